@@ -1,18 +1,32 @@
 """The heatmiser_edge component."""
 from __future__ import annotations
 
+import asyncio
 import logging
+import uuid
+from datetime import timedelta
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant, ServiceCall
-from homeassistant.const import Platform, CONF_HOST, CONF_PORT
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse, callback
+from homeassistant.const import Platform, CONF_HOST, CONF_PORT, EVENT_HOMEASSISTANT_STOP
 import voluptuous as vol
-from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers import device_registry as dr, entity_registry as er
 # from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.entity import DeviceInfo
-from homeassistant.exceptions import ServiceValidationError
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+from homeassistant.exceptions import ConfigEntryNotReady, ServiceValidationError
 
+from .capabilities import BlockSizes
+from .broadcast import async_set_operation_mode
 from .const import *
+from .heat_demand import get_heat_demand
 from .heatmiser_edge import *
+from .hub import HeatmiserEdgeHub
+from .poller import RegisterStorePoller
+from .runtime import RelayRuntime
+from .snapshot import Snapshot
+from .write_queue import WriteQueue
 
 # List of platforms to support. There should be a matching .py file for each,
 # eg <cover.py> and <sensor.py>
@@ -29,39 +43,62 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     
     # TODO: Add service to force register to be refreshed
     # TODO: Add service to bulk write to multiple registers at once
+
+    await _async_merge_channel_entries(hass)
+
+    schedule_template_store = Store(hass, SCHEDULE_TEMPLATE_STORAGE_VERSION, SCHEDULE_TEMPLATE_STORAGE_KEY)
+    schedule_templates = None
+
+    async def _async_get_schedule_templates() -> dict:
+        """Load the saved schedule templates (only read from disk the first time)."""
+        nonlocal schedule_templates
+        if schedule_templates is None:
+            schedule_templates = await schedule_template_store.async_load() or {}
+        return schedule_templates
+
+    snapshot_store = Store(hass, SNAPSHOT_STORAGE_VERSION, SNAPSHOT_STORAGE_KEY)
+    snapshots = None
+
+    async def _async_get_snapshots() -> dict:
+        """Load the saved snapshots, keyed by device id then snapshot id (only read from disk the first time)."""
+        nonlocal snapshots
+        if snapshots is None:
+            snapshots = await snapshot_store.async_load() or {}
+        return snapshots
+
+    def _get_device_ids(call: ServiceCall) -> list:
+        """The device ids a service call targets (one or a list), raising a helpful error if there aren't any."""
+        device_ids = call.data.get("device")
+        if isinstance(device_ids, str):
+            device_ids = [device_ids]
+        if not device_ids:
+            raise ServiceValidationError("No device specified")
+        return device_ids
+
+    def _get_register_store(device_id: str) -> heatmiser_edge_register_store:
+        """Find the register store for a device, raising a helpful error if there isn't one."""
+        device_registry = dr.async_get(hass)
+        device_entry = device_registry.async_get(device_id)
+        if not device_entry:
+            raise ServiceValidationError(f"Device {device_id} not found")
+
+        # Find the gateway (config entry) for this device, then the device's channel on it
+        config_entry_id = next(iter(device_entry.config_entries))
+        hub = hass.data.get(DOMAIN, {}).get(config_entry_id)
+        register_store = hub.store_for_device(device_entry.identifiers) if hub else None
+
+        if not register_store:
+            raise ServiceValidationError(f"Device {device_id} is not a Heatmiser Edge device")
+        return register_store
     
     async def write_register(call: ServiceCall) -> None:
         """Handle the service call to write a register."""
         _LOGGER.debug(f"[DEBUG] write_register service called with data: {call.data}")
-        # if not call.target:
-        #     raise ValueError("No target device specified")
-            
-        device_registry = dr.async_get(hass)
-        
-        # Handle both device_id and device formats
-        # device_ids = []
-        # if "device_id" in call.target:
-        #     device_ids.append(call.target["device_id"])
-        # elif "device" in call.target:
-        #     device_ids.extend(call.target["device"])
-        
-        device_ids = call.data.get("device")
-        if isinstance(device_ids, str):
-            device_ids = [device_ids]
-        
-        for device_id in device_ids:
+
+        for device_id in _get_device_ids(call):
             _LOGGER.debug(f"[DEBUG] Processing device_id: {device_id}")
             
-            device_entry = device_registry.async_get(device_id)
-            if not device_entry:
-                raise ServiceValidationError(f"Device {device_id} not found")
-                
-            # Find the config entry for this device
-            config_entry_id = next(iter(device_entry.config_entries))
-            register_store = hass.data[DOMAIN].get(config_entry_id)
-            
-            if not register_store:
-                raise ServiceValidationError(f"Device {device_id} is not a Heatmiser Edge device")
+            register_store = _get_register_store(device_id)
             
             register = call.data.get("register")
             if register < 50 or register > 217:
@@ -78,28 +115,11 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     async def write_register_range(call: ServiceCall) -> None:
         """Handle the service call to write a range of registers."""
         _LOGGER.debug(f"[DEBUG] write_register_range service called with data: {call.data}")
-        # if not call.target:
-        #     raise ValueError("No target device specified")
-            
-        device_registry = dr.async_get(hass)
-        
-        device_ids = call.data.get("device")
-        if isinstance(device_ids, str):
-            device_ids = [device_ids]
-        
-        for device_id in device_ids:
+
+        for device_id in _get_device_ids(call):
             _LOGGER.debug(f"[DEBUG] Processing device_id: {device_id}")
             
-            device_entry = device_registry.async_get(device_id)
-            if not device_entry:
-                raise ServiceValidationError(f"Device {device_id} not found")
-                
-            # Find the config entry for this device
-            config_entry_id = next(iter(device_entry.config_entries))
-            register_store = hass.data[DOMAIN].get(config_entry_id)
-            
-            if not register_store:
-                raise ServiceValidationError(f"Device {device_id} is not a Heatmiser Edge device")
+            register_store = _get_register_store(device_id)
             
             start_register = call.data.get("register")
             if start_register < 50 or start_register > 217:
@@ -123,25 +143,11 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     async def boost_thermostat_heating(call: ServiceCall) -> None:
         """Handle the service call to temporarily boost thermostat heating."""
         _LOGGER.debug(f"[DEBUG] boost_thermostat_heating service called with data: {call.data}")
-        
-        device_registry = dr.async_get(hass)
-        device_ids = call.data.get("device")
-        if isinstance(device_ids, str):
-            device_ids = [device_ids]
-        
-        for device_id in device_ids:
+
+        for device_id in _get_device_ids(call):
             _LOGGER.debug(f"[DEBUG] Processing device_id: {device_id}")
             
-            device_entry = device_registry.async_get(device_id)
-            if not device_entry:
-                raise ServiceValidationError(f"Device {device_id} not found")
-                
-            # Find the config entry for this device
-            config_entry_id = next(iter(device_entry.config_entries))
-            register_store = hass.data[DOMAIN].get(config_entry_id)
-            
-            if not register_store:
-                raise ServiceValidationError(f"Device {device_id} is not a Heatmiser Edge device")
+            register_store = _get_register_store(device_id)
             
             if register_store.device_type != DEVICE_TYPE_THERMOSTAT:
                 raise ServiceValidationError(f"Device {device_id} is not a thermostat")
@@ -165,31 +171,16 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
                 # Step 1: Sync time to device
                 await register_store.async_update_device_time()
                 
-                # Step 2: Update hold time register (HOLDTIME_HOUR_MIN)
-                # High 8 bits = hours, low 8 bits = minutes
-                hold_time_value = (duration_hours << 8) | duration_minutes
-                await register_store.write_register(
-                    int(ThermostatRegisterAddresses.HOLDTIME_HOUR_MIN),
-                    hold_time_value,
-                    refresh_values_after_writing=False
-                )
-                
-                # Step 3: Update hold set temperature register
+                # Step 2: Write hold time, hold temperature and Hold mode in one transaction
+                # Hold time: high 8 bits = hours, low 8 bits = minutes
                 # Temperature is scaled by factor of 10 (20°C = 200)
-                temp_register_value = int(temperature * 10)
-                await register_store.write_register(
-                    int(ThermostatRegisterAddresses.HOLD_SET_TEMPERATURE),
-                    temp_register_value,
-                    refresh_values_after_writing=False
-                )
-                
-                # Step 4: Change operation mode to Hold
                 # "Hold" is at index 2 in PRESET_MODES
-                await register_store.write_register(
-                    int(ThermostatRegisterAddresses.CURRENT_OPERATION_MODE),
-                    2,  # Hold mode
-                    refresh_values_after_writing=True
-                )
+                hold_time_value = (duration_hours << 8) | duration_minutes
+                await register_store.async_write_operation_block({
+                    int(ThermostatRegisterAddresses.HOLDTIME_HOUR_MIN): hold_time_value,
+                    int(ThermostatRegisterAddresses.HOLD_SET_TEMPERATURE): int(temperature * 10),
+                    int(ThermostatRegisterAddresses.CURRENT_OPERATION_MODE): PRESET_MODES.index("Hold"),
+                })
             except Exception as ex:
                 _LOGGER.error(f"Error boosting thermostat: {ex}")
                 raise
@@ -197,25 +188,11 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     async def boost_timer_output(call: ServiceCall) -> None:
         """Handle the service call to temporarily boost timer output."""
         _LOGGER.debug(f"[DEBUG] boost_timer_output service called with data: {call.data}")
-        
-        device_registry = dr.async_get(hass)
-        device_ids = call.data.get("device")
-        if isinstance(device_ids, str):
-            device_ids = [device_ids]
-        
-        for device_id in device_ids:
+
+        for device_id in _get_device_ids(call):
             _LOGGER.debug(f"[DEBUG] Processing device_id: {device_id}")
             
-            device_entry = device_registry.async_get(device_id)
-            if not device_entry:
-                raise ServiceValidationError(f"Device {device_id} not found")
-                
-            # Find the config entry for this device
-            config_entry_id = next(iter(device_entry.config_entries))
-            register_store = hass.data[DOMAIN].get(config_entry_id)
-            
-            if not register_store:
-                raise ServiceValidationError(f"Device {device_id} is not a Heatmiser Edge device")
+            register_store = _get_register_store(device_id)
             
             if register_store.device_type != DEVICE_TYPE_TIMER:
                 raise ServiceValidationError(f"Device {device_id} is not a timer")
@@ -237,33 +214,209 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
                 # Step 1: Sync time to device
                 await register_store.async_update_device_time()
                 
-                # Step 2: Update hold time register (HOLDTIME_HOUR_MIN)
-                # High 8 bits = hours, low 8 bits = minutes
+                # Step 2: Write hold time, output state and Hold mode in one transaction
+                # Hold time: high 8 bits = hours, low 8 bits = minutes
+                # "Hold" is at index 2 in TIMER_OPERATION_MODES
                 hold_time_value = (duration_hours << 8) | duration_minutes
-                await register_store.write_register(
-                    int(TimerRegisterAddresses.HOLDTIME_HOUR_MIN),
-                    hold_time_value,
-                    refresh_values_after_writing=False
-                )
-                
-                # Step 3: Update timer out force register with boolean state
-                await register_store.write_register(
-                    int(TimerRegisterAddresses.TIMER_OUT_FORCE),
-                    1 if state else 0,
-                    refresh_values_after_writing=False
-                )
-                
-                # Step 4: Change operation mode to Hold
-                # "Hold" is at index 2 in PRESET_MODES
-                await register_store.write_register(
-                    int(TimerRegisterAddresses.CURRENT_OPERATION_MODE),
-                    2,  # Hold mode
-                    refresh_values_after_writing=True
-                )
+                await register_store.async_write_operation_block({
+                    int(TimerRegisterAddresses.HOLDTIME_HOUR_MIN): hold_time_value,
+                    int(TimerRegisterAddresses.TIMER_OUT_FORCE): 1 if state else 0,
+                    int(TimerRegisterAddresses.CURRENT_OPERATION_MODE): TIMER_OPERATION_MODES.index("Hold"),
+                })
             except Exception as ex:
                 _LOGGER.error(f"Error boosting timer: {ex}")
                 raise
 
+    async def set_away_mode(call: ServiceCall) -> None:
+        """Handle the service call to put a device into Away mode until a given date and time."""
+        _LOGGER.debug(f"[DEBUG] set_away_mode service called with data: {call.data}")
+
+        return_time = dt_util.parse_datetime(str(call.data.get("until")))
+        if return_time is None:
+            raise ServiceValidationError("Return date and time is not valid")
+        return_time = dt_util.as_local(return_time)
+        if return_time <= dt_util.now():
+            raise ServiceValidationError("Return date and time must be in the future")
+
+        for device_id in _get_device_ids(call):
+            _LOGGER.debug(f"[DEBUG] Processing device_id: {device_id}")
+            register_store = _get_register_store(device_id)
+            registers = RegisterAddresses[register_store.device_type]
+
+            _LOGGER.info(f"Setting device {device_id} to Away until {return_time}")
+
+            try:
+                await register_store.async_update_device_time()
+
+                # Away time: high 8 bits = hours/month, low 8 bits = minutes/day
+                # "Away" is at index 4 for both thermostats and timers
+                await register_store.async_write_operation_block({
+                    int(registers.AWAYTIME_HOUR_MIN): (return_time.hour << 8) | return_time.minute,
+                    int(registers.AWAYTIME_MONTH_DAY): (return_time.month << 8) | return_time.day,
+                    int(registers.AWAYTIME_YEAR): return_time.year,
+                    int(registers.CURRENT_OPERATION_MODE): PRESET_MODES.index("Away"),
+                })
+            except Exception as ex:
+                _LOGGER.error(f"Error setting away mode: {ex}")
+                raise
+
+    async def set_operation_mode(call: ServiceCall) -> ServiceResponse:
+        """Handle the service call to put several devices into the same operation mode at once."""
+        _LOGGER.debug(f"[DEBUG] set_operation_mode service called with data: {call.data}")
+
+        mode_name = call.data.get("mode")
+        if mode_name not in BROADCAST_OPERATION_MODES:
+            raise ServiceValidationError(f"Mode must be one of {', '.join(BROADCAST_OPERATION_MODES)}")
+        mode = PRESET_MODES.index(mode_name)
+
+        # Group the devices by gateway, so that each gateway can be sent one broadcast
+        gateways = {}
+        for device_id in _get_device_ids(call):
+            register_store = _get_register_store(device_id)
+            if register_store.device_type is None:
+                raise ServiceValidationError(f"Device {device_id} has not been read yet")
+            gateways.setdefault(register_store.gateway, []).append(register_store)
+
+        _LOGGER.info(f"Setting {sum(len(stores) for stores in gateways.values())} devices to {mode_name}")
+        results = await asyncio.gather(*(async_set_operation_mode(gateway, stores, mode) for gateway, stores in gateways.items()))
+
+        return {"gateways": {f"{gateway.host}:{gateway.port}": result for gateway, result in zip(gateways, results)}}
+
+    async def backup_registers(call: ServiceCall) -> ServiceResponse:
+        """Handle the service call to take a snapshot of every register on one or more devices."""
+        _LOGGER.debug(f"[DEBUG] backup_registers service called with data: {call.data}")
+
+        register_stores = {device_id: _get_register_store(device_id) for device_id in _get_device_ids(call)}
+        saved_snapshots = await _async_get_snapshots()
+
+        async def _backup(device_id: str, register_store: heatmiser_edge_register_store) -> dict:
+            # Use the cache if it's recent, otherwise read through the integration's own (gateway limited) connection
+            from_cache = await register_store.async_ensure_fresh(SNAPSHOT_MAX_CACHE_AGE)
+            snapshot = register_store.to_snapshot()
+            snapshot.extra["device_id"] = device_id
+            snapshot_id = uuid.uuid4().hex
+
+            device_snapshots = saved_snapshots.setdefault(device_id, {})
+            device_snapshots[snapshot_id] = snapshot.to_dict()
+            # Dicts keep insertion order, so the oldest snapshots are first
+            while len(device_snapshots) > SNAPSHOT_MAX_PER_DEVICE:
+                device_snapshots.pop(next(iter(device_snapshots)))
+
+            return {"snapshot_id": snapshot_id, "source": "cache" if from_cache else "device", **snapshot.to_dict()}
+
+        results = await asyncio.gather(*(_backup(device_id, register_store) for device_id, register_store in register_stores.items()))
+        await snapshot_store.async_save(saved_snapshots)
+
+        return {"snapshots": dict(zip(register_stores.keys(), results))}
+
+    async def restore_registers(call: ServiceCall) -> ServiceResponse:
+        """Handle the service call to restore a saved snapshot, only writing the registers that differ."""
+        _LOGGER.debug(f"[DEBUG] restore_registers service called with data: {call.data}")
+
+        snapshot_id = call.data.get("snapshot_id")
+        register_stores = {device_id: _get_register_store(device_id) for device_id in _get_device_ids(call)}
+        saved_snapshots = await _async_get_snapshots()
+
+        def _find_snapshot(device_id: str) -> Snapshot:
+            if snapshot_id:
+                for device_snapshots in saved_snapshots.values():
+                    if snapshot_id in device_snapshots:
+                        return Snapshot.from_dict(device_snapshots[snapshot_id])
+                raise ServiceValidationError(f"Snapshot {snapshot_id} not found")
+            device_snapshots = saved_snapshots.get(device_id)
+            if not device_snapshots:
+                raise ServiceValidationError(f"No snapshots saved for device {device_id}")
+            return Snapshot.from_dict(list(device_snapshots.values())[-1])
+
+        # Resolve the snapshots up front so that a mistake fails before anything is written
+        restores = {device_id: (register_store, _find_snapshot(device_id)) for device_id, register_store in register_stores.items()}
+
+        async def _restore(device_id: str, register_store: heatmiser_edge_register_store, snapshot: Snapshot) -> dict:
+            try:
+                return {"errors": [], **await register_store.async_restore_snapshot(snapshot)}
+            except Exception as ex:
+                _LOGGER.error(f"Error restoring registers to device {device_id}: {ex}")
+                return {"registers_changed": 0, "transactions": 0, "errors": [str(ex)]}
+
+        results = await asyncio.gather(*(_restore(device_id, *restore) for device_id, restore in restores.items()))
+
+        return {"devices": dict(zip(restores.keys(), results))}
+
+    async def save_schedule_template(call: ServiceCall) -> ServiceResponse:
+        """Handle the service call to save a device's schedule as a named template."""
+        _LOGGER.debug(f"[DEBUG] save_schedule_template service called with data: {call.data}")
+
+        name = call.data.get("name")
+        device_ids = _get_device_ids(call)
+        if len(device_ids) != 1:
+            raise ServiceValidationError("Exactly one device must be given to save a schedule template from")
+
+        register_store = _get_register_store(device_ids[0])
+        if register_store.device_type is None:
+            raise ServiceValidationError(f"Device {device_ids[0]} has not been read yet")
+
+        schedule_length = SCHEDULE_REGISTER_COUNT[register_store.device_type]
+        values = register_store.registers[SCHEDULE_START_REGISTER:SCHEDULE_START_REGISTER + schedule_length]
+        if None in values:
+            raise ServiceValidationError(f"Schedule for device {device_ids[0]} has not been read completely")
+
+        templates = await _async_get_schedule_templates()
+        templates[name] = {
+            "device_type": register_store.device_type,
+            "start_register": SCHEDULE_START_REGISTER,
+            "values": list(values),
+        }
+        await schedule_template_store.async_save(templates)
+
+        _LOGGER.info(f"Saved schedule template {name} from device {device_ids[0]}")
+        return {"name": name, **templates[name]}
+
+    async def delete_schedule_template(call: ServiceCall) -> None:
+        """Handle the service call to delete a named schedule template."""
+        _LOGGER.debug(f"[DEBUG] delete_schedule_template service called with data: {call.data}")
+
+        name = call.data.get("name")
+        templates = await _async_get_schedule_templates()
+        if name not in templates:
+            raise ServiceValidationError(f"Schedule template {name} not found")
+        templates.pop(name)
+        await schedule_template_store.async_save(templates)
+
+    async def apply_schedule_template(call: ServiceCall) -> ServiceResponse:
+        """Handle the service call to apply a named schedule template to several devices at once."""
+        _LOGGER.debug(f"[DEBUG] apply_schedule_template service called with data: {call.data}")
+
+        name = call.data.get("name")
+        templates = await _async_get_schedule_templates()
+        if name not in templates:
+            raise ServiceValidationError(f"Schedule template {name} not found")
+        template = templates[name]
+
+        refresh_values_after_writing = call.data.get("refresh_values_after_writing", False)
+
+        # Resolve all the devices up front so that a typo fails before anything is written
+        register_stores = {device_id: _get_register_store(device_id) for device_id in _get_device_ids(call)}
+
+        async def _apply(device_id: str, register_store: heatmiser_edge_register_store) -> dict:
+            summary = {"registers_changed": 0, "transactions": 0, "errors": []}
+            if register_store.device_type != template["device_type"]:
+                summary["errors"].append("Template was saved from a different type of device")
+                return summary
+            try:
+                summary.update(await register_store.async_apply_register_image(template["start_register"], template["values"]))
+                if refresh_values_after_writing and summary["transactions"]:
+                    await register_store.async_update()
+            except Exception as ex:
+                _LOGGER.error(f"Error applying schedule template {name} to device {device_id}: {ex}")
+                summary["errors"].append(str(ex))
+            return summary
+
+        # Devices on different gateways are written concurrently, the gateway limits how many
+        # devices on the same RS485 bus are written at once
+        results = await asyncio.gather(*(_apply(device_id, register_store) for device_id, register_store in register_stores.items()))
+
+        return {"template": name, "devices": dict(zip(register_stores.keys(), results))}
+
     # Register the service
     hass.services.async_register(
         DOMAIN,
@@ -301,43 +454,321 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
         boost_timer_output
     )
 
+    hass.services.async_register(
+        DOMAIN,
+        "set_away_mode",
+        set_away_mode
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        "set_operation_mode",
+        set_operation_mode,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        "backup_registers",
+        backup_registers,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        "restore_registers",
+        restore_registers,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        "save_schedule_template",
+        save_schedule_template,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        "delete_schedule_template",
+        delete_schedule_template
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        "apply_schedule_template",
+        apply_schedule_template,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
     # Return boolean to indicate that initialization was successful.
     return True
 
 
+async def _async_merge_channel_entries(hass: HomeAssistant) -> None:
+    """Merge the one entry per channel of older versions into one entry per gateway.
+
+    The first entry for each gateway is kept (along with its options) and the channels of the
+    others are added to it. Their devices and entities are moved across first, so names, areas
+    and history are kept, as are their queued writes and relay runtimes, then the other entries are removed.
+    """
+    entries = hass.config_entries.async_entries(DOMAIN)
+    if all(entry.version >= CONFIG_ENTRY_VERSION for entry in entries):
+        return
+    device_registry = dr.async_get(hass)
+    entity_registry = er.async_get(hass)
+
+    gateways = {}
+    for entry in entries:
+        gateways.setdefault((entry.data[CONF_HOST], int(entry.data[CONF_PORT])), []).append(entry)
+
+    for (host, port), gateway_entries in gateways.items():
+        channel_entries = [entry for entry in gateway_entries if entry.version < CONFIG_ENTRY_VERSION]
+        if not channel_entries:
+            continue
+        gateway_entry = next((entry for entry in gateway_entries if entry.version >= CONFIG_ENTRY_VERSION), channel_entries[0])
+        data = _gateway_entry_data(gateway_entry)
+        known_ids = {int(channel[CONF_MODBUS_ID]) for channel in data[CONF_CHANNELS]}
+        for entry in channel_entries:
+            if entry is gateway_entry:
+                continue
+            channel_data = _gateway_entry_data(entry)
+            data[CONF_CHANNELS] += [channel for channel in channel_data[CONF_CHANNELS] if int(channel[CONF_MODBUS_ID]) not in known_ids]
+            known_ids.update(int(channel[CONF_MODBUS_ID]) for channel in channel_data[CONF_CHANNELS])
+            data[CONF_BLOCK_SIZES] = {**channel_data[CONF_BLOCK_SIZES], **data[CONF_BLOCK_SIZES]}
+
+        _LOGGER.info(f"Merging {len(channel_entries)} Heatmiser Edge channel entries into one entry for {host}:{port}")
+        hass.config_entries.async_update_entry(
+            gateway_entry, title=_gateway_entry_title(data), data=data, unique_id=f"{host}:{port}", version=CONFIG_ENTRY_VERSION
+        )
+        for entry in channel_entries:
+            if entry is gateway_entry:
+                continue
+            for device in dr.async_entries_for_config_entry(device_registry, entry.entry_id):
+                device_registry.async_update_device(device.id, add_config_entry_id=gateway_entry.entry_id, remove_config_entry_id=entry.entry_id)
+            for entity in er.async_entries_for_config_entry(entity_registry, entry.entry_id):
+                entity_registry.async_update_entity(entity.entity_id, config_entry_id=gateway_entry.entry_id)
+            await _async_move_channel_stores(hass, entry.entry_id, gateway_entry.entry_id)
+            await hass.config_entries.async_remove(entry.entry_id) # Also removes its stores, see async_remove_entry
+
+
+async def _async_move_channel_stores(hass: HomeAssistant, from_entry_id: str, to_entry_id: str) -> None:
+    """Add the queued writes and relay runtimes saved for one entry's channels to another entry's.
+
+    Both are keyed by slave id, and anything the other entry already has for a channel is kept.
+    """
+    for version, key in ((WRITE_QUEUE_STORAGE_VERSION, WRITE_QUEUE_STORAGE_KEY), (RUNTIME_STORAGE_VERSION, RUNTIME_STORAGE_KEY)):
+        moved = await Store(hass, version, f"{key}.{from_entry_id}").async_load()
+        if not moved:
+            continue
+        store = Store(hass, version, f"{key}.{to_entry_id}")
+        await store.async_save({**moved, **(await store.async_load() or {})})
+
+
+def _gateway_entry_data(entry: ConfigEntry) -> dict:
+    """An entry's data in the one entry per gateway form, converting it from one entry per channel if need be."""
+    if entry.version >= CONFIG_ENTRY_VERSION:
+        return {**entry.data, CONF_CHANNELS: list(entry.data[CONF_CHANNELS]), CONF_BLOCK_SIZES: dict(entry.data.get(CONF_BLOCK_SIZES, {}))}
+    return {
+        CONF_HOST: entry.data[CONF_HOST],
+        CONF_PORT: int(entry.data[CONF_PORT]),
+        "name": "Heatmiser Edge",
+        CONF_CHANNELS: [{CONF_MODBUS_ID: int(entry.data[CONF_MODBUS_ID]), "name": entry.data["name"]}],
+        CONF_BLOCK_SIZES: dict(entry.data.get(CONF_BLOCK_SIZES, {})),
+    }
+
+
+def _gateway_entry_title(data: dict) -> str:
+    return f"{data['name']} ({data[CONF_HOST]})"
+
+
+async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Convert a one entry per channel entry that async_setup didn't merge (it was the only one on its gateway)."""
+    if entry.version < CONFIG_ENTRY_VERSION:
+        data = _gateway_entry_data(entry)
+        hass.config_entries.async_update_entry(
+            entry, title=_gateway_entry_title(data), data=data, unique_id=f"{data[CONF_HOST]}:{data[CONF_PORT]}", version=CONFIG_ENTRY_VERSION
+        )
+    return True
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    """Set up heatmiser edge from a config entry."""
-    # Store an instance of the "connecting" class that does the work of speaking
-    # with your actual devices.
-    # hass.data.setdefault(DOMAIN, {})[entry.entry_id] = hub.Hub(hass, entry.data["host"])
+    """Set up a heatmiser edge gateway, and the channels behind it, from a config entry."""
+    # Create the register store for each channel that will hold the values read from the device
+    # NB these are initialised in heatmiser_edge.py
+    hub = HeatmiserEdgeHub(entry.data[CONF_HOST], entry.data[CONF_PORT], entry.data[CONF_CHANNELS])
+    for register_store in hub.stores.values():
+        register_store.pipeline_window = entry.options.get(CONF_PIPELINE_WINDOW, DEFAULT_PIPELINE_WINDOW)
+        register_store.use_broadcast = entry.options.get(CONF_USE_BROADCAST, DEFAULT_USE_BROADCAST)
+        register_store.gateway.set_broadcast(register_store, register_store.use_broadcast)
+
+    # Writes queued while a channel couldn't be reached, written once it can be (from the first update onwards)
+    write_queue_store = Store(hass, WRITE_QUEUE_STORAGE_VERSION, f"{WRITE_QUEUE_STORAGE_KEY}.{entry.entry_id}")
+    saved_write_queues = await write_queue_store.async_load() or {}
+
+    def _save_write_queues() -> None:
+        write_queue_store.async_delay_save(hub.write_queues, WRITE_QUEUE_SAVE_DELAY)
+
+    for slave_id, register_store in hub.stores.items():
+        register_store.write_queue = WriteQueue.from_dict(saved_write_queues.get(str(slave_id), {}))
+        register_store.on_write_queue_changed = _save_write_queues
+
+    # Relay runtime history, carried on from where it was left
+    runtime_store = Store(hass, RUNTIME_STORAGE_VERSION, f"{RUNTIME_STORAGE_KEY}.{entry.entry_id}")
+    saved_runtimes = await runtime_store.async_load() or {}
+    for slave_id, register_store in hub.stores.items():
+        if str(slave_id) in saved_runtimes:
+            register_store.relay_runtime = RelayRuntime.from_dict(saved_runtimes[str(slave_id)])
+
+    hass.data.setdefault(DOMAIN, {})[entry.entry_id] = hub
+
+    await hub.async_first_update() # Make sure values are all up to date in the register stores
+    if not any(hub.channels()):
+        hass.data[DOMAIN].pop(entry.entry_id)
+        hub.close()
+        raise ConfigEntryNotReady(f"Unable to read any channels on {entry.data['host']}")
+
+    # Block sizes not probed yet for a device's firmware are probed in the background after setup
+    await _async_load_block_sizes(hass)
+    to_probe = []
+
+    @callback
+    def _probe_block_sizes() -> None:
+        if to_probe:
+            entry.async_create_background_task(
+                hass, _async_probe_block_sizes(hass, entry, list(to_probe)), f"{DOMAIN} block sizes {entry.title}"
+            )
+            to_probe.clear()
+
+    async def _async_setup_channel(slave_id: int, name: str, register_store: heatmiser_edge_register_store) -> None:
+        """Set up a channel that has been read, now or when it first answers (see HeatmiserEdgeHub.on_channel_added)."""
+        if register_store.device_type == DEVICE_TYPE_THERMOSTAT:
+            # Thermostat - room temperature would be greater than 1
+            _LOGGER.debug(f"Detecting device {entry.data['host']} channel {slave_id} as being a thermostat")
+            get_heat_demand().add_zone(register_store, name)
+        else:
+            # Timer - thermostat on/off mode can only be 1 or 0
+            _LOGGER.debug(f"Detecting device {entry.data['host']} channel {slave_id} as being a timer")
+
+        if not _use_saved_block_sizes(hass, entry, register_store):
+            to_probe.append(register_store)
+
+        register_store.gateway.set_rate_limit(
+            register_store,
+            entry.options.get(CONF_GATEWAY_REQUESTS_PER_SECOND, DEFAULT_GATEWAY_REQUESTS_PER_SECOND),
+            entry.options.get(CONF_GATEWAY_BURST, DEFAULT_GATEWAY_BURST),
+        )
 
-    # Create the register store that will hold the values read from the device
-    # NB this is initialised in heatmiser_edge.py
-    register_store = heatmiser_edge_register_store(entry.data["host"],entry.data["port"],entry.data["modbus_id"])
+        # Keep the registers up to date from here on, rather than each entity polling
+        register_store.poller = RegisterStorePoller(
+            register_store,
+            min_interval=entry.options.get(CONF_MIN_POLL_INTERVAL, DEFAULT_MIN_POLL_INTERVAL),
+            max_interval=entry.options.get(CONF_MAX_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL),
+        )
 
-    hass.data.setdefault(DOMAIN, {})[entry.entry_id] = register_store
+    # Detect whether each channel is a thermostat or a timer
+    platforms = []
+    for slave_id, name, register_store in hub.channels():
+        await _async_setup_channel(slave_id, name, register_store)
+        device_platforms = PLATFORMS_THERMOSTAT if register_store.device_type == DEVICE_TYPE_THERMOSTAT else PLATFORMS_TIMER
+        platforms += [platform for platform in device_platforms if platform not in platforms]
+    if hub.failed:
+        # Either type of device could turn up later
+        platforms = PLATFORMS_ALL
 
-    await register_store.async_update() # Make sure values are all up to date in the register store
+    async def _async_add_channel(slave_id: int, name: str, register_store: heatmiser_edge_register_store) -> None:
+        await _async_setup_channel(slave_id, name, register_store)
+        _probe_block_sizes()
 
-    # This creates each HA object for each platform your device requires.
+    hub.on_channel_added = _async_add_channel
+
+    # This creates each HA object for each platform your devices require.
     # It's done by calling the `async_setup_entry` function in each platform module.
+    await hass.config_entries.async_forward_entry_setups(entry, platforms)
+
+    # Every channel is polled in turn from one loop, and any that couldn't be read are tried again
+    hub.start(lambda coro: entry.async_create_background_task(hass, coro, f"{DOMAIN} poller {entry.title}"))
+    entry.async_on_unload(entry.add_update_listener(_async_options_updated))
+    _probe_block_sizes()
+
+    @callback
+    def _save_runtimes(_) -> None:
+        runtime_store.async_delay_save(hub.relay_runtimes)
+
+    entry.async_on_unload(async_track_time_interval(hass, _save_runtimes, timedelta(seconds=RUNTIME_SAVE_INTERVAL)))
+
+    # Saved on stop too. Once stop has fired its listener is gone, so unloading mustn't remove it again
+    @callback
+    def _save_runtimes_on_stop(event) -> None:
+        nonlocal remove_stop_listener
+        remove_stop_listener = None
+        _save_runtimes(event)
+
+    remove_stop_listener = hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _save_runtimes_on_stop)
+
+    @callback
+    def _remove_stop_listener() -> None:
+        if remove_stop_listener is not None:
+            remove_stop_listener()
+
+    entry.async_on_unload(_remove_stop_listener)
+
+    return True
+
 
-    # Detect whether a thermostat or a timer
-    if register_store.device_type == DEVICE_TYPE_THERMOSTAT:
-        # Thermostat - room temperature would be greater than 1
-        _LOGGER.debug(f"Detecting device {entry.data['host']} channel {entry.data['modbus_id']} as being a thermostat")
-        await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS_THERMOSTAT)
-    elif register_store.device_type == DEVICE_TYPE_TIMER:
-        # Timer - thermostat on/off mode can only be 1 or 0
-        _LOGGER.debug(f"Detecting device {entry.data['host']} channel {entry.data['modbus_id']} as being a timer")
-        await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS_TIMER)
-    else:
-        _LOGGER.error(f"Unable to detect device type for {entry.data['host']} channel {entry.data['modbus_id']}. Not loading any platforms")
+async def _async_load_block_sizes(hass: HomeAssistant) -> tuple[Store, dict]:
+    """The store of probed block sizes, shared by every entry, and what's in it ("host:port": firmware: sizes)."""
+    if BLOCK_SIZES_STORAGE_KEY not in hass.data:
+        store = Store(hass, BLOCK_SIZES_STORAGE_VERSION, BLOCK_SIZES_STORAGE_KEY)
+        saved = await store.async_load() or {}
+        # Another entry may have loaded it meanwhile
+        hass.data.setdefault(BLOCK_SIZES_STORAGE_KEY, (store, saved))
+    return hass.data[BLOCK_SIZES_STORAGE_KEY]
+
+
+def _use_saved_block_sizes(hass: HomeAssistant, entry: ConfigEntry, register_store: heatmiser_edge_register_store) -> bool:
+    """Use the block sizes already probed for the device's firmware on its gateway, if there are any."""
+    _, saved = hass.data[BLOCK_SIZES_STORAGE_KEY]
+    firmware = str(register_store.registers[int(ThermostatRegisterAddresses.CODE_VERSION_NUMBER_RD)])
+    block_sizes = saved.get(f"{entry.data['host']}:{entry.data['port']}", {}).get(firmware)
+    if block_sizes is None:
+        # Probed before they were kept in the store
+        block_sizes = entry.data.get(CONF_BLOCK_SIZES, {}).get(firmware)
+    if block_sizes is None:
         return False
-    
+    register_store.block_sizes = BlockSizes.from_dict(block_sizes)
     return True
 
 
+async def _async_probe_block_sizes(hass: HomeAssistant, entry: ConfigEntry, register_stores: list) -> None:
+    """Find the largest block sizes each device's firmware can handle, one device at a time.
+
+    Runs in the background once the entry is set up, with the default sizes used until it's done.
+    The result is saved per gateway and firmware version, so it's probed again after a firmware
+    update, and another device with the same firmware (on this entry or another) reuses it.
+    """
+    store, saved = hass.data[BLOCK_SIZES_STORAGE_KEY]
+    gateway = f"{entry.data['host']}:{entry.data['port']}"
+    for register_store in register_stores:
+        if _use_saved_block_sizes(hass, entry, register_store):
+            # An earlier device just probed the same firmware
+            continue
+        firmware = str(register_store.registers[int(ThermostatRegisterAddresses.CODE_VERSION_NUMBER_RD)])
+        _LOGGER.info(f"Probing block sizes for {entry.data['host']} channel {register_store._slave_id} (firmware {firmware})")
+        try:
+            probed = await register_store.async_probe_block_sizes()
+        except Exception as ex:
+            _LOGGER.warning(f"Unable to probe block sizes for {entry.data['host']} channel {register_store._slave_id}, using the defaults: {ex}")
+            continue
+        saved.setdefault(gateway, {})[firmware] = probed.to_dict()
+        await store.async_save(saved)
+
+
+async def _async_options_updated(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the entry so the new polling options (or channels) take effect."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     # This is called when an entry/configured device is to be removed. The class
@@ -350,6 +781,20 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS_ALL) # This is a bit of a hack, should ideally only unload the platforms used by a given entry
 
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        hub = hass.data[DOMAIN].pop(entry.entry_id)
+        heat_demand = get_heat_demand()
+        for register_store in hub.stores.values():
+            heat_demand.remove_zone(register_store)
+        heat_demand.release_sensor(entry.entry_id)
+        hub.close()
+        # Save now rather than after the delay, in case the entry is being reloaded and reads them straight back
+        await Store(hass, WRITE_QUEUE_STORAGE_VERSION, f"{WRITE_QUEUE_STORAGE_KEY}.{entry.entry_id}").async_save(hub.write_queues())
+        await Store(hass, RUNTIME_STORAGE_VERSION, f"{RUNTIME_STORAGE_KEY}.{entry.entry_id}").async_save(hub.relay_runtimes())
+
+    return unload_ok
+
 
-    return unload_ok
\ No newline at end of file
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Forget any writes still queued for the entry's channels, and their relay runtime history."""
+    await Store(hass, WRITE_QUEUE_STORAGE_VERSION, f"{WRITE_QUEUE_STORAGE_KEY}.{entry.entry_id}").async_remove()
+    await Store(hass, RUNTIME_STORAGE_VERSION, f"{RUNTIME_STORAGE_KEY}.{entry.entry_id}").async_remove()
@@ -41,12 +41,14 @@ async def async_setup_entry(
     async_add_entities: AddEntitiesCallback,
 ) -> None:
     """Add cover for passed config_entry in HA."""
-    register_store = hass.data[DOMAIN][config_entry.entry_id]
+    hub = hass.data[DOMAIN][config_entry.entry_id]
+    hub.add_platform(
+        None, lambda slave_id, name, register_store: _add_channel_entities(hub.host, hub.port, slave_id, name, register_store, async_add_entities)
+    )
 
-    host = config_entry.data["host"]
-    port = config_entry.data["port"]
-    slave_id = config_entry.data["modbus_id"]
-    name = config_entry.data["name"]
+
+def _add_channel_entities(host, port, slave_id, name, register_store: heatmiser_edge_register_store, async_add_entities: AddEntitiesCallback) -> None:
+    """Add the entities for one channel (device) on the gateway."""
 
     ReadableRegisters = []
 
@@ -0,0 +1,97 @@
+"""Write the same values to every device on a gateway with one Modbus broadcast.
+
+Setting the clock or changing the mode of every device on a bus one device at a time takes a
+transaction per device. On RS485, unit 0 is a broadcast address that every device obeys, so
+one write does the lot. Nothing answers a broadcast though, so each device is read back
+afterwards (a cheap read of just the affected registers) and written to directly if the
+broadcast didn't arrive.
+
+The register stores taking part are the gateway's broadcast_members. As a broadcast reaches
+every device on the bus, group mode changes are only broadcast when every store on the
+gateway allows it and every one of them is being changed.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict, List
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def device_time_values(current_time: time.struct_time) -> List[int]:
+    """The RTC registers (year, month/day, hour/minute, second) for current_time."""
+    return [
+        current_time.tm_year,
+        (current_time.tm_mon << 8) + current_time.tm_mday,
+        (current_time.tm_hour << 8) + current_time.tm_min,
+        current_time.tm_sec,
+    ]
+
+
+async def async_broadcast_device_time(gateway, owner: Any) -> Dict[str, int]:
+    """Set the clock and daylight saving flag on every device on the gateway, then confirm each member got it.
+
+    Members whose device didn't are set directly. Returns how many were confirmed and how many had to be written.
+    """
+    current_time = time.localtime()
+    _LOGGER.info("Broadcasting time %s to every device on %s:%s", time.strftime("%Y-%m-%d %H:%M:%S", current_time), gateway.host, gateway.port)
+    await gateway.async_broadcast(owner, DAYLIGHT_SAVING_REGISTER, [int(current_time.tm_isdst)])
+    await gateway.async_broadcast(owner, RTC_START_REGISTER, device_time_values(current_time))
+
+    summary = {"confirmed": 0, "written": 0}
+    for store in gateway.broadcast_members | {owner}:
+        if store.device_type is None or not store.sync_device_time:
+            continue
+        try:
+            if await store.async_confirm_device_time(current_time):
+                summary["confirmed"] += 1
+                store.schedule_next_time_update()
+                continue
+            _LOGGER.debug("Time broadcast didn't reach device %s at %s, setting it directly", store._slave_id, store._host)
+            await store.async_write_device_time()
+            summary["written"] += 1
+        except Exception as ex:
+            _LOGGER.warning("Unable to set the time on device %s at %s: %s", store._slave_id, store._host, ex)
+    return summary
+
+
+async def async_set_operation_mode(gateway, stores: List[Any], mode: int) -> Dict[str, Any]:
+    """Put every store's device (all on gateway) into operation mode.
+
+    Broadcast if every store on the gateway allows it and is in stores, otherwise each device is
+    written to directly. Returns whether it was broadcast, how many devices were confirmed or
+    written directly, and any errors.
+    """
+    summary = {"broadcast": False, "confirmed": 0, "written": 0, "errors": []}
+    remaining = list(stores)
+    if gateway.broadcast_covers_bus and set(stores) == gateway.broadcast_members:
+        await gateway.async_broadcast(stores[0], OPERATION_BLOCK_START, [mode])
+        summary["broadcast"] = True
+        remaining = []
+        for store in stores:
+            readback_start, readback_count = OPERATION_BLOCK_READBACK[store.device_type]
+            try:
+                await store.async_read_registers(readback_start, readback_count)
+            except Exception as ex:
+                _LOGGER.debug("Unable to read back device %s at %s: %s", store._slave_id, store._host, ex)
+                remaining.append(store)
+                continue
+            if store.registers[int(RegisterAddresses[store.device_type].CURRENT_OPERATION_MODE_RD)] == mode:
+                # Through the cache's setter, so register listeners (e.g. the heat demand) hear of it
+                store._set_registers(OPERATION_BLOCK_START, [mode])
+                store._notify_update_listeners()
+                summary["confirmed"] += 1
+            else:
+                remaining.append(store)
+
+    for store in remaining:
+        try:
+            await store.async_write_operation_block({OPERATION_BLOCK_START: mode})
+            summary["written"] += 1
+        except Exception as ex:
+            _LOGGER.error(f"Error setting operation mode on device {store._slave_id} at {store._host}: {ex}")
+            summary["errors"].append(str(ex))
+    return summary
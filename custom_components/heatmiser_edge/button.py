@@ -40,12 +40,14 @@ async def async_setup_entry(
     async_add_entities: AddEntitiesCallback,
 ) -> None:
     """Add cover for passed config_entry in HA."""
-    register_store = hass.data[DOMAIN][config_entry.entry_id]
+    hub = hass.data[DOMAIN][config_entry.entry_id]
+    hub.add_platform(
+        DEVICE_TYPE_THERMOSTAT, lambda slave_id, name, register_store: _add_channel_entities(hub.host, hub.port, slave_id, name, register_store, async_add_entities)
+    )
 
-    host = config_entry.data["host"]
-    port = config_entry.data["port"]
-    slave_id = config_entry.data["modbus_id"]
-    name = config_entry.data["name"]
+
+def _add_channel_entities(host, port, slave_id, name, register_store: heatmiser_edge_register_store, async_add_entities: AddEntitiesCallback) -> None:
+    """Add the entities for one channel (device) on the gateway."""
 
     # register_id = int(ThermostatRegisterAddresses.THERMOSTAT_ON_OFF_MODE)
 
@@ -123,9 +125,4 @@ class HeatmiserEdgeClearTimePeriodButton(ButtonEntity):
     async def async_press(self) -> None:
         """Update the current value."""
         _LOGGER.warning("Attempting to clear time period")
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(self._register_id, value=int(24) , device_id=self._slave_id)
-        client.close()
-
-        self.register_store.registers[self._register_id] = int(24)
\ No newline at end of file
+        await self.register_store.write_register(self._register_id, 24, refresh_values_after_writing=False)
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Find the largest block of registers a device (and the gateway in front of it) can read or write at once.
+
+The protocol document doesn't say, and 10 is known to work everywhere, but newer firmware
+or better gateways can manage far more, which cuts the number of transactions in a poll.
+
+The probe is given two coroutines to talk to the device, so it works with the register
+store or with a bare pymodbus client in the tools:
+
+    read_block(start, count) -> list of values, or None if the read failed
+    write_block(start, values) -> True if the write succeeded
+
+Writes are probed by writing back the schedule registers' current values, so the device
+is left exactly as it was.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from .const import (
+    MAX_REGISTER_READ_COUNT,
+    MAX_REGISTER_WRITE_COUNT,
+    MODBUS_MAX_READ_COUNT,
+    MODBUS_MAX_WRITE_COUNT,
+    REGISTER_COUNT,
+    SCHEDULE_REGISTER_COUNT,
+    SCHEDULE_START_REGISTER,
+)
+from .register_blocks import plan_register_reads
+
+ReadBlock = Callable[[int, int], Awaitable[Optional[List[int]]]]
+WriteBlock = Callable[[int, List[int]], Awaitable[bool]]
+
+
+@dataclass
+class BlockSizes:
+    read: int = MAX_REGISTER_READ_COUNT
+    write: int = MAX_REGISTER_WRITE_COUNT
+
+    def to_dict(self) -> dict:
+        return {"read": self.read, "write": self.write}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BlockSizes":
+        return cls(int(data.get("read", MAX_REGISTER_READ_COUNT)), int(data.get("write", MAX_REGISTER_WRITE_COUNT)))
+
+
+async def _largest_working(works: Callable[[int], Awaitable[bool]], known_good: int, upper: int) -> int:
+    """Binary search for the largest count between known_good and upper that works."""
+    low, high = known_good, upper
+    while low < high:
+        middle = (low + high + 1) // 2
+        if await works(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+async def async_probe_read_count(read_block: ReadBlock, upper: int = MODBUS_MAX_READ_COUNT) -> int:
+    """The largest number of registers that can be read at once (never less than the default)."""
+    upper = min(upper, REGISTER_COUNT)
+
+    async def works(count: int) -> bool:
+        values = await read_block(0, count)
+        return values is not None and len(values) == count
+
+    return await _largest_working(works, MAX_REGISTER_READ_COUNT, upper)
+
+
+async def async_probe_write_count(read_block: ReadBlock, write_block: WriteBlock, device_type: int,
+                                  read_count: int = MAX_REGISTER_READ_COUNT, upper: int = MODBUS_MAX_WRITE_COUNT) -> int:
+    """The largest number of registers that can be written at once (never less than the default).
+
+    Each attempt writes the schedule registers back with the values they already have.
+    """
+    start = SCHEDULE_START_REGISTER
+    upper = min(upper, SCHEDULE_REGISTER_COUNT[device_type])
+
+    async def works(count: int) -> bool:
+        # Read the current values just before writing them back, so nothing changed on the device is undone
+        values: List[int] = []
+        for block_start, block_count in plan_register_reads(start, start + count - 1, read_count):
+            block = await read_block(block_start, block_count)
+            if block is None or len(block) != block_count:
+                return False
+            values.extend(block)
+        return await write_block(start, values)
+
+    return await _largest_working(works, MAX_REGISTER_WRITE_COUNT, upper)
+
+
+async def async_probe_block_sizes(read_block: ReadBlock, write_block: WriteBlock, device_type: int) -> BlockSizes:
+    read = await async_probe_read_count(read_block)
+    write = await async_probe_write_count(read_block, write_block, device_type, read)
+    return BlockSizes(read, write)
@@ -44,12 +44,14 @@ async def async_setup_entry(
     """Add cover for passed config_entry in HA."""
     # The hub is loaded from the associated hass.data entry that was created in the
     # __init__.async_setup_entry function
-    register_store = hass.data[DOMAIN][config_entry.entry_id]
+    hub = hass.data[DOMAIN][config_entry.entry_id]
+    hub.add_platform(
+        DEVICE_TYPE_THERMOSTAT, lambda slave_id, name, register_store: _add_channel_entities(hub.host, hub.port, slave_id, name, register_store, async_add_entities)
+    )
+
 
-    host = config_entry.data["host"]
-    port = config_entry.data["port"]
-    slave_id = config_entry.data["modbus_id"]
-    name = config_entry.data["name"]
+def _add_channel_entities(host, port, slave_id, name, register_store: heatmiser_edge_register_store, async_add_entities: AddEntitiesCallback) -> None:
+    """Add the entities for one channel (device) on the gateway."""
 
     thermostat = HeatmiserEdgeThermostat(host, port, slave_id, name, register_store)
 
@@ -70,6 +72,7 @@ class HeatmiserEdgeThermostat(ClimateEntity):
         | ClimateEntityFeature.TURN_OFF
         | ClimateEntityFeature.TURN_ON
     )
+    _attr_should_poll = False  # The register store's poller keeps the registers up to date
 
     def __init__(self, host, port, slave_id, name, register_store: heatmiser_edge_register_store):
         """Initialize the thermostat."""
@@ -143,38 +146,35 @@ class HeatmiserEdgeThermostat(ClimateEntity):
 
     async def async_turn_on(self):
         """Turn the entity on."""
-        self._attr_hvac_mode = HVACMode.HEAT
+        await self.async_set_hvac_mode(HVACMode.HEAT)
 
 
     async def async_turn_off(self):
         """Turn the entity off."""
-        self._attr_hvac_mode = HVACMode.Off
+        await self.async_set_hvac_mode(HVACMode.OFF)
 
     async def async_set_hvac_mode(self,hvac_mode):
-        # Do nothing
         match hvac_mode:
             case HVACMode.OFF:
                 OnOffValue = 0
             case _:
                 OnOffValue = 1
-                
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(int(ThermostatRegisterAddresses.THERMOSTAT_ON_OFF_MODE), value=OnOffValue , device_id=self._slave_id)
-        client.close()
 
-        self._hvac_mode = hvac_mode
+        # Shown straight away, then written and confirmed in the background (showing the device's value again if it disagrees)
+        self.register_store.write_registers_debounced(
+            {int(ThermostatRegisterAddresses.THERMOSTAT_ON_OFF_MODE): OnOffValue},
+            shown={int(ThermostatRegisterAddresses.THERMOSTAT_ON_OFF_MODE_RD): OnOffValue},
+            delay=0,
+        )
 
     async def async_set_preset_mode(self, preset_mode):
         """Set new target preset mode."""
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(int(ThermostatRegisterAddresses.CURRENT_OPERATION_MODE), value=int(PRESET_MODES.index(preset_mode)), device_id=self._slave_id)
-        client.close()
-
-        self._preset_mode = preset_mode
-
-        await self.async_update() # Force an update
+        # Shown straight away, then written and confirmed in the background (showing the device's value again if it disagrees)
+        self.register_store.write_registers_debounced(
+            {int(ThermostatRegisterAddresses.CURRENT_OPERATION_MODE): PRESET_MODES.index(preset_mode)},
+            shown={int(ThermostatRegisterAddresses.CURRENT_OPERATION_MODE_RD): PRESET_MODES.index(preset_mode)},
+            delay=0,
+        )
 
 
     async def async_set_temperature(self, **kwargs: Any) -> None:
@@ -185,16 +185,32 @@ class HeatmiserEdgeThermostat(ClimateEntity):
         # When setting temperature, we need to enter preset mode Override
         # This changes the temp until the next scheduled period (same as on device)
 
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(int(ThermostatRegisterAddresses.CURRENT_OPERATION_MODE), value=int(PRESET_MODES.index("Override")) , device_id=self._slave_id)
-        await client.write_register(int(ThermostatRegisterAddresses.HOLD_SET_TEMPERATURE), value=int(temperature)*10, device_id=self._slave_id)
-        await client.write_register(int(ThermostatRegisterAddresses.ADVANCED_SET_TEMPERATURE), value=int(temperature)*10, device_id=self._slave_id)
-        client.close()
-
-        self._target_temperature = int(temperature)
-
-        await self.async_update() # Force an update
+        # Operation mode, hold and advanced set temperatures are contiguous (32 to 34) so go in one write,
+        # as a transaction so the device isn't left in Override with the old temperature.
+        # Debounced, so dragging the setpoint only writes where it ends up. The new setpoint and mode are
+        # shown straight away, and just the registers they affect read back once written
+        self.register_store.write_registers_debounced(
+            {
+                int(ThermostatRegisterAddresses.CURRENT_OPERATION_MODE): PRESET_MODES.index("Override"),
+                int(ThermostatRegisterAddresses.HOLD_SET_TEMPERATURE): round(temperature*10),
+                int(ThermostatRegisterAddresses.ADVANCED_SET_TEMPERATURE): round(temperature*10),
+            },
+            shown={
+                int(ThermostatRegisterAddresses.CURRENT_SETTING_TEMPERATURE_RD): round(temperature*10),
+                int(ThermostatRegisterAddresses.CURRENT_OPERATION_MODE_RD): PRESET_MODES.index("Override"),
+            },
+        )
 
     async def async_update(self) -> None:
-        await self.register_store.async_update()
\ No newline at end of file
+        await self.register_store.async_update()
+
+    async def async_added_to_hass(self) -> None:
+        """Register for updates from the register store when entity is added."""
+        self._remove_listener = self.register_store.add_update_listener(self.async_write_ha_state)
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Unregister update listener when entity is removed."""
+        remove = getattr(self, "_remove_listener", None)
+        if remove is not None:
+            remove()
+            self._remove_listener = None
\ No newline at end of file
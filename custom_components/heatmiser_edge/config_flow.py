@@ -7,15 +7,35 @@ from typing import Any
 import voluptuous as vol
 
 from homeassistant import config_entries, exceptions
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 
 from homeassistant.helpers import (
     config_validation as cv,
     device_registry as dr,
 )
 
-from .const import DOMAIN  # pylint:disable=unused-import
-# from .hub import Hub
+from .const import (  # pylint:disable=unused-import
+    CONF_CHANNELS,
+    CONF_GATEWAY_BURST,
+    CONF_GATEWAY_REQUESTS_PER_SECOND,
+    CONF_MAX_POLL_INTERVAL,
+    CONF_MIN_POLL_INTERVAL,
+    CONF_MODBUS_ID,
+    CONF_PIPELINE_WINDOW,
+    CONF_UNIT_IDS,
+    CONF_USE_BROADCAST,
+    CONFIG_ENTRY_VERSION,
+    DEFAULT_GATEWAY_BURST,
+    DEFAULT_GATEWAY_REQUESTS_PER_SECOND,
+    DEFAULT_MAX_POLL_INTERVAL,
+    DEFAULT_MIN_POLL_INTERVAL,
+    DEFAULT_PIPELINE_WINDOW,
+    DEFAULT_UNIT_IDS,
+    DEFAULT_USE_BROADCAST,
+    DOMAIN,
+    MAX_PIPELINE_WINDOW,
+)
+from .hub import async_discover_units, parse_unit_ids
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -34,8 +54,8 @@ DATA_SCHEMA = vol.Schema(
     {
         vol.Required("host", default=''): cv.string,
         vol.Required("port", default=502): cv.port,
-        vol.Required("modbus_id", default=1): cv.port,
         vol.Required("name", default=''): str,
+        vol.Required(CONF_UNIT_IDS, default=DEFAULT_UNIT_IDS): cv.string,
     }
 )
 
@@ -54,15 +74,18 @@ async def validate_input(hass: HomeAssistant, data: dict) -> dict[str, Any]:
     # `async_step_user` method below.
     if len(data["host"]) < 3:
         raise InvalidHost
-
-    # hub = Hub(hass, data["host"])
-    # # The dummy hub provides a `test_connection` method to ensure it's working
-    # # as expected
-    # result = await hub.test_connection()
-    # if not result:
-    #     # If there is an error, raise an exception to notify HA that there was a
-    #     # problem. The UI will also show there was a problem
-    #     raise CannotConnect
+    try:
+        unit_ids = parse_unit_ids(data[CONF_UNIT_IDS])
+    except ValueError as ex:
+        raise InvalidUnitIds from ex
+
+    # Look for a device at each unit ID behind the gateway
+    try:
+        found = await async_discover_units(data["host"], data["port"], unit_ids)
+    except ConnectionError as ex:
+        raise CannotConnect from ex
+    if not found:
+        raise NoDevicesFound
 
     # If your PyPI package is not built with async, pass your methods
     # to the executor:
@@ -79,13 +102,21 @@ async def validate_input(hass: HomeAssistant, data: dict) -> dict[str, Any]:
     # "Title" is what is displayed to the user for this hub device
     # It is stored internally in HA as part of the device config.
     # See `async_step_user` below for how this is used
-    return {"title": f"{data['name']} ({data['host']}, id: {data['modbus_id']})"}
+    return {
+        "title": f"{data['name']} ({data['host']})",
+        "data": {
+            "host": data["host"],
+            "port": data["port"],
+            "name": data["name"],
+            CONF_CHANNELS: [{CONF_MODBUS_ID: unit_id, "name": f"{data['name']} {unit_id}"} for unit_id in found],
+        },
+    }
 
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for Hello World."""
 
-    VERSION = 1
+    VERSION = CONFIG_ENTRY_VERSION
     # Pick one of the available connection classes in homeassistant/config_entries.py
     # This tells HA if it should be asking for updates, or it'll be notified of updates
     # automatically. This example uses PUSH, as the dummy hub will notify HA of
@@ -104,10 +135,12 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         if user_input is not None:
             try:
                 info = await validate_input(self.hass, user_input)
-
-                return self.async_create_entry(title=info["title"], data=user_input)
             except CannotConnect:
                 errors["base"] = "cannot_connect"
+            except NoDevicesFound:
+                errors["base"] = "no_devices_found"
+            except InvalidUnitIds:
+                errors[CONF_UNIT_IDS] = "invalid_unit_ids"
             except InvalidHost:
                 # The error string is set here, and should be translated.
                 # This example does not currently cover translations, see the
@@ -117,16 +150,71 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             except Exception:  # pylint: disable=broad-except
                 _LOGGER.exception("Unexpected exception")
                 errors["base"] = "unknown"
+            else:
+                # One entry per gateway: devices found on a gateway that's already set up are added to its entry
+                await self.async_set_unique_id(f"{user_input['host']}:{user_input['port']}")
+                entry = next((entry for entry in self._async_current_entries() if entry.unique_id == self.unique_id), None)
+                if entry is None:
+                    return self.async_create_entry(title=info["title"], data=info["data"])
+                known_ids = {int(channel[CONF_MODBUS_ID]) for channel in entry.data[CONF_CHANNELS]}
+                new_channels = [channel for channel in info["data"][CONF_CHANNELS] if channel[CONF_MODBUS_ID] not in known_ids]
+                if not new_channels:
+                    return self.async_abort(reason="already_configured")
+                # Updating the data reloads the entry, which sets up the new channels
+                self.hass.config_entries.async_update_entry(entry, data={**entry.data, CONF_CHANNELS: [*entry.data[CONF_CHANNELS], *new_channels]})
+                return self.async_abort(reason="channels_added")
 
         # If there is no user input or there were errors, show the form again, including any errors that were found with the input.
         return self.async_show_form(
             step_id="user", data_schema=DATA_SCHEMA, errors=errors
         )
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry: config_entries.ConfigEntry) -> OptionsFlowHandler:
+        """Get the options flow for this handler."""
+        return OptionsFlowHandler()
+
+
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Polling and gateway options for a gateway and its devices."""
+
+    async def async_step_init(self, user_input=None):
+        errors = {}
+        if user_input is not None:
+            if user_input[CONF_MIN_POLL_INTERVAL] > user_input[CONF_MAX_POLL_INTERVAL]:
+                errors[CONF_MAX_POLL_INTERVAL] = "max_below_min"
+            else:
+                return self.async_create_entry(data=user_input)
+
+        options = self.config_entry.options
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(CONF_MIN_POLL_INTERVAL, default=options.get(CONF_MIN_POLL_INTERVAL, DEFAULT_MIN_POLL_INTERVAL)): vol.All(vol.Coerce(int), vol.Range(min=2, max=3600)),
+                    vol.Required(CONF_MAX_POLL_INTERVAL, default=options.get(CONF_MAX_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL)): vol.All(vol.Coerce(int), vol.Range(min=2, max=3600)),
+                    vol.Required(CONF_GATEWAY_REQUESTS_PER_SECOND, default=options.get(CONF_GATEWAY_REQUESTS_PER_SECOND, DEFAULT_GATEWAY_REQUESTS_PER_SECOND)): vol.All(vol.Coerce(float), vol.Range(min=0, max=1000)),
+                    vol.Required(CONF_GATEWAY_BURST, default=options.get(CONF_GATEWAY_BURST, DEFAULT_GATEWAY_BURST)): vol.All(vol.Coerce(int), vol.Range(min=1, max=1000)),
+                    vol.Required(CONF_PIPELINE_WINDOW, default=options.get(CONF_PIPELINE_WINDOW, DEFAULT_PIPELINE_WINDOW)): vol.All(vol.Coerce(int), vol.Range(min=0, max=MAX_PIPELINE_WINDOW)),
+                    vol.Required(CONF_USE_BROADCAST, default=options.get(CONF_USE_BROADCAST, DEFAULT_USE_BROADCAST)): bool,
+                }
+            ),
+            errors=errors,
+        )
+
 
 class CannotConnect(exceptions.HomeAssistantError):
     """Error to indicate we cannot connect."""
 
 
 class InvalidHost(exceptions.HomeAssistantError):
-    """Error to indicate there is an invalid hostname."""
\ No newline at end of file
+    """Error to indicate there is an invalid hostname."""
+
+
+class InvalidUnitIds(exceptions.HomeAssistantError):
+    """Error to indicate the unit IDs to look for couldn't be read."""
+
+
+class NoDevicesFound(exceptions.HomeAssistantError):
+    """Error to indicate nothing answered at any of the unit IDs."""
\ No newline at end of file
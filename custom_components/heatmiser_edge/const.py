@@ -2,6 +2,16 @@ from enum import IntEnum
 
 DOMAIN = "heatmiser_edge"
 
+# Config entries: one per gateway (version 2), listing the channels (unit IDs) behind it
+# Version 1 entries were one per channel, and are merged into one entry per gateway when loaded
+CONFIG_ENTRY_VERSION = 2
+CONF_MODBUS_ID = "modbus_id"
+CONF_CHANNELS = "channels"
+CONF_UNIT_IDS = "unit_ids"
+DEFAULT_UNIT_IDS = "1-16" # Unit IDs looked for when a gateway is added
+DISCOVERY_TIMEOUT = 1.0 # Seconds to wait for each unit ID to answer while looking for devices
+CHANNEL_RETRY_INTERVAL = 60 # Seconds between attempts to read channels that didn't answer when the entry was set up
+
 # Register addresses courtesy of EDGE-RS485-MODBUS-Communication-protocol-V1.8
 
 # NB Register addresses are offset by 1 from the documentation (i.e. doc 1 = digital 0)
@@ -79,6 +89,130 @@ RegisterAddresses = [ThermostatRegisterAddresses, TimerRegisterAddresses]
 
 SINGLE_REGISTER = 1
 
+REGISTER_COUNT = 218 # Registers 0 to 217
+
+# Seems like the most amount of registers we can read or write at a time is 10
+MAX_REGISTER_READ_COUNT = 10
+MAX_REGISTER_WRITE_COUNT = 10
+
+# Newer firmware and better gateways can manage more, so the largest working block sizes are
+# probed once per firmware version on each gateway (see capabilities.py) and saved under
+# BLOCK_SIZES_STORAGE_KEY, keyed by "host:port" then firmware. Entries set up before that kept
+# them in the entry data under CONF_BLOCK_SIZES, which is still read. These are the Modbus protocol's own limits
+MODBUS_MAX_READ_COUNT = 125
+MODBUS_MAX_WRITE_COUNT = 123
+CONF_BLOCK_SIZES = "block_sizes"
+BLOCK_SIZES_STORAGE_KEY = f"{DOMAIN}.block_sizes"
+BLOCK_SIZES_STORAGE_VERSION = 1
+
+# Status registers: the read-only values that change without anything being written
+# (temperatures, relay, current mode and schedule period). Polled far more often than the rest
+STATUS_BLOCK_START = 0
+STATUS_BLOCK_END = 19
+
+# Polling: status registers every interval, everything else every DEFAULT_FULL_POLL_EVERY intervals
+DEFAULT_POLL_INTERVAL = 30 # Seconds
+DEFAULT_FULL_POLL_EVERY = 10
+
+# Adaptive polling: after a poll that saw a change the interval drops to the minimum, after
+# ADAPTIVE_POLL_QUIET_POLLS polls with no change it grows by ADAPTIVE_POLL_BACKOFF per poll up to the maximum
+DEFAULT_MIN_POLL_INTERVAL = 10 # Seconds
+DEFAULT_MAX_POLL_INTERVAL = 300 # Seconds
+ADAPTIVE_POLL_BACKOFF = 1.5
+ADAPTIVE_POLL_QUIET_POLLS = 3
+SCHEDULE_TRANSITION_POLL_DELAY = 5 # Seconds after a schedule period starts to poll, giving the device time to act on it
+# Registers that count as a change: relay, temperatures, on/off, operation mode and schedule periods
+ADAPTIVE_POLL_WATCHED_REGISTERS = [(1, 2, 6, 7, 8, 9, 10), (1, 2, 3, 4, 8)] # Indexed by device type
+POLL_JITTER = 0.1 # Each delay between polls is randomly up to this fraction longer or shorter, so devices don't fall into step
+CONF_MIN_POLL_INTERVAL = "min_poll_interval"
+CONF_MAX_POLL_INTERVAL = "max_poll_interval"
+
+# Schedule area starts at the Sunday period 1 registers for both device types
+# Thermostat: 7 days x 6 periods x 4 registers (hour, minute, temp, reserved)
+# Timer: 7 days x 4 periods x 4 registers (on hour, on minute, off hour, off minute)
+SCHEDULE_START_REGISTER = 50
+SCHEDULE_REGISTER_COUNT = [168, 112] # Indexed by device type
+SCHEDULE_PERIODS_PER_DAY = 4 # Periods in use each day (the same ones shown as time entities)
+
+# Number of devices on the same gateway that can be talked to at once
+# RS485 is a shared bus so the gateways can only really handle one at a time
+DEFAULT_GATEWAY_CONCURRENCY = 1
+
+# Optional limit on requests per second sent to a gateway (0 for no limit), shared fairly between its devices
+# If devices on the same gateway are set differently, the strictest setting is used
+CONF_GATEWAY_REQUESTS_PER_SECOND = "gateway_requests_per_second"
+CONF_GATEWAY_BURST = "gateway_burst"
+DEFAULT_GATEWAY_REQUESTS_PER_SECOND = 0
+DEFAULT_GATEWAY_BURST = 5
+
+# Optional pipelined reads: up to this many block reads are sent to the gateway before waiting for
+# the responses (0 to read one block at a time). Gateways that get it wrong are read one block at a time instead
+CONF_PIPELINE_WINDOW = "pipeline_window"
+DEFAULT_PIPELINE_WINDOW = 0
+MAX_PIPELINE_WINDOW = 16
+PIPELINE_RETRY_INTERVAL = 3600 # Seconds before pipelining is tried again on a gateway that got it wrong
+
+# Optional broadcasts: writes that are the same for every device on a gateway (the clock, daylight
+# saving and group operation modes) are sent once to unit 0, which every device on an RS485 bus obeys
+# without answering. Each device is then read back to confirm it arrived, and written to directly if not
+CONF_USE_BROADCAST = "use_broadcast"
+DEFAULT_USE_BROADCAST = False
+BROADCAST_UNIT_ID = 0
+BROADCAST_TURNAROUND_DELAY = 0.2 # Seconds to leave the bus quiet after a broadcast, while the devices act on it
+BROADCAST_TIME_TOLERANCE = 2 # Minutes a read back clock may be out by and still count as set
+BROADCAST_OPERATION_MODES = ["Schedule", "Advance", "Frost protection"] # Frost protection is Standby on timers
+# The same on both device types
+DAYLIGHT_SAVING_REGISTER = 29
+RTC_START_REGISTER = 46 # Year, month/day, hour/minute, second (46 to 49)
+
+# Debounced writes (e.g. dragging a slider): the latest value for each register is shown straight away,
+# and written once no further change has come in for WRITE_DEBOUNCE_DELAY seconds (or WRITE_DEBOUNCE_MAX_DELAY
+# seconds after the first, so a long drag still gets written)
+WRITE_DEBOUNCE_DELAY = 1.0
+WRITE_DEBOUNCE_MAX_DELAY = 5.0
+
+# Operation block: mode, hold/force, advance, frost, hold time and away time (32 to 40)
+# All contiguous and writable on both device types, so can be written in one transaction
+OPERATION_BLOCK_START = 32
+OPERATION_BLOCK_END = 40
+
+# Read-only mirrors that change when the operation block is written, as (start, count)
+# Thermostat: current setting temperature, on/off mode and operation mode (6 to 8)
+# Timer: relay status through to operation mode (1 to 8)
+OPERATION_BLOCK_READBACK = [(6, 3), (1, 8)] # Indexed by device type
+
+# Backups and restores
+RESTORE_START_REGISTER = 20 # Registers below this are read-only
+MODBUS_ID_REGISTER = 30 # Never restored
+# Never restored: the daylight saving status and clock (they'd put the clock back to when the snapshot was taken),
+# the MODBUS ID (a snapshot from another unit would readdress this one) and the temporary parts of the operation
+# block (mode, hold/advance temperatures or timer force, hold and away times). The frost temperature (36) is restored.
+RESTORE_SKIP_REGISTERS = frozenset(
+    {DAYLIGHT_SAVING_REGISTER, MODBUS_ID_REGISTER, 32, 33, 34, 37, 38, 39, 40, *range(RTC_START_REGISTER, RTC_START_REGISTER + 4)}
+)
+SNAPSHOT_MAX_CACHE_AGE = 120 # Seconds, cached registers older than this are re-read before a backup or restore
+SNAPSHOT_MAX_PER_DEVICE = 10 # Oldest snapshots are dropped from storage after this many
+SNAPSHOT_STORAGE_KEY = f"{DOMAIN}.snapshots"
+SNAPSHOT_STORAGE_VERSION = 1
+
+# Writes to a device that can't be reached are queued (latest value per register) and written once it can be
+# Saved per config entry, keyed by channel, so they survive a restart
+WRITE_QUEUE_STORAGE_KEY = f"{DOMAIN}.write_queue"
+WRITE_QUEUE_STORAGE_VERSION = 1
+WRITE_QUEUE_SAVE_DELAY = 1 # Seconds, changes made together are saved together
+
+# Relay runtime, added up from the relay status read by each poll (see runtime.py)
+# Kept in RUNTIME_BUCKET_SECONDS buckets for the last RUNTIME_DAYS days, saved per config entry, keyed by channel
+RUNTIME_BUCKET_SECONDS = 300
+RUNTIME_DAYS = 7
+RUNTIME_MAX_GAP = 900 # Seconds, longer gaps between polls (e.g. the device couldn't be reached) aren't counted
+RUNTIME_STORAGE_KEY = f"{DOMAIN}.runtime"
+RUNTIME_STORAGE_VERSION = 1
+RUNTIME_SAVE_INTERVAL = 600 # Seconds, it's saved on unload and shutdown as well so this just limits what a crash loses
+
+SCHEDULE_TEMPLATE_STORAGE_KEY = f"{DOMAIN}.schedule_templates"
+SCHEDULE_TEMPLATE_STORAGE_VERSION = 1
+
 HOUR_TO_SETTEMP_REGISTER_OFFSET = 2  # Offset from start of period time register to the corresponding temperature register
 
 PRESET_MODES = ["Override","Schedule","Hold","Advance","Away","Frost protection"] # Override is known as "change over" in docs
@@ -0,0 +1,62 @@
+"""Diagnostics support for the heatmiser_edge component."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import *
+from .heat_demand import get_heat_demand
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Return diagnostics for a config entry: each channel's device, poller and queued writes, and the gateway."""
+    hub = hass.data.get(DOMAIN, {}).get(entry.entry_id)
+    if hub is None:
+        return {"data": dict(entry.data), "options": dict(entry.options), "loaded": False}
+
+    return {
+        "data": dict(entry.data),
+        "options": dict(entry.options),
+        "channels": {
+            slave_id: _channel_diagnostics(register_store) for slave_id, register_store in hub.stores.items()
+        },
+        "gateway": next(iter(hub.stores.values())).gateway.diagnostics() if hub.stores else None,
+        "heat_demand": get_heat_demand().diagnostics(),
+    }
+
+
+def _channel_diagnostics(register_store) -> dict[str, Any]:
+    poller = register_store.poller
+    return {
+        "device": {
+            "device_type": register_store.device_type,
+            "firmware": register_store.registers[int(ThermostatRegisterAddresses.CODE_VERSION_NUMBER_RD)],
+            "last_update_time": register_store.last_update_time,
+            "last_status_update_time": register_store.last_status_update_time,
+            "seconds_until_schedule_transition": register_store.seconds_until_schedule_transition(),
+            "block_sizes": register_store.block_sizes.to_dict(),
+        },
+        "poller": None if poller is None else {
+            "polls": poller.polls,
+            "errors": poller.errors,
+            "last_error": poller.last_error,
+            "current_interval": poller.current_interval,
+            "min_interval": poller.min_interval,
+            "max_interval": poller.max_interval,
+            "last_poll_duration": poller.last_poll_duration,
+            "average_poll_duration": poller.poll_duration_sum / (poller.polls + poller.errors) if poller.polls + poller.errors else None,
+        },
+        "write_queue": {
+            "length": len(register_store.write_queue),
+            "age": register_store.write_queue.age(),
+            "registers": register_store.write_queue.to_dict(),
+        },
+        "relay_runtime": {
+            "today": register_store.relay_runtime.runtime_today(),
+            "duty_cycle_last_hour": register_store.relay_runtime.duty_cycle_last_hour(),
+            "daily": register_store.relay_runtime.daily_runtimes(),
+        },
+        "registers": register_store.registers,
+    }
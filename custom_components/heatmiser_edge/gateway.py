@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from pymodbus.client import AsyncModbusTcpClient
+
+from .const import *
+from .pipeline import PipelinedModbusClient
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _RoundRobinWaiters:
+    """Futures waiting their turn, served one owner at a time in rotation.
+
+    An owner with lots of requests queued (a full poll, a restore) can't starve the
+    others, as each owner with something waiting gets one turn per round.
+    """
+
+    def __init__(self) -> None:
+        self._queues: "OrderedDict[Any, Deque[asyncio.Future]]" = OrderedDict()
+
+    def add(self, owner: Any) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(owner, deque()).append(future)
+        return future
+
+    def pop(self) -> Optional[asyncio.Future]:
+        """The next future to wake, or None if nothing is waiting."""
+        while self._queues:
+            owner, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(owner)
+            else:
+                del self._queues[owner]
+            if not future.done():  # Skip waiters that were cancelled
+                return future
+        return None
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+
+class HeatmiserEdgeGateway:
+    """A Modbus TCP to RS485 gateway, shared by every register store on the same host and port.
+
+    Every device behind a gateway sits on the same RS485 bus, so the gateway limits
+    how many of them can be talked to at once. Connections are kept open and reused
+    rather than reconnecting for every read or write.
+
+    Optionally every request is also limited by a token bucket (requests per second plus a
+    burst), as some cheap gateways start dropping frames if sent too many too quickly.
+    Both the connections and the request budget are shared out fairly between the stores
+    (owners) using the gateway.
+    """
+
+    def __init__(self, host: str, port: int, max_concurrent: int = DEFAULT_GATEWAY_CONCURRENCY) -> None:
+        self.host = host
+        self.port = port
+        self._free_connections = max_concurrent
+        self._connection_waiters = _RoundRobinWaiters()
+        self._idle_clients: List[AsyncModbusTcpClient] = []
+        self._idle_pipelines: List[PipelinedModbusClient] = []
+        self.pipelining_failed: Optional[str] = None # Why pipelined reads were given up on, if they were
+        self._pipelining_failed_at: Optional[float] = None # time.monotonic(), see pipelining_allowed
+        self.broadcast_members: set = set() # Stores that allow broadcasts to their device, see broadcast.py
+        self.broadcasts = 0
+        self._users = 0
+        self._poll_slots = 0
+
+        # Rate limiting, off until an owner asks for it
+        self._rate_limits: Dict[Any, Tuple[float, float]] = {}
+        self.requests_per_second = 0.0
+        self.burst = 0.0
+        self._tokens = 0.0
+        self._tokens_updated = time.monotonic()
+        self._token_waiters = _RoundRobinWaiters()
+        self._token_timer: Optional[asyncio.TimerHandle] = None
+
+        # Statistics, for diagnostics
+        self.requests = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @asynccontextmanager
+    async def connection(self, owner: Any = None) -> AsyncIterator[AsyncModbusTcpClient]:
+        """Yield a connected client, waiting for the gateway to be free first."""
+        await self._acquire_connection(owner)
+        try:
+            client = await self._get_client()
+            try:
+                yield _RateLimitedClient(client, self, owner)
+            except Exception:
+                # Don't reuse a connection that might be left half way through a transaction
+                client.close()
+                raise
+            if client.connected:
+                self._idle_clients.append(client)
+        finally:
+            self._release_connection()
+
+    @asynccontextmanager
+    async def pipeline(self, owner: Any, window: int) -> AsyncIterator[PipelinedModbusClient]:
+        """Yield a connected client for pipelined reads, waiting for the gateway to be free first.
+
+        Takes one of the gateway's connection slots like connection() does, so the devices
+        still take turns on the bus; it's only the requests for one device that overlap.
+        """
+        await self._acquire_connection(owner)
+        try:
+            client = await self._get_pipeline(window)
+            try:
+                yield client
+            except Exception:
+                client.close()
+                raise
+            if client.connected:
+                self._idle_pipelines.append(client)
+        finally:
+            self._release_connection()
+
+    async def _get_pipeline(self, window: int) -> PipelinedModbusClient:
+        while self._idle_pipelines:
+            client = self._idle_pipelines.pop()
+            if client.connected:
+                client.window = max(1, int(window))
+                return client
+            client.close()
+        client = PipelinedModbusClient(self.host, self.port, window)
+        await client.connect()
+        return client
+
+    def pipelining_allowed(self) -> bool:
+        """Whether pipelined reads can be used: not for PIPELINE_RETRY_INTERVAL seconds after they last went wrong, then they're tried again."""
+        if self.pipelining_failed is None:
+            return True
+        if time.monotonic() - self._pipelining_failed_at < PIPELINE_RETRY_INTERVAL:
+            return False
+        _LOGGER.info("Trying pipelined requests to gateway %s:%s again", self.host, self.port)
+        self.pipelining_failed = None
+        return True
+
+    def disable_pipelining(self, reason: str) -> None:
+        """Stop every device on the gateway from pipelining for a while, as the gateway doesn't cope with it."""
+        if self.pipelining_failed is None:
+            _LOGGER.warning(
+                "Gateway %s:%s doesn't handle pipelined requests (%s), reading one block at a time for the next %d minutes",
+                self.host, self.port, reason, PIPELINE_RETRY_INTERVAL // 60,
+            )
+            self.pipelining_failed = reason
+        self._pipelining_failed_at = time.monotonic()
+        for client in self._idle_pipelines:
+            client.close()
+        self._idle_pipelines.clear()
+
+    async def _acquire_connection(self, owner: Any) -> None:
+        if self._free_connections > 0 and not len(self._connection_waiters):
+            self._free_connections -= 1
+            return
+        await self._wait(self._connection_waiters.add(owner), self._release_connection)
+
+    def _release_connection(self) -> None:
+        waiter = self._connection_waiters.pop()
+        if waiter is not None:
+            waiter.set_result(None)  # Hand the connection straight over
+        else:
+            self._free_connections += 1
+
+    async def _get_client(self) -> AsyncModbusTcpClient:
+        while self._idle_clients:
+            client = self._idle_clients.pop()
+            if client.connected:
+                return client
+            client.close()
+        client = AsyncModbusTcpClient(self.host, port=self.port)
+        if not await client.connect():
+            client.close()
+            raise ConnectionError(f"Unable to connect to {self.host}:{self.port}")
+        return client
+
+    # ===== Broadcasts =====
+
+    def set_broadcast(self, owner: Any, enabled: bool) -> None:
+        """Allow (or stop allowing) an owner's device to be written to by broadcast."""
+        if enabled:
+            self.broadcast_members.add(owner)
+        else:
+            self.broadcast_members.discard(owner)
+
+    @property
+    def broadcast_covers_bus(self) -> bool:
+        """True if every owner using the gateway allows broadcasts, so a broadcast only reaches devices that want it."""
+        return bool(self.broadcast_members) and len(self.broadcast_members) >= self._users
+
+    async def async_broadcast(self, owner: Any, start_register: int, values: List[int]) -> None:
+        """Write values to every device on the bus at once.
+
+        No device answers a broadcast, so whether it arrived has to be checked by reading it back.
+        The gateway is held for a moment afterwards while the devices act on it.
+        """
+        async with self.connection(owner) as client:
+            if len(values) == 1:
+                await client.write_register(int(start_register), value=int(values[0]), device_id=BROADCAST_UNIT_ID, no_response_expected=True)
+            else:
+                await client.write_registers(int(start_register), [int(v) for v in values], device_id=BROADCAST_UNIT_ID, no_response_expected=True)
+            await asyncio.sleep(BROADCAST_TURNAROUND_DELAY)
+        self.broadcasts += 1
+
+    # ===== Rate limiting =====
+
+    def set_rate_limit(self, owner: Any, requests_per_second: float, burst: float) -> None:
+        """Set an owner's request budget for the gateway (0 requests per second for no limit).
+
+        If the owners on a gateway ask for different budgets, the strictest is used.
+        """
+        if requests_per_second > 0:
+            self._rate_limits[owner] = (float(requests_per_second), max(1.0, float(burst)))
+        else:
+            self._rate_limits.pop(owner, None)
+
+        was_limited = self.requests_per_second > 0
+        if self._rate_limits:
+            self._refill()
+            self.requests_per_second = min(rate for rate, _ in self._rate_limits.values())
+            self.burst = min(burst for _, burst in self._rate_limits.values())
+            self._tokens = min(self._tokens, self.burst) if was_limited else self.burst
+        else:
+            self.requests_per_second = 0.0
+            self.burst = 0.0
+        self._drain_tokens()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._tokens_updated) * self.requests_per_second)
+        self._tokens_updated = now
+
+    async def acquire_request(self, owner: Any) -> None:
+        """Wait until the request budget allows another request."""
+        self.requests += 1
+        if self.requests_per_second <= 0:
+            return
+        self._refill()
+        if self._tokens >= 1 and not len(self._token_waiters):
+            self._tokens -= 1
+            return
+        future = self._token_waiters.add(owner)
+        self._schedule_drain()
+        await self._wait(future, self._return_token)
+
+    def _return_token(self) -> None:
+        """A waiter was given a token but was cancelled before using it."""
+        self._tokens = min(self.burst, self._tokens + 1)
+        self._drain_tokens()
+
+    def _schedule_drain(self) -> None:
+        if self._token_timer is not None or not len(self._token_waiters) or self.requests_per_second <= 0:
+            return
+        delay = max(0.0, (1 - self._tokens) / self.requests_per_second)
+        self._token_timer = asyncio.get_running_loop().call_later(delay, self._on_token_timer)
+
+    def _on_token_timer(self) -> None:
+        self._token_timer = None
+        self._drain_tokens()
+
+    def _drain_tokens(self) -> None:
+        """Wake as many waiters as there are tokens for, in turn by owner."""
+        if self.requests_per_second <= 0:
+            # No limit any more, let everything through
+            while (waiter := self._token_waiters.pop()) is not None:
+                waiter.set_result(None)
+            return
+        self._refill()
+        while self._tokens >= 1:
+            waiter = self._token_waiters.pop()
+            if waiter is None:
+                break
+            self._tokens -= 1
+            waiter.set_result(None)
+        self._schedule_drain()
+
+    async def _wait(self, future: asyncio.Future, give_back) -> None:
+        """Wait for our turn, recording how long it took. give_back is called if the turn came but we were cancelled."""
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                give_back()
+            raise
+        waited = time.monotonic() - started
+        self.waits += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    def diagnostics(self) -> dict:
+        return {
+            "host": self.host,
+            "port": self.port,
+            "users": self._users,
+            "requests_per_second": self.requests_per_second,
+            "burst": self.burst,
+            "requests": self.requests,
+            "connection_queue_depth": len(self._connection_waiters),
+            "request_queue_depth": len(self._token_waiters),
+            "waits": self.waits,
+            "wait_time_total": round(self.wait_time_total, 3),
+            "wait_time_max": round(self.wait_time_max, 3),
+            "wait_time_average": round(self.wait_time_total / self.waits, 3) if self.waits else 0.0,
+            "pipelining_failed": self.pipelining_failed,
+            "broadcast_members": len(self.broadcast_members),
+            "broadcasts": self.broadcasts,
+        }
+
+    def next_poll_offset(self, interval: float) -> float:
+        """How far into the poll interval the next device to start polling on this gateway should start.
+
+        Successive devices are spread out by the golden ratio, so however many end up sharing
+        the gateway their polls are roughly evenly spaced rather than all landing at once.
+        """
+        slot = self._poll_slots
+        self._poll_slots += 1
+        return (slot * _GOLDEN_RATIO_CONJUGATE) % 1 * interval
+
+    def close(self) -> None:
+        """Close any idle connections."""
+        for client in self._idle_clients:
+            client.close()
+        self._idle_clients.clear()
+        for client in self._idle_pipelines:
+            client.close()
+        self._idle_pipelines.clear()
+        if self._token_timer is not None:
+            self._token_timer.cancel()
+            self._token_timer = None
+
+
+class _RateLimitedClient:
+    """Wraps a client so that each request counts against the gateway's request budget."""
+
+    def __init__(self, client: AsyncModbusTcpClient, gateway: HeatmiserEdgeGateway, owner: Any) -> None:
+        self._client = client
+        self._gateway = gateway
+        self._owner = owner
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+    async def read_holding_registers(self, *args, **kwargs):
+        await self._gateway.acquire_request(self._owner)
+        return await self._client.read_holding_registers(*args, **kwargs)
+
+    async def write_register(self, *args, **kwargs):
+        await self._gateway.acquire_request(self._owner)
+        return await self._client.write_register(*args, **kwargs)
+
+    async def write_registers(self, *args, **kwargs):
+        await self._gateway.acquire_request(self._owner)
+        return await self._client.write_registers(*args, **kwargs)
+
+
+_GOLDEN_RATIO_CONJUGATE = 0.6180339887498949
+
+_GATEWAYS: Dict[Tuple[str, int], HeatmiserEdgeGateway] = {}
+
+
+def get_gateway(host: str, port: int) -> HeatmiserEdgeGateway:
+    """Return the shared gateway for host:port, creating it if needed.
+
+    Each call should be matched by a call to release_gateway once the caller is finished with it.
+    """
+    key = (host, int(port))
+    if key not in _GATEWAYS:
+        _LOGGER.debug("Creating gateway for %s:%s", host, port)
+        _GATEWAYS[key] = HeatmiserEdgeGateway(host, int(port))
+    gateway = _GATEWAYS[key]
+    gateway._users += 1
+    return gateway
+
+
+def release_gateway(gateway: HeatmiserEdgeGateway, owner: Any = None) -> None:
+    """Stop using a gateway, closing its connections once nothing else is using it."""
+    gateway._users -= 1
+    gateway.broadcast_members.discard(owner)
+    if owner is not None and owner in gateway._rate_limits:
+        gateway.set_rate_limit(owner, 0, 0)
+    if gateway._users <= 0:
+        _LOGGER.debug("Closing gateway for %s:%s", gateway.host, gateway.port)
+        gateway.close()
+        _GATEWAYS.pop((gateway.host, gateway.port), None)
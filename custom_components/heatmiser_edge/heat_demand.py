@@ -0,0 +1,167 @@
+"""Keep track of which thermostats, on every gateway, are calling for heat.
+
+For driving a boiler from "any thermostat calling for heat". Rather than going through every
+relay sensor whenever anything changes, each thermostat's register store tells the aggregate
+as soon as its relay register changes (see heatmiser_edge_register_store.add_register_listener),
+so only that zone is looked at. While a zone is calling, changes to its room and set temperatures
+update its setpoint deficit (how far below its set temperature it is) in the same way.
+
+Each update records how long it took from the start of the read that found the change, so the
+delay between a relay changing on the device and the boiler being told can be watched.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .const import ThermostatRegisterAddresses
+
+_LOGGER = logging.getLogger(__name__)
+
+RELAY_REGISTER = int(ThermostatRegisterAddresses.RELAY_STATUS_RD)
+ROOM_TEMPERATURE_REGISTER = int(ThermostatRegisterAddresses.ROOM_TEMPERATURE_RD)
+SET_TEMPERATURE_REGISTER = int(ThermostatRegisterAddresses.CURRENT_SETTING_TEMPERATURE_RD)
+_NOT_CALLING = object()
+
+
+class HeatDemand:
+    """The zones (thermostats) calling for heat, how many relays are on and the largest setpoint deficit."""
+
+    def __init__(self) -> None:
+        self._zones: Dict[Any, Tuple[str, Callable[[], None]]] = {} # Register store: (name, remove listener)
+        self._calling: Dict[Any, Optional[float]] = {} # Register store: setpoint deficit (degrees)
+        self._listeners: List[Callable[[], None]] = []
+        self.owner: Optional[str] = None # Config entry showing the sensor, as there's one for every gateway
+        self._sensor_adders: Dict[str, Callable[[], None]] = {} # Config entry: adds the sensor to that entry, see claim_sensor
+        self.updates = 0
+        self.last_latency: Optional[float] = None # Seconds from the start of the read to the aggregate being updated
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def relays_on(self) -> int:
+        return len(self._calling)
+
+    @property
+    def calling(self) -> List[str]:
+        """Names of the zones calling for heat."""
+        return sorted(self._zones[store][0] for store in self._calling)
+
+    @property
+    def max_deficit(self) -> Optional[float]:
+        """The furthest any calling zone is below its set temperature (degrees), or None if none are calling."""
+        return max((deficit for deficit in self._calling.values() if deficit is not None), default=None)
+
+    def add_zone(self, store: Any, name: str) -> None:
+        """Follow a thermostat's register store (which should have been read already)."""
+        self.remove_zone(store)
+        remove = store.add_register_listener(
+            (RELAY_REGISTER, ROOM_TEMPERATURE_REGISTER, SET_TEMPERATURE_REGISTER), self._on_registers_changed
+        )
+        self._zones[store] = (name, remove)
+        if self._update_zone(store):
+            self._notify_listeners()
+
+    def remove_zone(self, store: Any) -> None:
+        zone = self._zones.pop(store, None)
+        if zone is None:
+            return
+        zone[1]()
+        if self._calling.pop(store, _NOT_CALLING) is not _NOT_CALLING:
+            self._notify_listeners()
+
+    def claim_sensor(self, entry_id: str, add_sensor: Callable[[], None]) -> None:
+        """Offer a config entry to show the sensor, calling add_sensor straight away if no entry is showing it."""
+        self._sensor_adders[entry_id] = add_sensor
+        if self.owner is None:
+            self.owner = entry_id
+            add_sensor()
+
+    def release_sensor(self, entry_id: str) -> None:
+        """Withdraw a config entry (e.g. it's being unloaded), handing the sensor to another entry if it was showing it.
+
+        Once no entries are left, everything is reset ready for the next one to be set up.
+        """
+        self._sensor_adders.pop(entry_id, None)
+        if self.owner == entry_id:
+            self.owner = None
+            if self._sensor_adders:
+                self.owner, add_sensor = next(iter(self._sensor_adders.items()))
+                add_sensor()
+        if not self._sensor_adders:
+            self.reset()
+
+    def reset(self) -> None:
+        """Forget every zone and listener and start the counts again."""
+        for store in list(self._zones):
+            self.remove_zone(store)
+        self._listeners.clear()
+        self.owner = None
+        self.updates = 0
+        self.last_latency = None
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def add_listener(self, listener: Callable[[], None]) -> Callable[[], None]:
+        """Register a listener that will be called after each change to the aggregate. Returns a function to remove it."""
+        self._listeners.append(listener)
+        def _remove() -> None:
+            try:
+                self._listeners.remove(listener)
+            except ValueError:
+                pass
+        return _remove
+
+    def _on_registers_changed(self, store: Any, changed: Dict[int, Tuple[Optional[int], int]]) -> None:
+        # Temperature changes only matter while the zone is calling
+        if RELAY_REGISTER not in changed and store not in self._calling:
+            return
+        if not self._update_zone(store):
+            return
+        if store.read_started is not None:
+            self.last_latency = time.monotonic() - store.read_started
+            self.latency_sum += self.last_latency
+            self.latency_max = max(self.latency_max, self.last_latency)
+        self.updates += 1
+        self._notify_listeners()
+
+    def _update_zone(self, store: Any) -> bool:
+        """Work out one zone's part in the aggregate from its cached registers. Returns True if it changed."""
+        registers = store.registers
+        before = self._calling.get(store, _NOT_CALLING)
+        if registers[RELAY_REGISTER]:
+            deficit = None
+            if registers[ROOM_TEMPERATURE_REGISTER] is not None and registers[SET_TEMPERATURE_REGISTER] is not None:
+                deficit = max(0.0, (registers[SET_TEMPERATURE_REGISTER] - registers[ROOM_TEMPERATURE_REGISTER]) / 10)
+            self._calling[store] = deficit
+            return before != deficit
+        self._calling.pop(store, None)
+        return before is not _NOT_CALLING
+
+    def _notify_listeners(self) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener()
+            except Exception as exc:  # pragma: no cover
+                _LOGGER.debug("Heat demand listener raised: %s", exc)
+
+    def diagnostics(self) -> dict:
+        return {
+            "zones": len(self._zones),
+            "relays_on": self.relays_on,
+            "calling": self.calling,
+            "max_deficit": self.max_deficit,
+            "updates": self.updates,
+            "last_latency": self.last_latency,
+            "average_latency": self.latency_sum / self.updates if self.updates else None,
+            "max_latency": self.latency_max if self.updates else None,
+        }
+
+
+_heat_demand = HeatDemand()
+
+
+def get_heat_demand() -> HeatDemand:
+    """The heat demand shared by every gateway."""
+    return _heat_demand
@@ -1,73 +1,512 @@
+import asyncio
 import logging
-from typing import Callable, List
-from pymodbus.client import AsyncModbusTcpClient
+from typing import Callable, Dict, List, Optional, Tuple
+from pymodbus.exceptions import ConnectionException, ModbusIOException
 from .const import *
+from .broadcast import async_broadcast_device_time, device_time_values
+from .capabilities import BlockSizes, async_probe_block_sizes
+from .gateway import get_gateway, release_gateway
+from .pipeline import PipelineError
+from .register_blocks import changed_registers, plan_register_reads, plan_register_writes
+from .runtime import RelayRuntime
+from .schedule import WeeklySchedule, schedule_key
+from .snapshot import Snapshot
+from .write_queue import WriteQueue
 import time
+from datetime import datetime
 
 _LOGGER = logging.getLogger(__name__)
 
 class heatmiser_edge_register_store:
     def __init__(self, host, port, modbus_id) -> None:
         _LOGGER.debug("Initialising Register store")
-        self.registers = [None] * 218
+        self.registers = [None] * REGISTER_COUNT
         self.device_type = None
         self.time_of_next_update = None
+        self.last_update_time = None # time.time() of the last full read
+        self.last_status_update_time = None # time.time() of the last read of the status registers (full or status only)
         self._slave_id = modbus_id # TO CHANGE
         self._host = host
         self._port = port
+        self.gateway = get_gateway(host, port)
+        self.sync_device_time = True # Keep the device clock in step with this machine's clock
+        self.poller = None # RegisterStorePoller keeping this store up to date, if there is one
+        self.weekly_schedule: Optional[WeeklySchedule] = None # Decoded from the cached schedule registers
+        self._schedule_key = None
+        self._next_schedule_transition: Optional[datetime] = None
         self._update_listeners: List[Callable[[], None]] = []
+        self._register_listeners: List[Tuple[frozenset, Callable]] = [] # See add_register_listener
+        self.read_started: Optional[float] = None # time.monotonic() when the latest read from the device started
+        self.block_sizes = BlockSizes() # Most registers read or written in one transaction, see async_probe_block_sizes
+        self.pipeline_window = DEFAULT_PIPELINE_WINDOW # Block reads kept in flight at once, 0 to read one block at a time
+        self.use_broadcast = DEFAULT_USE_BROADCAST # Set the clock on every device on the gateway with one broadcast, see broadcast.py
+        self.write_queue = WriteQueue() # Writes made while the device couldn't be reached, written once it can be
+        self.on_write_queue_changed: Optional[Callable[[], None]] = None # Called whenever write_queue changes, e.g. to save it
+        self.relay_runtime = RelayRuntime() # How long the relay has been on, added to by every poll
+        # Debounced writes, see write_registers_debounced
+        self._debounced_writes: Dict[int, int] = {} # To be written
+        self._debounced_shown: Dict[int, int] = {} # Shown in the cache until then (the writes and any read-only mirrors of them)
+        self._debounced_before: Dict[int, Optional[int]] = {} # What the device last said for each shown register
+        self._debounced_batch: Dict[int, int] = {} # Shown register: the write being sent for it (absent while still waiting)
+        self._debounce_batches = 0
+        self._debounce_started: Optional[float] = None
+        self._debounce_task: Optional[asyncio.Task] = None
         
     async def write_register(self, register: int, value: int, refresh_values_after_writing: bool) -> None:
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        """Write a value to a specific register."""
+        """Write a value to a specific register.
+
+        If the device can't be reached the value is queued and written once it can be, see write_queue.py.
+        """
         try:
-            await client.write_register(int(register), value=int(value), device_id=self._slave_id)
-            client.close()
+            async with self.gateway.connection(self) as client:
+                await client.write_register(int(register), value=int(value), device_id=self._slave_id)
+            self._set_registers(int(register), [int(value)])
         except Exception as ex:
-            client.close()
-            _LOGGER.error(f"Error writing to register {register}: {ex}")
-            raise
+            if not _is_unreachable(ex):
+                _LOGGER.error(f"Error writing to register {register}: {ex}")
+                raise
+            self._queue_writes([(int(register), [int(value)])], ex)
+            return
+        if self.write_queue.discard(int(register), 1):
+            self._write_queue_changed()
         if refresh_values_after_writing:
             await self.async_update()  # Refresh register values after writing
         
     async def write_register_range(self, start_register: int, values: List[int], refresh_values_after_writing: bool) -> None:
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        """Write a range of values starting from a specific register."""
-        # Write data in chunks of up to 10 registers at a time
-        MAX_REGISTER_WRITE_COUNT = 10
+        """Write a range of values starting from a specific register, as one transaction (see async_write_transaction)."""
+        # Written in chunks of up to block_sizes.write registers at a time
         try:
-            for chunk_start_register_idx in range(0, len(values), MAX_REGISTER_WRITE_COUNT):
-                chunk_end_register_idx = min(chunk_start_register_idx + MAX_REGISTER_WRITE_COUNT, len(values))
-                chunk = values[chunk_start_register_idx:chunk_end_register_idx]
-                await client.write_registers(int(start_register) + chunk_start_register_idx, chunk, device_id=self._slave_id)
-            client.close()
+            summary = await self.async_write_transaction({int(start_register) + offset: value for offset, value in enumerate(values)})
         except Exception as ex:
-            client.close()
             _LOGGER.error(f"Error writing to registers starting at {start_register}: {ex}")
             raise
-        if refresh_values_after_writing:
+        if refresh_values_after_writing and summary["committed"]:
             await self.async_update()  # Refresh register values after writing
 
+    async def write_register_blocks(self, blocks: List[Tuple[int, List[int]]], queue_if_unreachable: bool = True) -> int:
+        """Write each (start register, values) block over a single connection.
+
+        The cached registers are updated to match what was written. If the device can't be reached
+        (and queue_if_unreachable is set) the blocks not yet written are queued rather than raising.
+        Returns the number of Modbus transactions sent, so fewer than len(blocks) if any were queued.
+        """
+        written = []
+        try:
+            await self._async_write_blocks(blocks, written)
+        except Exception as ex:
+            if not (queue_if_unreachable and _is_unreachable(ex)):
+                raise
+            self._queue_writes(blocks[len(written):], ex)
+        finally:
+            self._discard_queued_writes(written)
+        return len(written)
+
+    async def _async_write_blocks(self, blocks: List[Tuple[int, List[int]]], written: list) -> None:
+        """Write each block over a single connection, appending each to written (and updating the cache) once it has been."""
+        async with self.gateway.connection(self) as client:
+            for block_start, block_values in blocks:
+                values = [int(v) for v in block_values]
+                result = await client.write_registers(int(block_start), values, device_id=self._slave_id)
+                if result.isError():
+                    raise IOError(f"Error writing registers {block_start} to {block_start + len(values) - 1} to device {self._slave_id} at {self._host}: {result}")
+                self._set_registers(block_start, values)
+                self._show_debounced_writes(block_start, len(values))
+                written.append((block_start, values))
+
+    def _discard_queued_writes(self, written: List[Tuple[int, List[int]]]) -> None:
+        # Anything queued for these registers has been overtaken by what was just written
+        if any([self.write_queue.discard(block_start, len(values)) for block_start, values in written]):
+            self._write_queue_changed()
+
+    async def async_write_transaction(self, changes: Dict[int, int], max_gap: int = 2, queue_if_unreachable: bool = True) -> dict:
+        """Write several registers as one change: all of them or (as far as possible) none.
+
+        The registers the writes will cover are kept from the cache first (read from the device if
+        they aren't cached), then the changes are written in as few blocks as possible (runs up to
+        max_gap registers apart are joined, re-writing the ones between) and read back. If a write
+        fails or a register doesn't read back as written, every block that may have been written
+        is put back as it was and read back again, then TransactionError is raised with the summary.
+
+        If the device can't be reached before anything has been written (and queue_if_unreachable
+        is set) the changes are queued instead, see write_queue.py. Returns a summary: whether the
+        changes were committed or queued, the transactions sent and the registers' final values.
+        A roll back that can't reach the device is queued in the same way.
+        """
+        changes = {int(register): int(value) for register, value in changes.items()}
+        summary = {"committed": False, "queued": False, "rolled_back": False, "transactions": 0, "error": None, "registers": {}}
+        if not changes:
+            summary["committed"] = True
+            return summary
+        first, last = min(changes), max(changes)
+        try:
+            if None in self.registers[first:last + 1]:
+                # Cache not populated (e.g. an earlier read failed), don't write back or roll back to unknown values
+                await self.async_read_register_blocks(plan_register_reads(first, last, self.block_sizes.read))
+        except Exception as ex:
+            if not (queue_if_unreachable and _is_unreachable(ex)):
+                raise
+            self._queue_writes([(register, [value]) for register, value in sorted(changes.items())], ex)
+            summary["queued"] = True
+            return summary
+
+        target = [changes.get(register) for register in range(first, last + 1)]
+        # Every change is written, even if the cache says the device already has it (it may have changed since it was read)
+        current = [self._device_value(register) for register in range(REGISTER_COUNT)]
+        for register in changes:
+            current[register] = None
+        blocks = plan_register_writes(current, target, first, max_count=self.block_sizes.write, max_gap=max_gap)
+        snapshot = {
+            register: self._device_value(register)
+            for block_start, block_values in blocks for register in range(block_start, block_start + len(block_values))
+        }
+        written = []
+        try:
+            try:
+                await self._async_write_blocks(blocks, written)
+            finally:
+                summary["transactions"] = len(written)
+                self._discard_queued_writes(written)
+            device_values = await self._async_read_back(blocks)
+            mismatched = [register for register, value in changes.items() if device_values[register] != value]
+            if mismatched:
+                raise IOError(f"Registers {', '.join(str(register) for register in mismatched)} didn't read back as written")
+            summary["committed"] = True
+        except Exception as ex:
+            if not written and queue_if_unreachable and _is_unreachable(ex):
+                self._queue_writes(blocks, ex)
+                summary["queued"] = True
+            else:
+                summary["error"] = str(ex)
+                # If the device didn't answer, the block being written when it failed may or may not have been, so put that back too
+                await self._async_roll_back(blocks[:len(written) + int(_is_unreachable(ex))], snapshot, summary, queue_if_unreachable)
+        summary["registers"] = {register: self._device_value(register) for register in sorted(changes)}
+        self._notify_update_listeners()
+        if summary["error"] is not None:
+            outcome = "rolled back" if summary["rolled_back"] else "rolling back failed too, so the device may be left part way through"
+            raise TransactionError(
+                f"Writing registers {first} to {last} to device {self._slave_id} at {self._host} failed ({summary['error']}), {outcome}", summary
+            )
+        return summary
+
+    def write_registers_debounced(self, changes: Dict[int, int], shown: Optional[Dict[int, int]] = None, delay: float = WRITE_DEBOUNCE_DELAY) -> None:
+        """Write registers once they stop changing, showing the new values in the cache straight away.
+
+        For values that change many times in quick succession, e.g. while a slider is dragged: each
+        register's latest value is written once no change has come in for delay seconds
+        (0 to write in the background straight away), along with any other registers waiting, as one transaction (see async_write_transaction,
+        or async_write_operation_block for the operation block so its read-only mirrors are read back).
+        shown gives read-only registers that will change as a result, to be shown straight away too;
+        they are read back afterwards to confirm the device acted on the write. Polls in the meantime
+        keep showing the new values. Failures, and values the device doesn't confirm, are logged and
+        the cache then shows what the device has.
+        """
+        loop = asyncio.get_running_loop()
+        for register, value in {**changes, **(shown or {})}.items():
+            if register not in self._debounced_shown:
+                self._debounced_before[register] = self.registers[register]
+            self._debounced_shown[register] = int(value)
+            self._debounced_batch.pop(register, None)
+            self.registers[register] = int(value)
+        self._debounced_writes.update({int(register): int(value) for register, value in changes.items()})
+
+        if self._debounce_started is None:
+            self._debounce_started = loop.time()
+        if self._debounce_task is not None:
+            self._debounce_task.cancel()
+        delay = min(delay, self._debounce_started + WRITE_DEBOUNCE_MAX_DELAY - loop.time())
+        self._debounce_task = loop.create_task(self._async_write_debounced(max(0.0, delay)))
+        self._notify_update_listeners()
+
+    async def _async_write_debounced(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        # From here on a new change starts a new wait rather than cancelling this write
+        self._debounce_task = None
+        changes, batch = self._take_debounced_writes()
+        try:
+            read_back = set(changes)
+            if all(OPERATION_BLOCK_START <= register <= OPERATION_BLOCK_END for register in changes):
+                summary = await self.async_write_operation_block(changes)
+                readback_start, readback_count = OPERATION_BLOCK_READBACK[self.device_type]
+                read_back.update(range(readback_start, readback_start + readback_count))
+            else:
+                summary = await self.async_write_transaction(changes)
+            if not summary["committed"]:
+                # Queued until the device can be reached, so keep showing the values it will be sent
+                self._finish_debounced_writes(batch, keep_shown=True)
+                return
+
+            # Confirm the read-only registers shown change too, in case the device didn't act on the write
+            unread = sorted({register for register, owner in self._debounced_batch.items() if owner == batch} - read_back)
+            if unread:
+                await self.async_read_register_blocks(plan_register_reads(unread[0], unread[-1], self.block_sizes.read))
+        except Exception as ex:
+            _LOGGER.error(f"Error writing registers {', '.join(str(register) for register in sorted(changes))} to device {self._slave_id} at {self._host}: {ex}")
+            self._finish_debounced_writes(batch)
+            return
+        disagreed = {
+            register: self._device_value(register) for register, owner in self._debounced_batch.items()
+            if owner == batch and self._device_value(register) != self._debounced_shown[register]
+        }
+        if disagreed:
+            _LOGGER.warning(f"Device {self._slave_id} at {self._host} didn't confirm the values written, showing its values instead: {disagreed}")
+        self._finish_debounced_writes(batch)
+
+    def _take_debounced_writes(self) -> Tuple[Dict[int, int], int]:
+        """Take the waiting debounced writes to be sent, returning them and a batch number for _finish_debounced_writes.
+
+        Their values stay shown in the cache until the batch is finished, so polls in the meantime don't show the old ones.
+        """
+        changes = self._debounced_writes
+        self._debounce_batches += 1
+        for register in self._debounced_shown:
+            self._debounced_batch.setdefault(register, self._debounce_batches)
+        self._debounced_writes = {}
+        self._debounce_started = None
+        return changes, self._debounce_batches
+
+    def _finish_debounced_writes(self, batch: int, keep_shown: bool = False) -> None:
+        """Stop showing a batch's values, putting back what the device last said (unless keep_shown) and notifying listeners if that changes anything.
+
+        Registers written again since the batch was taken stay shown for the newer write.
+        """
+        changed = False
+        for register in [register for register, owner in self._debounced_batch.items() if owner == batch]:
+            del self._debounced_batch[register]
+            del self._debounced_shown[register]
+            before = self._debounced_before.pop(register)
+            if not keep_shown and self.registers[register] != before:
+                self.registers[register] = before
+                changed = True
+        if changed:
+            self._notify_update_listeners()
+
+    def _device_value(self, register: int) -> Optional[int]:
+        """The cached value of register as the device last said, rather than a debounced write waiting to be written."""
+        if register in self._debounced_shown:
+            return self._debounced_before[register]
+        return self.registers[register]
+
+    def _show_debounced_writes(self, start_register: int, count: int) -> None:
+        """Put the values waiting to be written back in the cache over the ones just read (which the device still has)."""
+        for register, value in self._debounced_shown.items():
+            if start_register <= register < start_register + count:
+                self._debounced_before[register] = self.registers[register]
+                self.registers[register] = value
+
+    async def _async_read_back(self, blocks: List[Tuple[int, List[int]]]) -> Dict[int, int]:
+        """Read just the registers the blocks cover back into the cache, returning the values read."""
+        reads = []
+        for block_start, block_values in blocks:
+            reads += plan_register_reads(block_start, block_start + len(block_values) - 1, self.block_sizes.read)
+        await self.async_read_register_blocks(reads)
+        return {
+            register: self._device_value(register)
+            for block_start, block_values in blocks for register in range(block_start, block_start + len(block_values))
+        }
+
+    async def _async_roll_back(self, blocks: List[Tuple[int, List[int]]], snapshot: Dict[int, int], summary: dict, queue_if_unreachable: bool) -> None:
+        """Put the blocks back to their values in snapshot, queueing whatever can't be put back if the device can't be reached."""
+        rollback = [
+            (block_start, [snapshot[register] for register in range(block_start, block_start + len(block_values))])
+            for block_start, block_values in blocks
+        ]
+        written = []
+        try:
+            await self._async_write_blocks(rollback, written)
+            device_values = await self._async_read_back(rollback)
+        except Exception as ex:
+            _LOGGER.error(f"Unable to roll back registers on device {self._slave_id} at {self._host}: {ex}")
+            summary["rollback_error"] = str(ex)
+            if queue_if_unreachable and _is_unreachable(ex):
+                self._queue_writes(rollback[len(written):], ex)
+                summary["queued"] = True
+            return
+        finally:
+            summary["transactions"] += len(written)
+            self._discard_queued_writes(written)
+        summary["rolled_back"] = all(
+            device_values[register] == value for block_start, values in rollback for register, value in enumerate(values, block_start)
+        )
+
+    async def async_flush_write_queue(self) -> int:
+        """Write the queued writes to the device in as few blocks as possible.
+
+        Queued values the device already has are dropped without being written. Should only be
+        done just after a full read, as registers between queued ones may be written back from the cache.
+        Returns the number of Modbus transactions sent.
+        """
+        if not self.write_queue:
+            return 0
+        blocks = plan_register_writes(self.registers, self.write_queue.target(REGISTER_COUNT), 0, max_count=self.block_sizes.write)
+        _LOGGER.info("Writing %d queued registers to device %s at %s in %d blocks", len(self.write_queue), self._slave_id, self._host, len(blocks))
+        try:
+            transactions = await self.write_register_blocks(blocks, queue_if_unreachable=False)
+        finally:
+            # Whatever was written now matches the cache; anything queued since with a different value stays queued
+            if self.write_queue.remove_delivered(self.registers):
+                self._write_queue_changed()
+        self._notify_update_listeners()
+        return transactions
+
+    def _queue_writes(self, blocks: List[Tuple[int, List[int]]], reason: Exception) -> None:
+        _LOGGER.warning(f"Device {self._slave_id} at {self._host} can't be reached, queueing write to {sum(len(values) for _, values in blocks)} registers: {reason}")
+        for block_start, block_values in blocks:
+            self.write_queue.add(block_start, block_values)
+        self._write_queue_changed()
+
+    def _write_queue_changed(self) -> None:
+        if self.on_write_queue_changed is not None:
+            self.on_write_queue_changed()
+        self._notify_update_listeners()
+
+    async def async_apply_register_image(self, start_register: int, values: List[Optional[int]], verify: bool = False) -> dict:
+        """Make the device match values (starting at start_register), writing only the differences.
+
+        The comparison is made against the cached registers, so these should be reasonably fresh.
+        None in values means leave that register alone. If verify is set, just the written blocks are read back.
+        Returns a summary of how many registers were changed and how many transactions that took.
+        """
+        blocks = plan_register_writes(self.registers, values, start_register, max_count=self.block_sizes.write)
+        registers_changed = len(changed_registers(self.registers, values, start_register))
+        transactions = 0
+        verify_failed_blocks = []
+        if blocks:
+            _LOGGER.debug("Writing %d changed registers to device %s at %s in %d blocks", registers_changed, self._slave_id, self._host, len(blocks))
+            transactions = await self.write_register_blocks(blocks, queue_if_unreachable=False)
+            if verify:
+                await self.async_read_register_blocks([(block_start, len(block_values)) for block_start, block_values in blocks])
+                verify_failed_blocks = [
+                    block_start for block_start, block_values in blocks
+                    if self.registers[block_start:block_start + len(block_values)] != list(block_values)
+                ]
+            self._notify_update_listeners()
+        summary = {
+            "registers_changed": registers_changed,
+            "transactions": transactions,
+        }
+        if verify:
+            summary["verify_failed_blocks"] = verify_failed_blocks
+        return summary
+
+    async def async_read_registers(self, start_register: int, count: int) -> List[int]:
+        """Read a block of registers from the device and update the cache with them."""
+        await self.async_read_register_blocks([(start_register, count)])
+        return self.registers[start_register:start_register + count]
+
+    async def async_read_register_blocks(self, reads: List[Tuple[int, int]]) -> None:
+        """Read each (start register, count) block over a single connection and update the cache with them."""
+        for (start_register, count), values in zip(reads, await self._async_read_blocks(reads)):
+            self._set_registers(start_register, values)
+            self._show_debounced_writes(start_register, count)
+
+    async def _async_read_blocks(self, reads: List[Tuple[int, int]]) -> List[List[int]]:
+        """Read each (start register, count) block over a single connection, returning the values of each.
+
+        If pipeline_window is set the blocks are requested pipeline_window at a time without waiting
+        for each response first. If the gateway gets that wrong, every device on it goes back to
+        one block at a time for a while (see HeatmiserEdgeGateway.pipelining_allowed) and the blocks
+        are read again that way. A response not arriving in time is just an error for this device.
+        """
+        self.read_started = time.monotonic()
+        unable_to_connect = None
+        if self.pipeline_window > 1 and self.gateway.pipelining_allowed():
+            try:
+                async with self.gateway.pipeline(self, self.pipeline_window) as client:
+                    return await client.async_read_blocks(self._slave_id, reads, lambda: self.gateway.acquire_request(self))
+            except PipelineError as ex:
+                self.gateway.disable_pipelining(str(ex))
+            except ConnectionError as ex:
+                unable_to_connect = str(ex)
+
+        values = []
+        async with self.gateway.connection(self) as client:
+            for start_register, count in reads:
+                result = await client.read_holding_registers(int(start_register), count=int(count), device_id=self._slave_id)
+                self._check_result(result, start_register, count)
+                values.append(result.registers)
+        if unable_to_connect is not None:
+            # The gateway is answering, it just won't take another connection for the pipelined reads
+            self.gateway.disable_pipelining(unable_to_connect)
+        return values
+
+    async def async_ensure_fresh(self, max_age: float) -> bool:
+        """Do a full read unless the cache was completely read within the last max_age seconds.
+
+        Returns True if the cached values were fresh enough to use as they were.
+        """
+        if (
+            self.last_update_time is not None
+            and time.time() - self.last_update_time <= max_age
+            and None not in self.registers
+        ):
+            return True
+        await self.async_update()
+        return False
+
+    async def async_restore_snapshot(self, snapshot: Snapshot) -> dict:
+        """Restore the writable registers from a snapshot, only writing the ones that differ.
+
+        The registers in RESTORE_SKIP_REGISTERS are never restored: the MODBUS ID, as a snapshot from
+        another unit would readdress this one, the clock and the temporary override state.
+        """
+        if snapshot.device_type is not None and snapshot.device_type != self.device_type:
+            raise ValueError("Snapshot was taken from a different type of device")
+        await self.async_ensure_fresh(SNAPSHOT_MAX_CACHE_AGE)
+        target = list(snapshot.registers[RESTORE_START_REGISTER:REGISTER_COUNT])
+        for register in RESTORE_SKIP_REGISTERS:
+            target[register - RESTORE_START_REGISTER] = None
+        return await self.async_apply_register_image(RESTORE_START_REGISTER, target, verify=True)
+
+    async def async_write_operation_block(self, values: dict) -> dict:
+        """Write the operation block (32 to 40) in one transaction, see async_write_transaction.
+
+        values maps register address to new value; registers between them are taken from the cache.
+        The read-only mirrors affected by the operation block are read back afterwards.
+        Returns the transaction's summary.
+        """
+        for register in values:
+            if not OPERATION_BLOCK_START <= int(register) <= OPERATION_BLOCK_END:
+                raise ValueError(f"Register {register} is not in the operation block")
+
+        # As a transaction, so a failure part way doesn't leave e.g. Hold mode with the old hold time
+        summary = await self.async_write_transaction(values, max_gap=OPERATION_BLOCK_END - OPERATION_BLOCK_START)
+        if not summary["committed"]:
+            return summary # Queued until the device can be reached
+
+        readback_start, readback_count = OPERATION_BLOCK_READBACK[self.device_type]
+        await self.async_read_registers(readback_start, readback_count)
+        self._notify_update_listeners()
+        return summary
+
+    async def async_update_status(self) -> None:
+        """Read just the status registers (the ones that change on their own) and notify listeners.
+
+        Much cheaper than a full async_update, so can be done far more often. Falls back to a
+        full update if the device hasn't been read yet, or has writes waiting to be written to it.
+        """
+        if self.device_type is None or self.write_queue:
+            await self.async_update()
+            return
+        await self.async_read_register_blocks(plan_register_reads(STATUS_BLOCK_START, STATUS_BLOCK_END, self.block_sizes.read))
+        self.last_status_update_time = time.time()
+        self._add_relay_runtime()
+        self._notify_update_listeners()
+
     async def async_update(self) -> None:
         _LOGGER.debug("Updating register store for device %s at %s", self._slave_id, self._host)
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
 
-        register_updated_values = [None] * 218
-        
-        MAX_REGISTER_UPDATE_COUNT = 10
+        register_updated_values = [None] * REGISTER_COUNT
 
-        # Seems like the most amount of registers we can update at a time is 10
-        for i in range(0,210,MAX_REGISTER_UPDATE_COUNT):
-            result = await client.read_holding_registers(i, count=MAX_REGISTER_UPDATE_COUNT, device_id=self._slave_id)     # get information from device
-            register_updated_values[i:i+MAX_REGISTER_UPDATE_COUNT] = result.registers
+        # 10 at a time unless a larger block size has been probed, see async_probe_block_sizes
+        reads = plan_register_reads(0, REGISTER_COUNT - 1, self.block_sizes.read)
+        for (block_start, block_count), values in zip(reads, await self._async_read_blocks(reads)):     # get information from device
+            register_updated_values[block_start:block_start + block_count] = values
 
-        result = await client.read_holding_registers(210, count=8, device_id=self._slave_id)     # Do last 8 seperately
-        register_updated_values[210:218] = result.registers
-        client.close()
-        self.registers = register_updated_values
+        self._set_registers(0, register_updated_values)
+        self._show_debounced_writes(0, REGISTER_COUNT)
+        self.last_update_time = time.time()
+        self.last_status_update_time = self.last_update_time
+        self._add_relay_runtime()
         
         # Check to see whether the device is a thermostat or a timer
         # Technically this should never change, but check just in case
@@ -76,9 +515,17 @@ class heatmiser_edge_register_store:
         else:
             self.device_type = DEVICE_TYPE_TIMER
         
-        await self.async_update_device_time()  # Ensure the device time is correct
-        # NB This shouldn't be checked this often as it involves writing to the device
-        # Ideally only once a day should be enough
+        if self.write_queue:
+            # The device is answering again, so write anything queued while it wasn't
+            try:
+                await self.async_flush_write_queue()
+            except Exception as ex:
+                _LOGGER.warning(f"Unable to write queued writes to device {self._slave_id} at {self._host}, will try again: {ex}")
+
+        if self.sync_device_time:
+            await self.async_update_device_time()  # Ensure the device time is correct
+            # NB This shouldn't be checked this often as it involves writing to the device
+            # Ideally only once a day should be enough
         
         # Notify listeners (HA entities) that new data is available
         self._notify_update_listeners()
@@ -90,19 +537,22 @@ class heatmiser_edge_register_store:
         
         if (self.time_of_next_update is None) or (current_time > (self.time_of_next_update)):
             # Last update was more than a day ago, so update the time
-            
-            # Update the time on the device to match the time on the HA server
-            _LOGGER.debug("Updating time on device %d to match HA time", self._slave_id)
-            
-            is_dst = current_time.tm_isdst
-
-            year = current_time.tm_year
-            month_day = (current_time.tm_mon << 8) + current_time.tm_mday
-            hour_minute = (current_time.tm_hour << 8) + current_time.tm_min
-            second = current_time.tm_sec
-            _LOGGER.info("Updating time on device %d to %d-%02d-%02d %02d:%02d:%02d",self._slave_id, year, current_time.tm_mon, current_time.tm_mday, current_time.tm_hour, current_time.tm_min, current_time.tm_sec)
-            client = AsyncModbusTcpClient(self._host)
-            await client.connect()
+            if self.use_broadcast:
+                # Sets every device on the gateway at once, and their next updates
+                await async_broadcast_device_time(self.gateway, self)
+            else:
+                await self.async_write_device_time()
+
+    async def async_write_device_time(self) -> None:
+        """Set the time on the device to match the time on the HA server."""
+        current_time = time.localtime()
+        _LOGGER.debug("Updating time on device %d to match HA time", self._slave_id)
+        
+        is_dst = current_time.tm_isdst
+
+        year, month_day, hour_minute, second = device_time_values(current_time)
+        _LOGGER.info("Updating time on device %d to %d-%02d-%02d %02d:%02d:%02d",self._slave_id, year, current_time.tm_mon, current_time.tm_mday, current_time.tm_hour, current_time.tm_min, current_time.tm_sec)
+        async with self.gateway.connection(self) as client:
             if int(is_dst) != int(self.registers[int(RegisterAddresses[self.device_type].DAYLIGHT_SAVING_STATUS_RD)]):
                 _LOGGER.info("Updating daylight saving status on device %d to %d", self._slave_id, is_dst)
                 await client.write_register(int(RegisterAddresses[self.device_type].DAYLIGHT_SAVING_STATUS), value=int(is_dst), device_id=self._slave_id)
@@ -110,10 +560,108 @@ class heatmiser_edge_register_store:
             await client.write_register(int(RegisterAddresses[self.device_type].SYNCHRONOUS_RTC_MONTH_DAY), value=month_day, device_id=self._slave_id)
             await client.write_register(int(RegisterAddresses[self.device_type].SYNCHRONOUS_RTC_HOUR_MINUTE), value=hour_minute, device_id=self._slave_id)
             await client.write_register(int(RegisterAddresses[self.device_type].SYNCHRONOUS_RTC_SECOND), value=second, device_id=self._slave_id)
-            client.close()
-            
-            self.time_of_next_update = time.localtime(time.time() + 3600) # Set the next update to be in an hour
         
+        self.schedule_next_time_update()
+
+    def schedule_next_time_update(self) -> None:
+        self.time_of_next_update = time.localtime(time.time() + 3600) # Set the next update to be in an hour
+
+    async def async_confirm_device_time(self, current_time: time.struct_time) -> bool:
+        """Read back the device's clock and daylight saving flag, returning True if they match current_time.
+
+        The clock may have ticked on since it was set, so the time only needs to be within a couple of minutes.
+        """
+        await self.async_read_register_blocks([(DAYLIGHT_SAVING_REGISTER, 1), (RTC_START_REGISTER, 3)])
+        year, month_day, hour_minute, _ = device_time_values(current_time)
+        device_hour_minute = self.registers[RTC_START_REGISTER + 2]
+        minutes_out = abs(((device_hour_minute >> 8) * 60 + (device_hour_minute & 0xFF)) - ((hour_minute >> 8) * 60 + (hour_minute & 0xFF)))
+        return (
+            self.registers[DAYLIGHT_SAVING_REGISTER] == int(current_time.tm_isdst)
+            and self.registers[RTC_START_REGISTER] == year
+            and self.registers[RTC_START_REGISTER + 1] == month_day
+            and min(minutes_out, 24 * 60 - minutes_out) <= BROADCAST_TIME_TOLERANCE
+        )
+        
+    def seconds_until_schedule_transition(self) -> Optional[float]:
+        """Seconds until the device's schedule next changes, from the cached schedule registers.
+
+        None if the registers haven't been read yet or the device isn't following a schedule.
+        The device clock is kept in step with this machine's, so the device's day and time
+        are taken to be local time. The schedule is only decoded again when its registers
+        change, and the next transition only worked out again once it has passed.
+        """
+        if self.device_type is None:
+            return None
+        key = schedule_key(self.registers, self.device_type)
+        if key != self._schedule_key:
+            self.weekly_schedule = WeeklySchedule.from_registers(self.registers, self.device_type)
+            self._schedule_key = key
+            self._next_schedule_transition = None
+        now = datetime.now()
+        if self._next_schedule_transition is None or self._next_schedule_transition <= now:
+            self._next_schedule_transition = self.weekly_schedule.next_transition(now)
+        if self._next_schedule_transition is None:
+            return None
+        return (self._next_schedule_transition - now).total_seconds()
+
+    async def async_probe_block_sizes(self) -> BlockSizes:
+        """Find the largest blocks of registers the device can read and write in one go, and use them from now on.
+
+        Takes a few dozen transactions, so the result should be saved (by firmware version) rather
+        than probed every time. Each attempt gets a connection of its own, as a gateway that
+        doesn't like a request may leave the connection unusable. The device must have been read first.
+        """
+        async def read_block(start: int, count: int) -> Optional[List[int]]:
+            try:
+                async with self.gateway.connection(self) as client:
+                    result = await client.read_holding_registers(start, count=count, device_id=self._slave_id)
+            except Exception as ex:
+                _LOGGER.debug("Reading %d registers from device %s at %s failed: %s", count, self._slave_id, self._host, ex)
+                return None
+            return None if result.isError() else list(result.registers)
+
+        async def write_block(start: int, values: List[int]) -> bool:
+            try:
+                async with self.gateway.connection(self) as client:
+                    result = await client.write_registers(start, values, device_id=self._slave_id)
+            except Exception as ex:
+                _LOGGER.debug("Writing %d registers to device %s at %s failed: %s", len(values), self._slave_id, self._host, ex)
+                return False
+            return not result.isError()
+
+        self.block_sizes = await async_probe_block_sizes(read_block, write_block, self.device_type)
+        _LOGGER.info("Device %s at %s can read %d and write %d registers at a time", self._slave_id, self._host, self.block_sizes.read, self.block_sizes.write)
+        return self.block_sizes
+
+    def close(self) -> None:
+        """Stop using the gateway. The store shouldn't be used after this.
+
+        Debounced writes still waiting are queued (see write_queue.py) rather than lost.
+        """
+        if self._debounce_task is not None:
+            self._debounce_task.cancel()
+            self._debounce_task = None
+            changes, batch = self._take_debounced_writes()
+            for register, value in changes.items():
+                self.write_queue.add(register, [value])
+            self._finish_debounced_writes(batch, keep_shown=True)
+            self._write_queue_changed()
+        release_gateway(self.gateway, self)
+
+    def _check_result(self, result, start_register: int, count: int) -> None:
+        if result.isError():
+            raise IOError(f"Error reading registers {start_register} to {start_register + count - 1} from device {self._slave_id} at {self._host}: {result}")
+
+    def to_snapshot(self) -> Snapshot:
+        """Return a snapshot of the cached registers."""
+        return Snapshot(
+            registers=list(self.registers),
+            host=self._host,
+            unit_id=self._slave_id,
+            device_type=self.device_type,
+            timestamp=self.last_update_time,
+        )
+
     def add_update_listener(self, listener: Callable[[], None]) -> Callable[[], None]:
         """Register a listener that will be called after each successful update.
         Returns a function that, when called, removes the listener.
@@ -126,6 +674,44 @@ class heatmiser_edge_register_store:
                 pass
         return _remove
 
+    def add_register_listener(self, registers, listener: Callable[["heatmiser_edge_register_store", Dict[int, Tuple[Optional[int], int]]], None]) -> Callable[[], None]:
+        """Register a listener that will be called as soon as any of registers changes value in the cache.
+
+        Called with the store and {register: (old value, new value)} for just the registers that
+        changed (as read from or written to the device, not debounced writes still waiting).
+        Returns a function that, when called, removes the listener.
+        """
+        entry = (frozenset(int(register) for register in registers), listener)
+        self._register_listeners.append(entry)
+        def _remove() -> None:
+            try:
+                self._register_listeners.remove(entry)
+            except ValueError:
+                pass
+        return _remove
+
+    def _set_registers(self, start_register: int, values: List[int]) -> None:
+        """Update the cache from start_register, telling the register listeners about any that changed."""
+        changed = {}
+        if self._register_listeners:
+            for register, value in enumerate(values, start_register):
+                if self.registers[register] != value:
+                    changed[register] = (self.registers[register], value)
+        self.registers[start_register:start_register + len(values)] = values
+        for registers, listener in list(self._register_listeners):
+            listener_changes = {register: change for register, change in changed.items() if register in registers}
+            if listener_changes:
+                try:
+                    listener(self, listener_changes)
+                except Exception as exc:  # pragma: no cover
+                    _LOGGER.debug("Register listener raised: %s", exc)
+
+    def _add_relay_runtime(self) -> None:
+        """Add the time since the last poll to relay_runtime, using the relay status just read."""
+        relay = self._device_value(int(ThermostatRegisterAddresses.RELAY_STATUS_RD)) # Same register on timers
+        if relay is not None:
+            self.relay_runtime.add(bool(relay), self.last_status_update_time)
+
     def _notify_update_listeners(self) -> None:
         """Notify all registered listeners that an update occurred."""
         for listener in list(self._update_listeners):
@@ -134,6 +720,18 @@ class heatmiser_edge_register_store:
             except Exception as exc:  # pragma: no cover
                 _LOGGER.debug("Update listener raised: %s", exc)
 
+class TransactionError(IOError):
+    """A transaction failed part way. summary says how far it got and whether it was rolled back."""
+
+    def __init__(self, message: str, summary: dict) -> None:
+        super().__init__(message)
+        self.summary = summary
+
+
+def _is_unreachable(ex: Exception) -> bool:
+    """Whether ex means the device (or its gateway) couldn't be reached, rather than it refusing the request."""
+    return isinstance(ex, (ConnectionError, asyncio.TimeoutError, ConnectionException, ModbusIOException))
+
 # class HeatmiserDevice:
 #     def __init__(self, host, port, modbus_id) -> None:
 #         _LOGGER.warning("Initialising Device")
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .const import *
+from .gateway import get_gateway, release_gateway
+from .heatmiser_edge import heatmiser_edge_register_store
+from .poller import async_poll_in_turn
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def device_identifier(host: str, slave_id: int, device_type: int) -> str:
+    """The device registry identifier used by every entity of a channel."""
+    return f"{DOMAIN}{host}{slave_id}{device_type}"
+
+
+def parse_unit_ids(text: str) -> List[int]:
+    """Unit IDs from a list such as "1-4,7", in order and without repeats. Raises ValueError if it can't be read."""
+    unit_ids: List[int] = []
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        for unit_id in range(int(first), int(last or first) + 1):
+            if not 1 <= unit_id <= 247:
+                raise ValueError(f"Unit ID {unit_id} is outside 1 to 247")
+            if unit_id not in unit_ids:
+                unit_ids.append(unit_id)
+    if not unit_ids:
+        raise ValueError("No unit IDs given")
+    return unit_ids
+
+
+async def async_discover_units(host: str, port: int, unit_ids: List[int]) -> List[int]:
+    """Return the unit IDs in unit_ids that answer on the gateway at host:port."""
+    gateway = get_gateway(host, port)
+    found = []
+    try:
+        for unit_id in unit_ids:
+            try:
+                async with gateway.connection() as client:
+                    result = await asyncio.wait_for(
+                        client.read_holding_registers(0, count=1, device_id=unit_id), DISCOVERY_TIMEOUT
+                    )
+            except ConnectionError:
+                raise
+            except Exception as ex:  # Most likely a timeout, nothing at that address
+                _LOGGER.debug("No answer from unit %d at %s:%s: %s", unit_id, host, port, ex)
+                continue
+            if not result.isError():
+                found.append(unit_id)
+    finally:
+        release_gateway(gateway)
+    return found
+
+
+class HeatmiserEdgeHub:
+    """A gateway and every channel (device) behind it, all polled from one loop.
+
+    Each channel keeps its own register store and poller, so its interval still adapts to the
+    device, but the polls are taken in turn by a single task rather than a task per device.
+
+    Channels that can't be read when the entry is set up are kept, and tried again every
+    CHANNEL_RETRY_INTERVAL seconds. Once one answers it is set up (on_channel_added), its
+    entities are added by each platform (see add_platform) and it joins the poll loop.
+    """
+
+    def __init__(self, host: str, port: int, channels: List[dict]) -> None:
+        self.host = host
+        self.port = port
+        self.names: Dict[int, str] = {}
+        self.stores: Dict[int, heatmiser_edge_register_store] = {}
+        for channel in channels:
+            slave_id = int(channel[CONF_MODBUS_ID])
+            self.names[slave_id] = channel.get("name") or f"{host} {slave_id}"
+            self.stores[slave_id] = heatmiser_edge_register_store(host, port, slave_id)
+        self.failed: List[int] = [] # Unit IDs of channels that haven't been read yet
+        self.on_channel_added: Optional[Callable[[int, str, heatmiser_edge_register_store], Awaitable[None]]] = None
+        self._platforms: List[Tuple[Optional[int], Callable[[int, str, heatmiser_edge_register_store], None]]] = []
+        self._create_task = None
+        self._task: Optional[asyncio.Task] = None
+        self._retry_task: Optional[asyncio.Task] = None
+
+    async def async_first_update(self) -> List[int]:
+        """Read every channel for the first time, returning the unit IDs that couldn't be read."""
+        results = await asyncio.gather(*(store.async_update() for store in self.stores.values()), return_exceptions=True)
+        failed = []
+        for (slave_id, store), result in zip(self.stores.items(), results):
+            if isinstance(result, BaseException) or store.device_type is None:
+                _LOGGER.warning(f"Unable to read {self.host} channel {slave_id}, will keep trying: {result}")
+                failed.append(slave_id)
+        self.failed = failed
+        return failed
+
+    def channels(self, device_type: Optional[int] = None) -> Iterator[Tuple[int, str, heatmiser_edge_register_store]]:
+        """(slave id, name, register store) for each channel that has been read, optionally just those of one device type."""
+        for slave_id, store in self.stores.items():
+            if store.device_type is not None and (device_type is None or store.device_type == device_type):
+                yield slave_id, self.names[slave_id], store
+
+    def add_platform(self, device_type: Optional[int], add_channel_entities: Callable[[int, str, heatmiser_edge_register_store], None]) -> None:
+        """Add a platform's entities, with add_channel_entities(slave id, name, register store), for each channel of device_type (all if None).
+
+        Called for the channels read so far straight away, and for the rest as they first answer.
+        """
+        self._platforms.append((device_type, add_channel_entities))
+        for slave_id, name, store in self.channels(device_type):
+            add_channel_entities(slave_id, name, store)
+
+    def store_for_device(self, identifiers) -> Optional[heatmiser_edge_register_store]:
+        """The register store for a device registry entry with the given identifiers, if it's one of this hub's."""
+        for slave_id, _, store in self.channels():
+            if (DOMAIN, device_identifier(self.host, slave_id, store.device_type)) in identifiers:
+                return store
+        return None
+
+    def write_queues(self) -> dict:
+        """Each channel's queued writes, keyed by slave id (as a string), for storage. Channels with none are left out."""
+        return {str(slave_id): store.write_queue.to_dict() for slave_id, store in self.stores.items() if store.write_queue}
+
+    def relay_runtimes(self) -> dict:
+        """Each channel's relay runtime history, keyed by slave id (as a string), for storage."""
+        return {str(slave_id): store.relay_runtime.to_dict() for slave_id, store in self.stores.items()}
+
+    def start(self, create_task=None) -> None:
+        """Start polling every channel in the background, and retrying those not read yet. create_task defaults to asyncio.create_task."""
+        self._create_task = create_task or asyncio.create_task
+        pollers = [store.poller for _, _, store in self.channels() if store.poller is not None]
+        if self._task is None and pollers:
+            self._task = self._create_task(async_poll_in_turn(pollers))
+        if self._retry_task is None and self.failed:
+            self._retry_task = self._create_task(self._async_retry_failed())
+
+    def stop(self) -> None:
+        for task in (self._task, self._retry_task):
+            if task is not None:
+                task.cancel()
+        self._task = self._retry_task = None
+
+    async def _async_retry_failed(self) -> None:
+        """Try the channels not read yet every CHANNEL_RETRY_INTERVAL seconds, adding each one once it answers."""
+        while self.failed:
+            await asyncio.sleep(CHANNEL_RETRY_INTERVAL)
+            added = False
+            for slave_id in list(self.failed):
+                store = self.stores[slave_id]
+                try:
+                    await store.async_update()
+                except Exception as ex:
+                    _LOGGER.debug(f"{self.host} channel {slave_id} still can't be read: {ex}")
+                    continue
+                if store.device_type is None:
+                    continue
+                _LOGGER.info(f"{self.host} channel {slave_id} has answered, adding it")
+                self.failed.remove(slave_id)
+                name = self.names[slave_id]
+                if self.on_channel_added is not None:
+                    await self.on_channel_added(slave_id, name, store)
+                for device_type, add_channel_entities in self._platforms:
+                    if device_type is None or device_type == store.device_type:
+                        add_channel_entities(slave_id, name, store)
+                added = True
+            if added:
+                # Start the poll loop again with the new channels in it
+                if self._task is not None:
+                    self._task.cancel()
+                    self._task = None
+                pollers = [store.poller for _, _, store in self.channels() if store.poller is not None]
+                if pollers:
+                    self._task = self._create_task(async_poll_in_turn(pollers))
+        self._retry_task = None
+
+    def close(self) -> None:
+        """Stop polling and stop using the gateway. The hub shouldn't be used after this."""
+        self.stop()
+        for store in self.stores.values():
+            store.close()
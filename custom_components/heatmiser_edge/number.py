@@ -42,12 +42,14 @@ async def async_setup_entry(
     async_add_entities: AddEntitiesCallback,
 ) -> None:
     """Add cover for passed config_entry in HA."""
-    register_store = hass.data[DOMAIN][config_entry.entry_id]
+    hub = hass.data[DOMAIN][config_entry.entry_id]
+    hub.add_platform(
+        None, lambda slave_id, name, register_store: _add_channel_entities(hub.host, hub.port, slave_id, name, register_store, async_add_entities)
+    )
 
-    host = config_entry.data["host"]
-    port = config_entry.data["port"]
-    slave_id = config_entry.data["modbus_id"]
-    name = config_entry.data["name"]
+
+def _add_channel_entities(host, port, slave_id, name, register_store: heatmiser_edge_register_store, async_add_entities: AddEntitiesCallback) -> None:
+    """Add the entities for one channel (device) on the gateway."""
 
     GenericWritableRegisters = []
     
@@ -200,15 +202,8 @@ class HeatmiserEdgeWritableRegisterGeneric(NumberEntity):
 
     async def async_set_native_value(self,value: float) -> None:
         """Update the current value."""
-        _LOGGER.warning("Attempting to set native value")
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(self._register_id, value=int(value)*self._gain , device_id=self._slave_id)
-        client.close()
-
-        self._native_value = int(value)
-        
-        await self.register_store.async_update()  # Force an update to ensure HA shows the correct value
+        # Shown straight away, written (then just this register read back) once the value stops changing
+        self.register_store.write_registers_debounced({self._register_id: round(value*self._gain)})
 
 
 class HeatmiserEdgeWritableRegisterTemp(NumberEntity):
@@ -288,12 +283,5 @@ class HeatmiserEdgeWritableRegisterTemp(NumberEntity):
 
     async def async_set_native_value(self,value: float) -> None:
         """Update the current value."""
-        _LOGGER.warning("Attempting to set native value")
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(self._register_id, value=int(value)*10 , device_id=self._slave_id)
-        client.close()
-
-        self._native_value = int(value)
-        
-        await self.register_store.async_update()  # Force an update to ensure HA shows the correct value
\ No newline at end of file
+        # Shown straight away, written (then just this register read back) once the value stops changing
+        self.register_store.write_registers_debounced({self._register_id: round(value*10)})
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""Read holding registers with several Modbus TCP requests in flight on one connection.
+
+Modbus TCP tags every request with a transaction ID which the response echoes, so a gateway
+that queues requests can be sent the next one before answering the last. Reading a whole
+device then costs roughly one round trip plus the time on the RS485 bus, rather than one
+round trip per block.
+
+Not every gateway copes with this. Anything unexpected (a response with an unknown
+transaction ID or from the wrong unit, a malformed frame or the connection dropping) raises
+PipelineError, so the caller can fall back to one request at a time. A response not arriving
+in time raises PipelineTimeout instead, as that's usually just the one device being offline or
+slow rather than the gateway getting pipelining wrong.
+
+It talks to the gateway over its own asyncio connection rather than through pymodbus, whose
+clients wait for each response before sending the next request.
+"""
+from __future__ import annotations
+
+import asyncio
+import struct
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+READ_HOLDING_REGISTERS = 0x03
+_MBAP_HEADER = struct.Struct(">HHHB")  # Transaction ID, protocol ID (always 0), length, unit ID
+DEFAULT_PIPELINE_TIMEOUT = 5.0 # Seconds to wait for each response
+
+
+class PipelineError(Exception):
+    """The gateway didn't handle pipelined requests properly."""
+
+
+class PipelineTimeout(IOError):
+    """A request wasn't answered in time (most likely the device is offline or slow)."""
+
+
+class ModbusExceptionResponse(IOError):
+    """The device answered a request with a Modbus exception."""
+
+    def __init__(self, start_register: int, count: int, exception_code: int) -> None:
+        super().__init__(f"Exception {exception_code} reading registers {start_register} to {start_register + count - 1}")
+        self.exception_code = exception_code
+
+
+class PipelinedModbusClient:
+    """A Modbus TCP connection that keeps up to window read requests in flight at once."""
+
+    def __init__(self, host: str, port: int, window: int, timeout: float = DEFAULT_PIPELINE_TIMEOUT) -> None:
+        self.host = host
+        self.port = port
+        self.window = max(1, int(window))
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._receive_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_transaction_id = 0
+        self._failure: Optional[Exception] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and self._failure is None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as ex:
+            raise ConnectionError(f"Unable to connect to {self.host}:{self.port}: {ex}") from ex
+        self._receive_task = asyncio.get_running_loop().create_task(self._async_receive())
+
+    async def async_read_blocks(
+        self,
+        unit_id: int,
+        reads: Sequence[Tuple[int, int]],
+        before_request: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> List[List[int]]:
+        """Read each (start register, count) block, returning the values of each in the same order.
+
+        before_request is awaited before each request is sent (e.g. to wait for a rate limit).
+        """
+        window = asyncio.Semaphore(self.window)
+
+        async def read(start_register: int, count: int) -> List[int]:
+            async with window:
+                if before_request is not None:
+                    await before_request()
+                return await self._async_request(unit_id, start_register, count)
+
+        tasks = [asyncio.ensure_future(read(start_register, count)) for start_register, count in reads]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _async_request(self, unit_id: int, start_register: int, count: int) -> List[int]:
+        if not self.connected:
+            raise PipelineError(f"Connection to {self.host}:{self.port} is closed") from self._failure
+        transaction_id = self._next_transaction_id
+        self._next_transaction_id = (self._next_transaction_id + 1) & 0xFFFF
+        pdu = struct.pack(">BHH", READ_HOLDING_REGISTERS, start_register, count)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[transaction_id] = future
+        try:
+            self._writer.write(_MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+            await self._writer.drain()
+            response_unit_id, response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError as ex:
+            raise PipelineTimeout(f"No response from unit {unit_id} at {self.host}:{self.port} to transaction {transaction_id}") from ex
+        except OSError as ex:
+            self._fail(PipelineError(f"Connection to {self.host}:{self.port} failed: {ex}"))
+            raise self._failure from ex
+        finally:
+            self._pending.pop(transaction_id, None)
+
+        if response_unit_id != unit_id:
+            self._fail(PipelineError(f"Transaction {transaction_id} answered by unit {response_unit_id} rather than {unit_id}"))
+            raise self._failure
+        function_code = response[0]
+        if function_code == READ_HOLDING_REGISTERS | 0x80 and len(response) >= 2:
+            raise ModbusExceptionResponse(start_register, count, response[1])
+        if function_code != READ_HOLDING_REGISTERS or len(response) != 2 + count * 2 or response[1] != count * 2:
+            self._fail(PipelineError(f"Unexpected response to transaction {transaction_id} from {self.host}:{self.port}"))
+            raise self._failure
+        return list(struct.unpack(f">{count}H", response[2:]))
+
+    async def _async_receive(self) -> None:
+        """Match each response to its request by transaction ID."""
+        try:
+            while True:
+                header = await self._reader.readexactly(_MBAP_HEADER.size)
+                transaction_id, protocol_id, length, unit_id = _MBAP_HEADER.unpack(header)
+                if protocol_id != 0 or length < 2:
+                    raise PipelineError(f"Malformed frame from {self.host}:{self.port}")
+                pdu = await self._reader.readexactly(length - 1)
+                future = self._pending.get(transaction_id)
+                if future is None:
+                    raise PipelineError(f"Response from {self.host}:{self.port} with unknown transaction ID {transaction_id}")
+                if not future.done():
+                    future.set_result((unit_id, pdu))
+        except asyncio.CancelledError:
+            raise
+        except PipelineError as ex:
+            self._fail(ex)
+        except Exception as ex:
+            self._fail(PipelineError(f"Connection to {self.host}:{self.port} failed: {ex}"))
+
+    def _fail(self, failure: Exception) -> None:
+        """Give up on the connection, failing every request still waiting for a response."""
+        if self._failure is None:
+            self._failure = failure
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(self._failure)
+        self._pending.clear()
+        if self._writer is not None:
+            self._writer.close()
+
+    def close(self) -> None:
+        if self._receive_task is not None:
+            self._receive_task.cancel()
+            self._receive_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
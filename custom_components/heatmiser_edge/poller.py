@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RegisterStorePoller:
+    """Keeps a register store up to date by polling it on a timer.
+
+    Polling is tiered: the status registers are read every poll, and every register
+    (settings and schedule as well) is read every full_every intervals.
+
+    The interval adapts to the device: after a poll that saw the relay, temperatures, mode
+    or schedule period change it drops to min_interval, and once nothing has changed for a
+    few polls it stretches towards max_interval.
+
+    Separately from the regular polls, the status registers are read a few seconds after each
+    scheduled period starts (worked out from the cached schedule), so the new set temperature
+    and relay state show up straight away without polling any more often the rest of the time.
+    """
+
+    def __init__(
+        self,
+        register_store,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        full_every: int = DEFAULT_FULL_POLL_EVERY,
+        min_interval: Optional[float] = None,
+        max_interval: Optional[float] = None,
+    ) -> None:
+        self.register_store = register_store
+        self.interval = interval
+        self.min_interval = min(interval, DEFAULT_MIN_POLL_INTERVAL if min_interval is None else min_interval)
+        self.max_interval = max(interval, DEFAULT_MAX_POLL_INTERVAL if max_interval is None else max_interval)
+        self.full_interval = interval * max(1, int(full_every))
+        self.current_interval = interval
+        self.quiet_polls = 0
+        self._watched_values: Optional[Tuple] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Statistics, for diagnostics and the exporter
+        self.polls = 0
+        self.last_poll_ok = False
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_poll_time: Optional[float] = None
+        self.last_poll_duration: Optional[float] = None
+        self.poll_duration_sum = 0.0
+        self.registers_read = 0
+
+    async def async_poll(self, status_only: bool = False) -> bool:
+        """Poll once, returning True if it worked.
+
+        Reads every register if it's time to, unless status_only is set.
+        """
+        last_full = self.register_store.last_update_time
+        full = last_full is None or (not status_only and time.time() - last_full >= self.full_interval)
+        started = time.monotonic()
+        try:
+            if full:
+                await self.register_store.async_update()
+            else:
+                await self.register_store.async_update_status()
+        except Exception as ex:
+            self.errors += 1
+            self.last_error = str(ex)
+            self.last_poll_ok = False
+            self.current_interval = self.interval  # Don't back off from a device that isn't answering
+            _LOGGER.warning("Polling device %s at %s failed: %s", self.register_store._slave_id, self.register_store._host, ex)
+            return False
+        finally:
+            self.last_poll_duration = time.monotonic() - started
+            self.poll_duration_sum += self.last_poll_duration
+            self.last_poll_time = time.time()
+        self.polls += 1
+        self.registers_read += REGISTER_COUNT if full else STATUS_BLOCK_END - STATUS_BLOCK_START + 1
+        self.last_poll_ok = True
+        self._adapt_interval()
+        return True
+
+    def _adapt_interval(self) -> None:
+        store = self.register_store
+        if store.device_type is None:
+            return
+        values = tuple(store.registers[register] for register in ADAPTIVE_POLL_WATCHED_REGISTERS[store.device_type])
+        if self._watched_values is not None and values != self._watched_values:
+            self.current_interval = self.min_interval
+            self.quiet_polls = 0
+        else:
+            self.quiet_polls += 1
+            if self.quiet_polls >= ADAPTIVE_POLL_QUIET_POLLS:
+                self.current_interval = min(self.max_interval, self.current_interval * ADAPTIVE_POLL_BACKOFF)
+        self._watched_values = values
+
+    def next_delay(self) -> float:
+        """Seconds to wait before the next regular poll, with a little jitter."""
+        return self.current_interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+    def initial_delay(self) -> float:
+        """Seconds to wait before the first poll, so the devices on a gateway take turns through the interval."""
+        offset = self.register_store.gateway.next_poll_offset(self.interval)
+        return offset + self.interval * random.uniform(0, POLL_JITTER)
+
+    def next_transition_delay(self) -> Optional[float]:
+        """Seconds to wait before reading the status registers after the next schedule transition."""
+        transition = self.register_store.seconds_until_schedule_transition()
+        if transition is None:
+            return None
+        return transition + SCHEDULE_TRANSITION_POLL_DELAY
+
+    async def async_run(self, initial_delay: float = 0) -> None:
+        """Poll forever (until cancelled), starting after initial_delay seconds."""
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time() + initial_delay
+        while True:
+            now = loop.time()
+            transition_delay = self.next_transition_delay()
+            if transition_delay is not None and now + transition_delay < next_poll:
+                await asyncio.sleep(transition_delay)
+                await self.async_poll(status_only=True)
+                # Catch up sooner if the transition changed something, but otherwise keep to the regular polls
+                next_poll = min(next_poll, loop.time() + self.next_delay())
+                continue
+            await asyncio.sleep(max(0, next_poll - now))
+            await self.async_poll()
+            next_poll = loop.time() + self.next_delay()
+
+    def start(self, create_task=None, initial_delay: float = 0) -> None:
+        """Start polling in the background. create_task defaults to asyncio.create_task."""
+        if self._task is None:
+            self._task = (create_task or asyncio.create_task)(self.async_run(initial_delay))
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+async def async_poll_in_turn(
+    pollers: List[RegisterStorePoller],
+    poll: Optional[Callable[[RegisterStorePoller, bool], Awaitable[bool]]] = None,
+) -> None:
+    """Poll every device on one gateway from a single loop (until cancelled), each whenever it is due.
+
+    The devices are polled one at a time in due order, so the gateway's RS485 bus is never asked
+    to do more than one thing at once. Each poller still decides its own interval, and as with
+    RegisterStorePoller.async_run, each device's status registers are also read just after each
+    of its schedule transitions. poll(poller, status_only) defaults to poller.async_poll.
+    """
+    if poll is None:
+        poll = lambda poller, status_only: poller.async_poll(status_only=status_only)
+    loop = asyncio.get_running_loop()
+    # Spread the first polls across an interval rather than starting them all at once
+    regular_due = [loop.time() + poller.initial_delay() for poller in pollers]
+    transition_pending = [False] * len(pollers)
+    due = [(due_time, index, False) for index, due_time in enumerate(regular_due)]
+    heapq.heapify(due)
+    while due:
+        due_time, index, transition = heapq.heappop(due)
+        if not transition and due_time != regular_due[index]:
+            continue  # Superseded by an earlier poll
+        delay = due_time - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        poller = pollers[index]
+        await poll(poller, transition)
+
+        now = loop.time()
+        next_regular = now + poller.next_delay()
+        if transition:
+            transition_pending[index] = False
+            if next_regular < regular_due[index]:  # The transition changed something, catch up sooner
+                regular_due[index] = next_regular
+                heapq.heappush(due, (next_regular, index, False))
+        else:
+            regular_due[index] = next_regular
+            heapq.heappush(due, (next_regular, index, False))
+        transition_delay = poller.next_transition_delay()
+        if not transition_pending[index] and transition_delay is not None and now + transition_delay < regular_due[index]:
+            transition_pending[index] = True
+            heapq.heappush(due, (now + transition_delay, index, True))
@@ -0,0 +1,80 @@
+"""Plan block reads and writes against a Heatmiser Edge register image.
+
+backup_and_restore.py in tools/ plans its reads and restores with it as well.
+"""
+from __future__ import annotations
+
+from typing import List, Optional, Sequence, Tuple
+
+RegisterBlock = Tuple[int, List[int]]
+
+
+def changed_registers(current: Sequence[Optional[int]], target: Sequence[Optional[int]], start_register: int) -> List[int]:
+    """Return the register addresses where target differs from current.
+
+    target[0] corresponds to start_register. None in target means "don't care".
+    """
+    changed = []
+    for offset, value in enumerate(target):
+        if value is None:
+            continue
+        register = start_register + offset
+        if register >= len(current) or current[register] != value:
+            changed.append(register)
+    return changed
+
+
+def plan_register_writes(
+    current: Sequence[Optional[int]],
+    target: Sequence[Optional[int]],
+    start_register: int,
+    max_count: int = 10,
+    max_gap: int = 2,
+) -> List[RegisterBlock]:
+    """Work out the smallest set of block writes that turns current into target.
+
+    Runs of changed registers separated by up to max_gap unchanged registers are
+    merged into one write (re-writing the unchanged values) as long as the values
+    in the gap are known and the block fits within max_count.
+    Returns a list of (start register, values) tuples.
+    """
+    changed = changed_registers(current, target, start_register)
+    if not changed:
+        return []
+
+    def value_for(register: int) -> Optional[int]:
+        offset = register - start_register
+        if 0 <= offset < len(target) and target[offset] is not None:
+            return target[offset]
+        if register < len(current):
+            return current[register]
+        return None
+
+    # Group the changed registers into [first, last] runs
+    runs: List[List[int]] = [[changed[0], changed[0]]]
+    for register in changed[1:]:
+        run = runs[-1]
+        gap = register - run[1] - 1
+        if (
+            gap <= max_gap
+            and (register - run[0] + 1) <= max_count
+            and all(value_for(r) is not None for r in range(run[1] + 1, register))
+        ):
+            run[1] = register
+        else:
+            runs.append([register, register])
+
+    blocks: List[RegisterBlock] = []
+    for first, last in runs:
+        for block_start in range(first, last + 1, max_count):
+            block_end = min(block_start + max_count - 1, last)
+            blocks.append((block_start, [value_for(r) for r in range(block_start, block_end + 1)]))
+    return blocks
+
+
+def plan_register_reads(start_register: int, end_register: int, max_count: int = 10) -> List[Tuple[int, int]]:
+    """Split the inclusive range start..end into (start, count) reads of at most max_count."""
+    return [
+        (block_start, min(max_count, end_register - block_start + 1))
+        for block_start in range(start_register, end_register + 1, max_count)
+    ]
@@ -0,0 +1,163 @@
+"""How long a device's relay has been on, from the relay status read on each poll.
+
+Between two polls the relay is taken to have stayed as it was at the first of them, so each
+poll adds the time since the last one (split across fixed length buckets) to the runtime. Gaps
+between polls longer than max_gap (e.g. while the device couldn't be reached) aren't counted at
+all, rather than guessing.
+
+The buckets are kept in fixed size ring buffers (typed arrays, oldest overwritten) covering the
+last few days, along with the time each bucket was actually covered by polls, so the duty cycle
+is the fraction of the time known about. Running totals for today and for the last hour are kept
+as the buckets come and go, so each poll costs the same however much history is kept.
+"""
+from __future__ import annotations
+
+import base64
+import time
+from array import array
+from datetime import date
+from typing import Optional
+
+from .const import RUNTIME_BUCKET_SECONDS, RUNTIME_DAYS, RUNTIME_MAX_GAP
+
+
+class RelayRuntime:
+    """Relay on time and polled time per bucket for the last days, with today's and the last hour's totals."""
+
+    def __init__(self, bucket_seconds: int = RUNTIME_BUCKET_SECONDS, days: int = RUNTIME_DAYS, max_gap: float = RUNTIME_MAX_GAP) -> None:
+        self.bucket_seconds = int(bucket_seconds)
+        self.bucket_count = int(days * 86400 // self.bucket_seconds)
+        self.hour_buckets = max(1, 3600 // self.bucket_seconds)
+        self.max_gap = max_gap
+        self._on = array("f", bytes(4 * self.bucket_count)) # Seconds the relay was on, per bucket
+        self._covered = array("f", bytes(4 * self.bucket_count)) # Seconds covered by polls, per bucket
+        self._head: Optional[int] = None # Number (time // bucket_seconds) of the newest bucket
+        self._hour_on = 0.0 # Totals over the newest hour_buckets buckets
+        self._hour_covered = 0.0
+        self._today: Optional[date] = None
+        self._today_on = 0.0
+        self._last_time: Optional[float] = None
+        self._last_on = False
+
+    def add(self, relay_on: bool, timestamp: Optional[float] = None) -> None:
+        """Record the relay state read by a poll at timestamp (time.time(), defaults to now)."""
+        now = time.time() if timestamp is None else timestamp
+        if self._last_time is not None and now > self._last_time:
+            if now - self._last_time <= self.max_gap:
+                self._add_interval(self._last_time, now, self._last_on)
+            else:
+                self._advance(int(now // self.bucket_seconds))
+        if self._last_time is None or now > self._last_time:
+            self._last_time = now
+            self._last_on = bool(relay_on)
+
+    def runtime_today(self, now: Optional[float] = None) -> float:
+        """Seconds the relay has been on since local midnight."""
+        now = time.time() if now is None else now
+        if self._today != date.fromtimestamp(now):
+            return 0.0
+        return self._today_on
+
+    def duty_cycle_last_hour(self, now: Optional[float] = None) -> Optional[float]:
+        """Fraction (0 to 1) of the last hour polled that the relay was on, or None if none of it was.
+
+        Buckets that have dropped out of the hour since the last poll (e.g. the device can't be
+        reached) are left out, so it goes to None rather than repeating an old figure.
+        """
+        if self._head is None:
+            return None
+        now = time.time() if now is None else now
+        hour_on, hour_covered = self._hour_on, self._hour_covered
+        # At most hour_buckets of them, however long it's been
+        first = self._head - self.hour_buckets + 1
+        for bucket in range(first, min(self._head, int(now // self.bucket_seconds) - self.hour_buckets) + 1):
+            hour_on -= self._on[bucket % self.bucket_count]
+            hour_covered -= self._covered[bucket % self.bucket_count]
+        if hour_covered <= 0:
+            return None
+        return min(1.0, max(0.0, hour_on / hour_covered))
+
+    def daily_runtimes(self) -> dict:
+        """Seconds the relay was on on each local day still in the buffers, keyed by ISO date. Goes through every bucket."""
+        if self._head is None:
+            return {}
+        days: dict = {}
+        for bucket in range(self._head - self.bucket_count + 1, self._head + 1):
+            index = bucket % self.bucket_count
+            if self._covered[index]:
+                day = date.fromtimestamp(bucket * self.bucket_seconds).isoformat()
+                days[day] = days.get(day, 0.0) + self._on[index]
+        return days
+
+    def _add_interval(self, start: float, end: float, relay_on: bool) -> None:
+        """Spread start to end across the buckets it covers (usually just one)."""
+        while start < end:
+            bucket = int(start // self.bucket_seconds)
+            bucket_end = min(end, (bucket + 1) * self.bucket_seconds)
+            self._advance(bucket)
+            seconds = bucket_end - start
+            on_seconds = seconds if relay_on else 0.0
+            index = bucket % self.bucket_count
+            self._covered[index] += seconds
+            self._on[index] += on_seconds
+            if bucket > self._head - self.hour_buckets:
+                self._hour_covered += seconds
+                self._hour_on += on_seconds
+            # Buckets don't straddle midnight (as long as the UTC offset is a whole number of buckets)
+            day = date.fromtimestamp(start)
+            if day != self._today:
+                self._today, self._today_on = day, 0.0
+            self._today_on += on_seconds
+            start = bucket_end
+
+    def _advance(self, bucket: int) -> None:
+        """Make bucket the newest, clearing the ones it takes the place of and dropping those leaving the last hour."""
+        if self._head is None:
+            self._head = bucket
+            return
+        if bucket <= self._head:
+            return
+        if bucket - self._head >= self.bucket_count:
+            # Everything kept is out of date
+            self._on = array("f", bytes(4 * self.bucket_count))
+            self._covered = array("f", bytes(4 * self.bucket_count))
+            self._hour_on = self._hour_covered = 0.0
+        else:
+            for new_bucket in range(self._head + 1, bucket + 1):
+                leaving = (new_bucket - self.hour_buckets) % self.bucket_count
+                self._hour_on -= self._on[leaving]
+                self._hour_covered -= self._covered[leaving]
+                index = new_bucket % self.bucket_count
+                self._on[index] = 0.0
+                self._covered[index] = 0.0
+        self._head = bucket
+
+    def to_dict(self) -> dict:
+        """For storage, with the buffers as base64."""
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "bucket_count": self.bucket_count,
+            "head": self._head,
+            "on": base64.b64encode(self._on.tobytes()).decode(),
+            "covered": base64.b64encode(self._covered.tobytes()).decode(),
+            "today": None if self._today is None else self._today.isoformat(),
+            "today_on": self._today_on,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RelayRuntime":
+        """Restore from to_dict. If the bucket sizes have changed since, the history is dropped."""
+        runtime = cls()
+        if data.get("bucket_seconds") != runtime.bucket_seconds or data.get("bucket_count") != runtime.bucket_count:
+            return runtime
+        runtime._on = array("f", base64.b64decode(data["on"]))
+        runtime._covered = array("f", base64.b64decode(data["covered"]))
+        runtime._head = data["head"]
+        if data.get("today"):
+            runtime._today = date.fromisoformat(data["today"])
+            runtime._today_on = float(data["today_on"])
+        if runtime._head is not None:
+            for bucket in range(runtime._head - runtime.hour_buckets + 1, runtime._head + 1):
+                runtime._hour_on += runtime._on[bucket % runtime.bucket_count]
+                runtime._hour_covered += runtime._covered[bucket % runtime.bucket_count]
+        return runtime
@@ -0,0 +1,96 @@
+"""Work out when a device's schedule next changes from its cached schedule registers."""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from .const import DEVICE_TYPE_THERMOSTAT, SCHEDULE_PERIODS_PER_DAY, SCHEDULE_REGISTER_COUNT, SCHEDULE_START_REGISTER, RegisterAddresses
+
+DISABLED_HOUR = 24  # A period starting at hour 24 isn't used
+
+
+def _day_start_registers(device_type: int) -> List[int]:
+    """First schedule register of each day, indexed Monday = 0 like datetime.weekday()."""
+    addresses = RegisterAddresses[device_type]
+    return [
+        int(addresses.MONDAY_PERIOD_1_START_HOUR),
+        int(addresses.TUESDAY_PERIOD_1_START_HOUR),
+        int(addresses.WEDNESDAY_PERIOD_1_START_HOUR),
+        int(addresses.THURSDAY_PERIOD_1_START_HOUR),
+        int(addresses.FRIDAY_PERIOD_1_START_HOUR),
+        int(addresses.SATURDAY_PERIOD_1_START_HOUR),
+        int(addresses.SUNDAY_PERIOD_1_START_HOUR),
+    ]
+
+
+def schedule_day(schedule_mode: Optional[int], weekday: int) -> Optional[int]:
+    """Which day's schedule registers are followed on weekday (Monday = 0), or None if there's no schedule."""
+    if schedule_mode == 0:  # Weekday/Weekend: the Monday and Saturday schedules
+        return 0 if weekday < 5 else 5
+    if schedule_mode == 1:  # 7 day
+        return weekday
+    if schedule_mode == 2:  # 24 hour: the Sunday schedule every day
+        return 6
+    return None
+
+
+def day_transitions(registers: Sequence[Optional[int]], device_type: int, day: int) -> List[int]:
+    """Minutes after midnight at which the schedule for day (Monday = 0) changes, in order.
+
+    Thermostat periods start at a time; timer periods have an on time and an off time.
+    """
+    start = _day_start_registers(device_type)[day]
+    times = set()
+    for period in range(SCHEDULE_PERIODS_PER_DAY):
+        register = start + period * 4
+        pairs = [(register, register + 1)]
+        if device_type != DEVICE_TYPE_THERMOSTAT:
+            pairs.append((register + 2, register + 3))
+        for hour_register, minute_register in pairs:
+            hour, minute = registers[hour_register], registers[minute_register]
+            if hour is None or minute is None or hour >= DISABLED_HOUR:
+                continue
+            times.add(hour * 60 + minute)
+    return sorted(times)
+
+
+def schedule_key(registers: Sequence[Optional[int]], device_type: int) -> Tuple:
+    """The schedule mode and schedule registers, to tell whether a cached WeeklySchedule is still current."""
+    start = SCHEDULE_START_REGISTER
+    return (registers[int(RegisterAddresses[device_type].SCHEDULE_MODE)], tuple(registers[start:start + SCHEDULE_REGISTER_COUNT[device_type]]))
+
+
+class WeeklySchedule:
+    """When a device's schedule changes on each day of the week.
+
+    Built once from the schedule registers, so finding the next transition doesn't need to
+    decode the registers again.
+    """
+
+    def __init__(self, schedule_mode: Optional[int], transitions: List[List[int]]) -> None:
+        self.schedule_mode = schedule_mode
+        self._transitions = transitions  # Minutes after midnight, indexed by stored day (Monday = 0)
+
+    @classmethod
+    def from_registers(cls, registers: Sequence[Optional[int]], device_type: int) -> "WeeklySchedule":
+        return cls(
+            registers[int(RegisterAddresses[device_type].SCHEDULE_MODE)],
+            [day_transitions(registers, device_type, day) for day in range(7)],
+        )
+
+    def transitions_on(self, weekday: int) -> List[int]:
+        """Minutes after midnight at which the schedule changes on weekday (Monday = 0)."""
+        day = schedule_day(self.schedule_mode, weekday)
+        return [] if day is None else self._transitions[day]
+
+    def next_transition(self, now: datetime) -> Optional[datetime]:
+        """The next time after now that the schedule changes, or None if the device isn't following one."""
+        if schedule_day(self.schedule_mode, now.weekday()) is None:
+            return None
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for offset in range(8):
+            for minutes in self.transitions_on((now.weekday() + offset) % 7):
+                transition = midnight + timedelta(days=offset, minutes=minutes)
+                if transition > now:
+                    return transition
+        return None
@@ -26,12 +26,14 @@ async def async_setup_entry(
     async_add_entities: AddEntitiesCallback,
 ) -> None:
     """Set up select entities from a config entry."""
-    register_store = hass.data[DOMAIN][config_entry.entry_id]
+    hub = hass.data[DOMAIN][config_entry.entry_id]
+    hub.add_platform(
+        None, lambda slave_id, name, register_store: _add_channel_entities(hub.host, hub.port, slave_id, name, register_store, async_add_entities)
+    )
 
-    host = config_entry.data["host"]
-    port = config_entry.data["port"]
-    slave_id = config_entry.data["modbus_id"]
-    name = config_entry.data["name"]
+
+def _add_channel_entities(host, port, slave_id, name, register_store: heatmiser_edge_register_store, async_add_entities: AddEntitiesCallback) -> None:
+    """Add the entities for one channel (device) on the gateway."""
 
     select_entities: list[HeatmiserEdgeSelectableRegister] = []
 
@@ -158,12 +160,12 @@ class HeatmiserEdgeSelectableRegister(SelectEntity):
             raise ValueError(f"Invalid option {option}")
         index = self._options.index(option)
 
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(self._register_id, value=int(index), device_id=self._slave_id)
-        client.close()
+        await self.register_store.write_register(self._register_id, index, refresh_values_after_writing=False)
 
-        await self.register_store.async_update()
+        # Read back just the register written, unless it was queued as the device couldn't be reached
+        if self._register_id not in self.register_store.write_queue.pending:
+            await self.register_store.async_read_registers(self._register_id, 1)
+        self.async_write_ha_state()
 
     async def async_added_to_hass(self) -> None:
         """Register for updates from the register store when entity is added."""
@@ -8,11 +8,13 @@ from typing import Any
 import voluptuous as vol
 
 from .const import *
+from .heat_demand import HeatDemand, get_heat_demand
 from .heatmiser_edge import *
 
 from homeassistant.components.sensor import (
     SensorEntity,
     SensorDeviceClass,
+    SensorStateClass,
 )
 from homeassistant.const import (
     ATTR_TEMPERATURE,
@@ -20,7 +22,9 @@ from homeassistant.const import (
     CONF_ID,
     CONF_NAME,
     CONF_PORT,
+    PERCENTAGE,
     UnitOfTemperature,
+    UnitOfTime,
     EntityCategory,
 )
 from homeassistant.core import HomeAssistant
@@ -41,12 +45,19 @@ async def async_setup_entry(
     async_add_entities: AddEntitiesCallback,
 ) -> None:
     """Add cover for passed config_entry in HA."""
-    register_store = hass.data[DOMAIN][config_entry.entry_id]
+    hub = hass.data[DOMAIN][config_entry.entry_id]
+    hub.add_platform(
+        None, lambda slave_id, name, register_store: _add_channel_entities(hub.host, hub.port, slave_id, name, register_store, async_add_entities)
+    )
 
-    host = config_entry.data["host"]
-    port = config_entry.data["port"]
-    slave_id = config_entry.data["modbus_id"]
-    name = config_entry.data["name"]
+    # One heat demand sensor covers every gateway, so it's added by whichever entry gets here first,
+    # and handed on to another entry if that one is unloaded (see HeatDemand.release_sensor)
+    heat_demand = get_heat_demand()
+    heat_demand.claim_sensor(config_entry.entry_id, lambda: async_add_entities([HeatmiserEdgeHeatDemand(heat_demand)]))
+
+
+def _add_channel_entities(host, port, slave_id, name, register_store: heatmiser_edge_register_store, async_add_entities: AddEntitiesCallback) -> None:
+    """Add the entities for one channel (device) on the gateway."""
 
     ReadableRegisters = []
 
@@ -69,6 +80,14 @@ async def async_setup_entry(
     for rg in register_lookup:
         ReadableRegisters.append(HeatmiserEdgeReadableRegisterGeneric(host, port, slave_id, name, register_store, rg["register"], rg["name"], rg["gain"], rg["offset"], rg["units"]))
 
+    # Writes waiting for the device to be reachable again
+    ReadableRegisters.append(HeatmiserEdgeWriteQueueLength(host, port, slave_id, name, register_store))
+    ReadableRegisters.append(HeatmiserEdgeWriteQueueAge(host, port, slave_id, name, register_store))
+
+    # Relay runtime, added up by the register store from every poll
+    ReadableRegisters.append(HeatmiserEdgeRuntimeToday(host, port, slave_id, name, register_store))
+    ReadableRegisters.append(HeatmiserEdgeDutyCycle(host, port, slave_id, name, register_store))
+
     # Add all entities to HA
     async_add_entities(ReadableRegisters)
 
@@ -161,4 +180,142 @@ class HeatmiserEdgeReadableRegisterGeneric(SensorEntity):
     #     await client.write_register(self._register_id, int(value)*10 , self._slave_id)
     #     client.close()
 
-    #     self._native_value = int(value)
\ No newline at end of file
+    #     self._native_value = int(value)
+
+
+class HeatmiserEdgeWriteQueueLength(HeatmiserEdgeReadableRegisterGeneric):
+    """Number of registers with a write waiting for the device to be reachable again."""
+
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, host, port, slave_id, name, register_store: heatmiser_edge_register_store):
+        super().__init__(host, port, slave_id, name, register_store, None, "Queued writes", 1, 0, None)
+
+    @property
+    def unique_id(self):
+        return f"{self._id}_write_queue_length"
+
+    @property
+    def native_value(self):
+        return len(self.register_store.write_queue)
+
+
+class HeatmiserEdgeWriteQueueAge(HeatmiserEdgeReadableRegisterGeneric):
+    """How long the oldest queued write has been waiting, or unknown if there are none.
+
+    Polled by Home Assistant (as well as updating with the register store) so it keeps counting while the device can't be reached.
+    """
+
+    _attr_device_class = SensorDeviceClass.DURATION
+
+    def __init__(self, host, port, slave_id, name, register_store: heatmiser_edge_register_store):
+        super().__init__(host, port, slave_id, name, register_store, None, "Oldest queued write age", 1, 0, UnitOfTime.SECONDS)
+
+    @property
+    def unique_id(self):
+        return f"{self._id}_write_queue_age"
+
+    @property
+    def native_value(self):
+        age = self.register_store.write_queue.age()
+        return None if age is None else round(age)
+
+
+class HeatmiserEdgeRuntimeToday(HeatmiserEdgeReadableRegisterGeneric):
+    """How long the relay has been on since midnight, e.g. for energy reporting.
+
+    Polled by Home Assistant (as well as updating with the register store) so it goes back to 0 at midnight.
+    """
+
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+    _attr_suggested_display_precision = 2
+
+    def __init__(self, host, port, slave_id, name, register_store: heatmiser_edge_register_store):
+        super().__init__(host, port, slave_id, name, register_store, None, "Relay runtime today", 1, 0, UnitOfTime.HOURS)
+
+    @property
+    def entity_category(self):
+        return None
+
+    @property
+    def unique_id(self):
+        return f"{self._id}_runtime_today"
+
+    @property
+    def native_value(self):
+        return round(self.register_store.relay_runtime.runtime_today() / 3600, 4)
+
+
+class HeatmiserEdgeDutyCycle(HeatmiserEdgeReadableRegisterGeneric):
+    """Percentage of the last hour the relay was on (of the time the device was polled), or unknown until it has been."""
+
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_suggested_display_precision = 0
+
+    def __init__(self, host, port, slave_id, name, register_store: heatmiser_edge_register_store):
+        super().__init__(host, port, slave_id, name, register_store, None, "Relay duty cycle (last hour)", 1, 0, PERCENTAGE)
+
+    @property
+    def entity_category(self):
+        return None
+
+    @property
+    def unique_id(self):
+        return f"{self._id}_duty_cycle"
+
+    @property
+    def native_value(self):
+        duty_cycle = self.register_store.relay_runtime.duty_cycle_last_hour()
+        return None if duty_cycle is None else round(duty_cycle * 100, 1)
+
+
+class HeatmiserEdgeHeatDemand(SensorEntity):
+    """Number of thermostats (on every gateway) calling for heat, e.g. to enable a boiler.
+
+    Updated as soon as a relay register changes, rather than going through every thermostat.
+    The zones calling, the largest setpoint deficit and how long updates take are attributes.
+    """
+
+    _attr_should_poll = False
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_name = "Heatmiser Edge heat demand"
+    _attr_unique_id = f"{DOMAIN}_heat_demand"
+    _attr_icon = "mdi:fire"
+
+    def __init__(self, heat_demand: HeatDemand):
+        self.heat_demand = heat_demand
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Return the device info"""
+        return DeviceInfo(
+            identifiers={(DOMAIN, "heat_demand")},
+                name="Heatmiser Edge heat demand",
+                model="Edge",
+                manufacturer="Heatmiser",
+                )
+
+    @property
+    def native_value(self):
+        return self.heat_demand.relays_on
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        return {
+            "calling": self.heat_demand.calling,
+            "max_setpoint_deficit": self.heat_demand.max_deficit,
+            "last_latency": None if self.heat_demand.last_latency is None else round(self.heat_demand.last_latency, 3),
+            "max_latency": round(self.heat_demand.latency_max, 3) if self.heat_demand.updates else None,
+        }
+
+    async def async_added_to_hass(self) -> None:
+        """Register for updates from the heat demand when entity is added."""
+        self._remove_listener = self.heat_demand.add_listener(self.async_write_ha_state)
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Unregister update listener when entity is removed."""
+        remove = getattr(self, "_remove_listener", None)
+        if remove is not None:
+            remove()
+            self._remove_listener = None
@@ -0,0 +1,298 @@
+"""Register snapshots (backups) of a Heatmiser Edge device.
+
+Binary format (version 1), all integers big-endian. A file or stream holds one or more
+records back to back:
+
+    magic        4 bytes   b"HMSN"
+    version      uint8
+    header_len   uint32
+    header       header_len bytes of UTF-8 JSON (device type, firmware, timestamp, host, unit id, ...)
+    count        uint16    number of registers
+    present      ceil(count / 8) bytes, bit set if the register was read successfully
+    values       count x uint16 (0 where the register is missing)
+    crc32        uint32    CRC-32 of everything above, starting from the magic
+
+The legacy backup format (a single comma separated line of values with "None" for
+registers that couldn't be read) can still be read.
+
+No Home Assistant imports so this can be shared with the tools.
+"""
+from __future__ import annotations
+
+import io
+import json
+import os
+import struct
+import time
+import zlib
+from array import array
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, only used to speed up diffing lots of snapshots
+    numpy = None
+
+from .const import DEVICE_TYPE_THERMOSTAT, DEVICE_TYPE_TIMER, REGISTER_COUNT, ThermostatRegisterAddresses
+
+MAGIC = b"HMSN"
+FORMAT_VERSION = 1
+FILE_EXTENSION = ".hmsnap"
+LEGACY_FILE_EXTENSION = ".txt"
+
+_PREAMBLE = struct.Struct(">4sBI")
+_COUNT = struct.Struct(">H")
+_CRC = struct.Struct(">I")
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot can't be parsed or fails its integrity check."""
+
+
+@dataclass
+class Snapshot:
+    """A full register image of one device, plus where and when it came from."""
+
+    registers: List[Optional[int]]
+    host: Optional[str] = None
+    unit_id: Optional[int] = None
+    device_type: Optional[int] = None
+    timestamp: Optional[float] = None
+    extra: dict = field(default_factory=dict)
+    # (registers, values, present) as read from a file, so packed() doesn't pack them again. Ignored once registers is replaced
+    _packed: Optional[Tuple[list, array, bytes]] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.device_type is None:
+            self.device_type = detect_device_type(self.registers)
+
+    @property
+    def firmware(self) -> Optional[int]:
+        """Code version number (CODE_VERSION_NUMBER_RD) of the device when the snapshot was taken."""
+        if not self.registers:
+            return None
+        return self.registers[int(ThermostatRegisterAddresses.CODE_VERSION_NUMBER_RD)]
+
+    def header(self) -> dict:
+        header = {
+            "device_type": self.device_type,
+            "firmware": self.firmware,
+            "timestamp": self.timestamp,
+            "host": self.host,
+            "unit_id": self.unit_id,
+        }
+        header.update(self.extra)
+        return header
+
+    def packed(self) -> Tuple[array, bytes]:
+        """Return the registers as a packed uint16 array (0 where missing) and the presence bitmap."""
+        if self._packed is not None and self._packed[0] is self.registers:
+            return self._packed[1], self._packed[2]
+        values = array("H", (0 if v is None else int(v) for v in self.registers))
+        present = bytearray((len(self.registers) + 7) // 8)
+        for index, value in enumerate(self.registers):
+            if value is not None:
+                present[index >> 3] |= 1 << (index & 7)
+        return values, bytes(present)
+
+    def to_dict(self) -> dict:
+        """JSON friendly representation (used for Home Assistant storage and service responses)."""
+        return {"format_version": FORMAT_VERSION, **self.header(), "registers": list(self.registers)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Snapshot":
+        known = {"format_version", "device_type", "firmware", "timestamp", "host", "unit_id", "registers"}
+        return cls(
+            registers=list(data["registers"]),
+            host=data.get("host"),
+            unit_id=data.get("unit_id"),
+            device_type=data.get("device_type"),
+            timestamp=data.get("timestamp"),
+            extra={k: v for k, v in data.items() if k not in known},
+        )
+
+
+def detect_device_type(registers) -> Optional[int]:
+    """Thermostats report a room temperature greater than 1, timers don't (same check as the register store)."""
+    room_temperature = registers[int(ThermostatRegisterAddresses.ROOM_TEMPERATURE_RD)] if len(registers) > 2 else None
+    if room_temperature is None:
+        return None
+    return DEVICE_TYPE_THERMOSTAT if room_temperature > 1 else DEVICE_TYPE_TIMER
+
+
+def encode(snapshot: Snapshot) -> bytes:
+    """Encode a snapshot as one binary record."""
+    header = json.dumps(snapshot.header(), separators=(",", ":")).encode("utf-8")
+    values, present = snapshot.packed()
+    if values.itemsize != 2:  # pragma: no cover
+        raise SnapshotError("Platform does not have a 16 bit array type")
+    if struct.pack("=H", 1) != struct.pack(">H", 1):
+        values = array("H", values) # A copy, as packed() may return the snapshot's own
+        values.byteswap()
+    body = b"".join((
+        _PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)),
+        header,
+        _COUNT.pack(len(snapshot.registers)),
+        present,
+        values.tobytes(),
+    ))
+    return body + _CRC.pack(zlib.crc32(body))
+
+
+def _read_exact(fp: BinaryIO, length: int) -> bytes:
+    data = fp.read(length)
+    if len(data) != length:
+        raise SnapshotError("Snapshot is truncated")
+    return data
+
+
+def _read_record(fp: BinaryIO, preamble: bytes) -> Snapshot:
+    magic, version, header_len = _PREAMBLE.unpack(preamble)
+    if magic != MAGIC:
+        raise SnapshotError("Not a snapshot record")
+    if version > FORMAT_VERSION:
+        raise SnapshotError(f"Snapshot format version {version} is newer than this version supports ({FORMAT_VERSION})")
+
+    header = _read_exact(fp, header_len)
+    count_bytes = _read_exact(fp, _COUNT.size)
+    (count,) = _COUNT.unpack(count_bytes)
+    present = _read_exact(fp, (count + 7) // 8)
+    value_bytes = _read_exact(fp, count * 2)
+    (crc,) = _CRC.unpack(_read_exact(fp, _CRC.size))
+
+    checksum = zlib.crc32(preamble)
+    for part in (header, count_bytes, present, value_bytes):
+        checksum = zlib.crc32(part, checksum)
+    if checksum != crc:
+        raise SnapshotError("Snapshot checksum does not match, the file is corrupt")
+
+    values = array("H")
+    values.frombytes(value_bytes)
+    if struct.pack("=H", 1) != struct.pack(">H", 1):
+        values.byteswap()
+    registers = values.tolist()
+    if present != _all_present(count):
+        registers = [value if present[i >> 3] & (1 << (i & 7)) else None for i, value in enumerate(registers)]
+    snapshot = Snapshot.from_dict({**json.loads(header.decode("utf-8")), "registers": registers})
+    # Keep the packed form, so diffing lots of snapshots doesn't pack every one again
+    snapshot._packed = (snapshot.registers, values, present)
+    return snapshot
+
+
+def _all_present(count: int) -> bytes:
+    """The presence bitmap of count registers that were all read."""
+    present = bytearray(b"\xff" * (count // 8))
+    if count % 8:
+        present.append((1 << (count % 8)) - 1)
+    return bytes(present)
+
+
+def parse_legacy(text: str) -> Snapshot:
+    """Parse the old comma separated backup format."""
+    raw_values = [v.strip() for v in text.strip().split(",") if v.strip()]
+    try:
+        registers = [None if v == "None" else int(v) for v in raw_values]
+    except ValueError as ex:
+        raise SnapshotError(f"Not a valid backup file: {ex}") from ex
+    if len(registers) != REGISTER_COUNT:
+        raise SnapshotError(f"Backup file must contain exactly {REGISTER_COUNT} values.")
+    return Snapshot(registers=registers, extra={"legacy": True})
+
+
+def iter_snapshots(fp: BinaryIO) -> Iterator[Snapshot]:
+    """Yield each snapshot in a binary stream one at a time, falling back to the legacy text format."""
+    preamble = fp.read(_PREAMBLE.size)
+    if not preamble.startswith(MAGIC):
+        try:
+            text = (preamble + fp.read()).decode("ascii")
+        except UnicodeDecodeError as ex:
+            raise SnapshotError("Not a snapshot or legacy backup file") from ex
+        yield parse_legacy(text)
+        return
+    while preamble:
+        if len(preamble) != _PREAMBLE.size:
+            raise SnapshotError("Snapshot is truncated")
+        yield _read_record(fp, preamble)
+        preamble = fp.read(_PREAMBLE.size)
+
+
+class SnapshotWriter:
+    """Write snapshots one after another to a binary stream."""
+
+    def __init__(self, fp: BinaryIO) -> None:
+        self._fp = fp
+
+    def write(self, snapshot: Snapshot) -> None:
+        self._fp.write(encode(snapshot))
+
+
+def decode(data: bytes) -> Snapshot:
+    """Decode a single snapshot from bytes (binary or legacy text)."""
+    return next(iter_snapshots(io.BytesIO(data)))
+
+
+def read_snapshot(file_path: str) -> Snapshot:
+    """Read the first snapshot in a file, which can be binary or the legacy text format."""
+    with open(file_path, "rb") as f:
+        try:
+            snapshot = next(iter_snapshots(f))
+        except StopIteration:
+            raise SnapshotError(f"{file_path} is empty") from None
+    if snapshot.timestamp is None:
+        snapshot.timestamp = os.path.getmtime(file_path)
+    return snapshot
+
+
+def write_snapshot(file_path: str, snapshot: Snapshot) -> None:
+    """Write a snapshot to a file in the binary format."""
+    if snapshot.timestamp is None:
+        snapshot.timestamp = time.time()
+    with open(file_path, "wb") as f:
+        SnapshotWriter(f).write(snapshot)
+
+
+def diff_registers(reference: Snapshot, others: Sequence[Snapshot]) -> List[List[int]]:
+    """For each snapshot in others, return the registers whose value differs from reference.
+
+    A register that is missing in one snapshot but not the other counts as different.
+    With numpy installed all the snapshots are compared in one vectorised pass over the
+    packed arrays, otherwise identical snapshots are skipped with a single bytes comparison.
+    """
+    count = len(reference.registers)
+    ref_values, ref_present = reference.packed()
+
+    def packed_to(snap: Snapshot) -> Tuple[array, bytes]:
+        if len(snap.registers) == count:
+            return snap.packed() # Already packed if it was read from a file
+        registers = list(snap.registers[:count]) + [None] * (count - len(snap.registers))
+        return Snapshot(registers, device_type=snap.device_type).packed()
+
+    packed_others = [packed_to(snap) for snap in others]
+    if not packed_others:
+        return []
+
+    if numpy is not None:
+        ref = numpy.frombuffer(ref_values.tobytes(), dtype=numpy.uint16)
+        ref_mask = numpy.unpackbits(numpy.frombuffer(ref_present, dtype=numpy.uint8), bitorder="little")[:count].astype(bool)
+        values = numpy.frombuffer(b"".join(v.tobytes() for v, _ in packed_others), dtype=numpy.uint16).reshape(len(others), count)
+        masks = numpy.unpackbits(
+            numpy.frombuffer(b"".join(p for _, p in packed_others), dtype=numpy.uint8).reshape(len(others), -1),
+            axis=1, bitorder="little",
+        )[:, :count].astype(bool)
+        differs = ((values != ref) & masks & ref_mask) | (masks != ref_mask)
+        rows, columns = numpy.nonzero(differs)
+        result: List[List[int]] = [[] for _ in others]
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            result[row].append(column)
+        return result
+
+    ref_bytes = ref_values.tobytes()
+    result = []
+    for (values, present), snap in zip(packed_others, others):
+        if present == ref_present and values.tobytes() == ref_bytes:
+            result.append([])
+            continue
+        registers = list(snap.registers[:count]) + [None] * (count - len(snap.registers))
+        result.append([i for i, (a, b) in enumerate(zip(reference.registers, registers)) if a != b])
+    return result
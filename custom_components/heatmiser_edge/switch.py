@@ -36,12 +36,14 @@ async def async_setup_entry(
     async_add_entities: AddEntitiesCallback,
 ) -> None:
     """Add switch for passed config_entry in HA."""
-    register_store = hass.data[DOMAIN][config_entry.entry_id]
+    hub = hass.data[DOMAIN][config_entry.entry_id]
+    hub.add_platform(
+        DEVICE_TYPE_TIMER, lambda slave_id, name, register_store: _add_channel_entities(hub.host, hub.port, slave_id, name, register_store, async_add_entities)
+    )
 
-    host = config_entry.data["host"]
-    port = config_entry.data["port"]
-    slave_id = config_entry.data["modbus_id"]
-    name = config_entry.data["name"]
+
+def _add_channel_entities(host, port, slave_id, name, register_store: heatmiser_edge_register_store, async_add_entities: AddEntitiesCallback) -> None:
+    """Add the entities for one channel (device) on the gateway."""
 
     timer = HeatmiserEdgeTimer(host, port, slave_id, name, register_store)
 
@@ -52,6 +54,7 @@ class HeatmiserEdgeTimer(SwitchEntity):
     """Representation of a Heatmiser Edge timer switch."""
 
     _attr_device_class = SwitchDeviceClass.SWITCH
+    _attr_should_poll = False  # The register store's poller keeps the registers up to date
 
     def __init__(self, host, port, slave_id, name, register_store: heatmiser_edge_register_store):
         """Initialize the timer switch."""
@@ -98,25 +101,20 @@ class HeatmiserEdgeTimer(SwitchEntity):
         """Turn the switch on."""
         self._is_on = True
         # Add your Modbus write logic here to turn on the timer
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(int(TimerRegisterAddresses.CURRENT_OPERATION_MODE), value=int(PRESET_MODES.index("Advance")) , device_id=self._slave_id) # Override also known as "change over" in docs
-        await client.write_register(int(TimerRegisterAddresses.TIMER_OUT_FORCE), value=1, device_id=self._slave_id)
-        client.close()
-
-        await self.async_update() # Force an update
+        # Operation mode and timer out force are contiguous (32 and 33) so go in one write (as a transaction)
+        await self.register_store.async_write_operation_block({
+            int(TimerRegisterAddresses.CURRENT_OPERATION_MODE): PRESET_MODES.index("Advance"),
+            int(TimerRegisterAddresses.TIMER_OUT_FORCE): 1,
+        })
 
     async def async_turn_off(self, **kwargs: Any) -> None:
         """Turn the switch off."""
         self._is_on = False
         # Add your Modbus write logic here to turn off the timer
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(int(TimerRegisterAddresses.CURRENT_OPERATION_MODE), value=int(PRESET_MODES.index("Advance")) , device_id=self._slave_id) # Override also known as "change over" in docs
-        await client.write_register(int(TimerRegisterAddresses.TIMER_OUT_FORCE), value=0, device_id=self._slave_id)
-        client.close()
-        
-        await self.async_update() # Force an update
+        await self.register_store.async_write_operation_block({
+            int(TimerRegisterAddresses.CURRENT_OPERATION_MODE): PRESET_MODES.index("Advance"),
+            int(TimerRegisterAddresses.TIMER_OUT_FORCE): 0,
+        })
 
     async def async_update(self) -> None:
         """Update the switch state."""
@@ -124,9 +122,8 @@ class HeatmiserEdgeTimer(SwitchEntity):
 
     async def async_added_to_hass(self) -> None:
         """Register for updates from the register store when entity is added."""
-        self._remove_listener = self.register_store.add_update_listener(
-            lambda: self.async_schedule_update_ha_state(True)
-        )
+        # Just write the state: refreshing here would update the store again and call this listener in a loop
+        self._remove_listener = self.register_store.add_update_listener(self.async_write_ha_state)
 
     async def async_will_remove_from_hass(self) -> None:
         """Unregister update listener when entity is removed."""
@@ -41,12 +41,14 @@ async def async_setup_entry(
     async_add_entities: AddEntitiesCallback,
 ) -> None:
     """Add cover for passed config_entry in HA."""
-    register_store = hass.data[DOMAIN][config_entry.entry_id]
+    hub = hass.data[DOMAIN][config_entry.entry_id]
+    hub.add_platform(
+        None, lambda slave_id, name, register_store: _add_channel_entities(hub.host, hub.port, slave_id, name, register_store, async_add_entities)
+    )
 
-    host = config_entry.data["host"]
-    port = config_entry.data["port"]
-    slave_id = config_entry.data["modbus_id"]
-    name = config_entry.data["name"]
+
+def _add_channel_entities(host, port, slave_id, name, register_store: heatmiser_edge_register_store, async_add_entities: AddEntitiesCallback) -> None:
+    """Add the entities for one channel (device) on the gateway."""
     
     # Add device specific writable registers
     
@@ -144,11 +146,8 @@ class HeatmiserEdgeWritableRegisterTime(TimeEntity):
     async def async_set_value(self,value: time) -> None:
         """Update the current value."""
         _LOGGER.warning(f"Attempting to set time to {int(value.hour)}:{int(value.minute)}")
-        client = AsyncModbusTcpClient(self._host)
-        await client.connect()
-        await client.write_register(self._register_id, value=int(value.hour) , device_id=self._slave_id)
-        await client.write_register(self._register_id+1, value=int(value.minute) , device_id=self._slave_id)
-        client.close()
+        # Hour and minute together, so a failure can't leave the period starting at the new hour and old minute
+        await self.register_store.async_write_transaction({self._register_id: int(value.hour), self._register_id + 1: int(value.minute)})
 
         self._native_value = value
 
@@ -0,0 +1,77 @@
+"""Writes waiting for a device that couldn't be reached.
+
+When a write fails because the device (or its gateway) can't be reached, the register values
+are kept here rather than lost, and written once the device answers again. Only the latest
+value for each register matters, so a later write to the same register replaces the earlier
+one rather than queueing behind it. The queue is written back as a few block writes (see
+register_blocks.plan_register_writes) rather than in the order the writes were made.
+
+Each register keeps the time it was first queued, so the age of the queue is how long the
+device has been out of step, even if the value has since been changed again.
+"""
+from __future__ import annotations
+
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+class WriteQueue:
+    """The latest undelivered value of each register, and when it was first queued."""
+
+    def __init__(self, pending: Optional[Dict[int, Tuple[int, float]]] = None) -> None:
+        self.pending: Dict[int, Tuple[int, float]] = dict(pending or {})
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def add(self, start_register: int, values: Sequence[int], queued_at: Optional[float] = None) -> None:
+        """Queue values for the registers from start_register, replacing anything already queued for them."""
+        queued_at = time.time() if queued_at is None else queued_at
+        for offset, value in enumerate(values):
+            register = int(start_register) + offset
+            first_queued_at = self.pending[register][1] if register in self.pending else queued_at
+            self.pending[register] = (int(value), first_queued_at)
+
+    def discard(self, start_register: int, count: int) -> bool:
+        """Forget anything queued for count registers from start_register (e.g. they've just been written). Returns True if anything was."""
+        registers = [register for register in range(int(start_register), int(start_register) + count) if register in self.pending]
+        for register in registers:
+            del self.pending[register]
+        return bool(registers)
+
+    def remove_delivered(self, registers: Sequence[Optional[int]]) -> bool:
+        """Forget the queued values that registers (the device's current values) already have. Returns True if any were."""
+        delivered = [
+            register for register, (value, _) in self.pending.items()
+            if register < len(registers) and registers[register] == value
+        ]
+        for register in delivered:
+            del self.pending[register]
+        return bool(delivered)
+
+    def target(self, register_count: int) -> List[Optional[int]]:
+        """The queued values as a register image (None where nothing is queued), for plan_register_writes."""
+        image: List[Optional[int]] = [None] * register_count
+        for register, (value, _) in self.pending.items():
+            if register < register_count:
+                image[register] = value
+        return image
+
+    def oldest(self) -> Optional[float]:
+        """When the longest waiting value was queued (time.time()), or None if nothing is queued."""
+        return min((queued_at for _, queued_at in self.pending.values()), default=None)
+
+    def age(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds the longest waiting value has waited, or None if nothing is queued."""
+        oldest = self.oldest()
+        if oldest is None:
+            return None
+        return (time.time() if now is None else now) - oldest
+
+    def to_dict(self) -> dict:
+        """For storage (JSON keys have to be strings)."""
+        return {str(register): [value, queued_at] for register, (value, queued_at) in sorted(self.pending.items())}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "WriteQueue":
+        return cls({int(register): (int(value), float(queued_at)) for register, (value, queued_at) in data.items()})
@@ -0,0 +1,25 @@
+"""Import the Home Assistant independent parts of the integration from the tools.
+
+The integration package's __init__.py imports Home Assistant, so rather than importing
+custom_components.heatmiser_edge directly, the component directory is registered as a
+bare package and the wanted modules are imported from that.
+
+So everything loaded here (directly or through heatmiser_edge.py) mustn't import Home Assistant.
+heatmiser_edge.py and gateway.py need pymodbus, the rest only the standard library.
+"""
+import importlib
+import os
+import sys
+import types
+
+COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "custom_components", "heatmiser_edge")
+PACKAGE_NAME = "heatmiser_edge_integration"
+
+
+def load_integration_module(name):
+    """Import and return the integration module called name (e.g. "register_blocks")."""
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [os.path.normpath(COMPONENT_DIR)]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")
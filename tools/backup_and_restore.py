@@ -1,14 +1,28 @@
 import argparse
-from pymodbus.client import ModbusTcpClient
+import asyncio
+from pymodbus.client import AsyncModbusTcpClient, ModbusTcpClient
 import os
+import time
 from colorama import init, Fore, Style
 
+from _integration import load_integration_module
+
+capabilities = load_integration_module("capabilities")
+const = load_integration_module("const")
+register_blocks = load_integration_module("register_blocks")
+snapshot = load_integration_module("snapshot")
+
+from snapshot_archive import SnapshotArchive
+
 # Initialize colorama
 init()
 
 REGISTER_COUNT = 218           # Registers 0 to 217
-BACKUP_FILENAME = "modbus_backup.txt"
+BACKUP_FILENAME = "modbus_backup" + snapshot.FILE_EXTENSION
+LEGACY_BACKUP_FILENAME = "modbus_backup" + snapshot.LEGACY_FILE_EXTENSION
 RESTORE_START = 20             # Only restore registers 20 to 217
+DEFAULT_PORT = 502
+MAX_CONCURRENT_GATEWAYS = 16   # Gateways talked to at once in batch mode
 
 def check_device_online(ip, slave_id):
     """Check if a Modbus device is online and responding."""
@@ -18,7 +32,7 @@ def check_device_online(ip, slave_id):
         return False
     
     # Try to read first register to verify communication
-    result = client.read_holding_registers(0, count=1, slave=slave_id)
+    result = client.read_holding_registers(0, count=1, device_id=slave_id)
     client.close()
     
     if result.isError():
@@ -28,21 +42,17 @@ def check_device_online(ip, slave_id):
     print(f"{Fore.GREEN}{Style.BRIGHT}Device at {ip} (slave ID: {slave_id}) is online and responding{Style.RESET_ALL}")
     return True
 
-REGISTER_COUNT = 218           # Registers 0 to 217
-BACKUP_FILENAME = "modbus_backup.txt"
-RESTORE_START = 20             # Only restore registers 20 to 217
-
 def read_registers(client, slave_id):
     all_values = [None] * REGISTER_COUNT
     for i in range(0, 210, 10):  # Read in chunks of 10
-        result = client.read_holding_registers(i, count=10, slave=slave_id)
+        result = client.read_holding_registers(i, count=10, device_id=slave_id)
         if result.isError():
             print(f"Error reading registers {i}–{i+9}: {result}")
             continue
         all_values[i:i+10] = result.registers
 
     # Read remaining 8 registers (210–217)
-    result = client.read_holding_registers(210, count=8, slave=slave_id)
+    result = client.read_holding_registers(210, count=8, device_id=slave_id)
     if not result.isError():
         all_values[210:218] = result.registers
     else:
@@ -50,23 +60,9 @@ def read_registers(client, slave_id):
 
     return all_values
 
-def write_registers(client, slave_id, values):
-    for i in range(RESTORE_START, 210, 10):
-        chunk = values[i:i+10]
-        if None in chunk:
-            print(f"Skipping write to {i}–{i+9} due to missing data.")
-            continue
-        client.write_registers(i, chunk, slave=slave_id)
-
-    last_chunk = values[210:218]
-    if None not in last_chunk:
-        client.write_registers(210, last_chunk, slave=slave_id)
-    else:
-        print("Skipping write to 210–217 due to missing data.")
-
-def backup_registers():
-    device_ip = input("Enter Modbus device IP address: ")
-    slave_id = int(input("Enter Modbus slave ID: "))
+def backup_registers(device_ip=None, slave_id=None):
+    device_ip = device_ip or input("Enter Modbus device IP address: ")
+    slave_id = slave_id or int(input("Enter Modbus slave ID: "))
 
     client = ModbusTcpClient(device_ip)
     if not client.connect():
@@ -77,45 +73,361 @@ def backup_registers():
     values = read_registers(client, slave_id)
     client.close()
 
-    with open(BACKUP_FILENAME, "w") as f:
-        f.write(",".join(map(str, values)))
+    snapshot.write_snapshot(BACKUP_FILENAME, snapshot.Snapshot(values, host=device_ip, unit_id=slave_id))
 
     print(f"Backup completed and saved to {BACKUP_FILENAME}.")
 
-def restore_registers():
-    device_ip = input("Enter Modbus device IP address: ")
-    slave_id = int(input("Enter Modbus slave ID: "))
+def restore_registers(device_ip=None, slave_id=None):
+    device_ip = device_ip or input("Enter Modbus device IP address: ")
+    slave_id = slave_id or int(input("Enter Modbus slave ID: "))
 
-    if not os.path.exists(BACKUP_FILENAME):
+    backup_file = BACKUP_FILENAME if os.path.exists(BACKUP_FILENAME) else LEGACY_BACKUP_FILENAME
+    if not os.path.exists(backup_file):
         print(f"No backup file found at {BACKUP_FILENAME}.")
         return
 
-    with open(BACKUP_FILENAME, "r") as f:
-        values_str = f.read().strip().split(",")
-        values = [int(v) if v != "None" else None for v in values_str]
-
-    if len(values) != REGISTER_COUNT:
-        print(f"Backup file must contain exactly {REGISTER_COUNT} values.")
+    try:
+        values = load_backup(backup_file)
+    except ValueError as ex:
+        print(ex)
         return
 
-    client = ModbusTcpClient(device_ip)
-    if not client.connect():
+    print(f"Restoring changed writable registers {RESTORE_START} to 217...")
+    try:
+        stats = asyncio.run(async_restore_single(device_ip, DEFAULT_PORT, slave_id, values))
+    except ConnectionError:
         print("Failed to connect to device.")
         return
 
-    print(f"Restoring writable registers {RESTORE_START} to 217...")
-    write_registers(client, slave_id, values)
-    client.close()
+    print_restore_stats(device_ip, DEFAULT_PORT, slave_id, stats)
+
+def backup_filename(ip, slave_id, timestamp=None):
+    """Default snapshot filename for a device, matching the one used by the GUI."""
+    ip_sanitized = ip.replace(".", "_")
+    timestamp = timestamp or time.strftime("%Y%m%d_%H%M%S")
+    return f"heatmiser_backup_{ip_sanitized}_{slave_id}_{timestamp}{snapshot.FILE_EXTENSION}"
 
-    print("Restoration completed.")
+def parse_device(spec):
+    """Parse a device given as host:unit or host:port:unit into (host, port, unit)."""
+    parts = spec.strip().replace(" ", ":").split(":")
+    parts = [p for p in parts if p]
+    if len(parts) == 2:
+        return parts[0], DEFAULT_PORT, int(parts[1])
+    if len(parts) == 3:
+        return parts[0], int(parts[1]), int(parts[2])
+    raise ValueError(f"Device must be host:unit or host:port:unit, got '{spec}'")
+
+def load_devices(devices=None, devices_file=None):
+    """Build the list of (host, port, unit) from the command line and/or a file (one device per line, # for comments)."""
+    specs = list(devices or [])
+    if devices_file:
+        with open(devices_file, "r") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    specs.append(line)
+    return [parse_device(spec) for spec in specs]
+
+class GatewayPool:
+    """One async connection per gateway, shared by all the devices behind it.
+
+    Devices on the same gateway are talked to one at a time (it's one RS485 bus),
+    devices on different gateways are talked to concurrently.
+    """
+
+    def __init__(self, max_gateways=MAX_CONCURRENT_GATEWAYS):
+        self._clients = {}
+        self.block_sizes = {}  # (host, port, firmware, writes probed) -> BlockSizes probed for that firmware on that gateway
+        self._locks = {}
+        self._limit = asyncio.Semaphore(max_gateways)
+
+    def _lock(self, host, port):
+        return self._locks.setdefault((host, port), asyncio.Lock())
+
+    async def acquire(self, host, port):
+        """Wait for the gateway to be free and return a connected client for it."""
+        # Wait for the gateway before taking a slot, so devices queued behind a busy
+        # gateway don't stop other gateways from being used
+        await self._lock(host, port).acquire()
+        await self._limit.acquire()
+        try:
+            client = self._clients.get((host, port))
+            if client is None or not client.connected:
+                client = AsyncModbusTcpClient(host, port=port)
+                if not await client.connect():
+                    raise ConnectionError(f"Failed to connect to {host}:{port}")
+                self._clients[(host, port)] = client
+            return client
+        except Exception:
+            self.release(host, port)
+            raise
+
+    def release(self, host, port):
+        self._limit.release()
+        self._lock(host, port).release()
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
+
+async def async_block_sizes(pool, client, host, port, slave_id, writes=False):
+    """The largest blocks the device can read (and if writes is set, write) in one go.
+
+    Probed once per firmware version on each gateway and then reused for the other devices.
+    Probing writes rewrites the schedule registers with their current values.
+    """
+    result = await client.read_holding_registers(0, count=const.MAX_REGISTER_READ_COUNT, device_id=slave_id)
+    if result.isError():
+        raise IOError(f"Error reading firmware version: {result}")
+    firmware = result.registers[int(const.ThermostatRegisterAddresses.CODE_VERSION_NUMBER_RD)]
+    device_type = (const.DEVICE_TYPE_THERMOSTAT if result.registers[int(const.ThermostatRegisterAddresses.ROOM_TEMPERATURE_RD)] > 1
+                   else const.DEVICE_TYPE_TIMER)
+
+    key = (host, port, firmware, writes)
+    if key in pool.block_sizes:
+        return pool.block_sizes[key]
+
+    async def read_block(start, count):
+        try:
+            result = await client.read_holding_registers(start, count=count, device_id=slave_id)
+        except Exception:
+            return None
+        return None if result.isError() else list(result.registers)
+
+    async def write_block(start, values):
+        try:
+            result = await client.write_registers(start, values, device_id=slave_id)
+        except Exception:
+            return False
+        return not result.isError()
+
+    if writes:
+        block_sizes = await capabilities.async_probe_block_sizes(read_block, write_block, device_type)
+    else:
+        block_sizes = capabilities.BlockSizes(read=await capabilities.async_probe_read_count(read_block))
+    pool.block_sizes[key] = block_sizes
+    print(f"{host}:{port} firmware {firmware} can read {block_sizes.read}"
+          f"{f' and write {block_sizes.write}' if writes else ''} registers at a time")
+    return block_sizes
+
+async def async_read_registers(client, slave_id, progress=None, read_count=const.MAX_REGISTER_READ_COUNT):
+    """Async version of read_registers. progress(block_start, count) is called after each block."""
+    all_values = [None] * REGISTER_COUNT
+    for i, count in register_blocks.plan_register_reads(0, REGISTER_COUNT - 1, read_count):
+        result = await client.read_holding_registers(i, count=count, device_id=slave_id)
+        if result.isError():
+            print(f"Error reading registers {i}–{i+count-1} from slave {slave_id}: {result}")
+        else:
+            all_values[i:i+count] = result.registers
+        if progress:
+            progress(i, count)
+    return all_values
+
+async def async_backup_device(pool, host, port, slave_id, output_dir=".", progress=None, probe=False):
+    """Back up one device through the pool, returning (filename, snapshot, seconds taken).
+
+    If probe is set, the largest read size for the device's firmware is found first (see async_block_sizes).
+    """
+    client = await pool.acquire(host, port)
+    try:
+        read_count = (await async_block_sizes(pool, client, host, port, slave_id)).read if probe else const.MAX_REGISTER_READ_COUNT
+        started = time.monotonic()
+        values = await async_read_registers(client, slave_id, progress, read_count)
+        elapsed = time.monotonic() - started
+    finally:
+        pool.release(host, port)
+
+    file_path = os.path.join(output_dir, backup_filename(host, slave_id))
+    snap = snapshot.Snapshot(values, host=host, unit_id=slave_id)
+    snapshot.write_snapshot(file_path, snap)
+    return file_path, snap, elapsed
+
+async def async_backup_devices(devices, output_dir=".", max_gateways=MAX_CONCURRENT_GATEWAYS, archive=None, probe=False):
+    """Back up every (host, port, unit) concurrently, printing progress as each device finishes.
+
+    If archive (a SnapshotArchive) is given, each snapshot is also added to it.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pool = GatewayPool(max_gateways)
+    started = time.monotonic()
+    completed = 0
+    failures = 0
+
+    async def _backup(host, port, slave_id):
+        nonlocal completed, failures
+        try:
+            file_path, snap, elapsed = await async_backup_device(pool, host, port, slave_id, output_dir, probe=probe)
+            if archive is not None:
+                archive.add(snap)
+            completed += 1
+            missing = snap.registers.count(None)
+            colour = Fore.YELLOW if missing else Fore.GREEN
+            print(f"{colour}[{completed + failures}/{len(devices)}] {host}:{port} slave {slave_id} backed up in {elapsed:.2f}s"
+                  f"{f' ({missing} registers missing)' if missing else ''} -> {file_path}{Style.RESET_ALL}")
+        except Exception as ex:
+            failures += 1
+            print(f"{Fore.RED}[{completed + failures}/{len(devices)}] {host}:{port} slave {slave_id} failed: {ex}{Style.RESET_ALL}")
+
+    try:
+        await asyncio.gather(*(_backup(*device) for device in devices))
+    finally:
+        pool.close()
+
+    print(f"{Style.BRIGHT}Backed up {completed} of {len(devices)} devices in {time.monotonic() - started:.2f}s"
+          f"{f' ({failures} failed)' if failures else ''}{Style.RESET_ALL}")
+    return failures == 0
+
+def load_backup(file_path):
+    """Read a backup file (snapshot or legacy text) into a list of REGISTER_COUNT values (None where a register couldn't be read)."""
+    values = snapshot.read_snapshot(file_path).registers
+    if len(values) != REGISTER_COUNT:
+        raise ValueError(f"Backup file must contain exactly {REGISTER_COUNT} values.")
+    return values
+
+def find_latest_backup(backup_dir, ip, slave_id):
+    """Return the newest backup (snapshot or legacy text) in backup_dir for the device, or None."""
+    prefix = f"heatmiser_backup_{ip.replace('.', '_')}_{slave_id}_"
+    extensions = (snapshot.FILE_EXTENSION, snapshot.LEGACY_FILE_EXTENSION)
+    matches = sorted(
+        (f for f in os.listdir(backup_dir) if f.startswith(prefix) and f.endswith(extensions)),
+        key=lambda f: os.path.splitext(f)[0],
+    )
+    return os.path.join(backup_dir, matches[-1]) if matches else None
+
+async def async_read_range(client, slave_id, start, end, read_count=const.MAX_REGISTER_READ_COUNT):
+    """Read registers start..end (inclusive), returning a REGISTER_COUNT long image with None outside the range."""
+    values = [None] * REGISTER_COUNT
+    for block_start, count in register_blocks.plan_register_reads(start, end, read_count):
+        result = await client.read_holding_registers(block_start, count=count, device_id=slave_id)
+        if not result.isError():
+            values[block_start:block_start+count] = result.registers
+    return values
+
+async def async_restore_device(pool, host, port, slave_id, values, progress=None, probe=False):
+    """Restore a backup to one device, only writing the registers that differ.
+
+    The device's current values are read first, the changed registers are written in
+    as few block writes as possible and then just those blocks are read back to verify.
+    If probe is set, the largest read and write sizes for the device's firmware are found first.
+    Returns a dict of statistics about the restore.
+    """
+    target = list(values[RESTORE_START:])
+    for register in const.RESTORE_SKIP_REGISTERS: # MODBUS ID, clock and temporary override state
+        target[register - RESTORE_START] = None
+
+    client = await pool.acquire(host, port)
+    try:
+        block_sizes = await async_block_sizes(pool, client, host, port, slave_id, writes=True) if probe else capabilities.BlockSizes()
+        started = time.monotonic()
+        current = await async_read_range(client, slave_id, RESTORE_START, REGISTER_COUNT - 1, block_sizes.read)
+        changed = register_blocks.changed_registers(current, target, RESTORE_START)
+        blocks = register_blocks.plan_register_writes(current, target, RESTORE_START, max_count=block_sizes.write)
+
+        for block_number, (block_start, block_values) in enumerate(blocks, start=1):
+            result = await client.write_registers(block_start, block_values, device_id=slave_id)
+            if result.isError():
+                raise IOError(f"Error writing registers {block_start}–{block_start+len(block_values)-1}: {result}")
+            if progress:
+                progress(block_number, len(blocks))
+
+        mismatched = []
+        for block_start, block_values in blocks:
+            result = await client.read_holding_registers(block_start, count=len(block_values), device_id=slave_id)
+            if result.isError() or list(result.registers) != list(block_values):
+                mismatched.append(block_start)
+        elapsed = time.monotonic() - started
+    finally:
+        pool.release(host, port)
+
+    return {
+        "registers_changed": len(changed),
+        "transactions": len(blocks),
+        "verify_failed_blocks": mismatched,
+        "seconds": elapsed,
+    }
+
+async def async_restore_single(host, port, slave_id, values):
+    pool = GatewayPool()
+    try:
+        return await async_restore_device(pool, host, port, slave_id, values)
+    finally:
+        pool.close()
+
+def print_restore_stats(host, port, slave_id, stats, prefix=""):
+    colour = Fore.RED if stats["verify_failed_blocks"] else Fore.GREEN
+    verify = (f", verify FAILED for blocks starting at {stats['verify_failed_blocks']}"
+              if stats["verify_failed_blocks"] else ", verified")
+    print(f"{colour}{prefix}{host}:{port} slave {slave_id}: {stats['registers_changed']} registers changed in "
+          f"{stats['transactions']} write transactions ({stats['seconds']:.2f}s){verify if stats['transactions'] else ''}{Style.RESET_ALL}")
+
+async def async_restore_devices(devices, backup_file=None, backup_dir=None, max_gateways=MAX_CONCURRENT_GATEWAYS, probe=False):
+    """Restore every (host, port, unit) concurrently, either all from backup_file or each from its latest backup in backup_dir."""
+    pool = GatewayPool(max_gateways)
+    started = time.monotonic()
+    done = 0
+    failures = 0
+    totals = {"registers_changed": 0, "transactions": 0}
+
+    async def _restore(host, port, slave_id):
+        nonlocal done, failures
+        try:
+            file_path = backup_file or find_latest_backup(backup_dir, host, slave_id)
+            if not file_path:
+                raise FileNotFoundError(f"No backup found in {backup_dir}")
+            stats = await async_restore_device(pool, host, port, slave_id, load_backup(file_path), probe=probe)
+            done += 1
+            totals["registers_changed"] += stats["registers_changed"]
+            totals["transactions"] += stats["transactions"]
+            if stats["verify_failed_blocks"]:
+                failures += 1
+            print_restore_stats(host, port, slave_id, stats, prefix=f"[{done}/{len(devices)}] ")
+        except Exception as ex:
+            done += 1
+            failures += 1
+            print(f"{Fore.RED}[{done}/{len(devices)}] {host}:{port} slave {slave_id} failed: {ex}{Style.RESET_ALL}")
+
+    try:
+        await asyncio.gather(*(_restore(*device) for device in devices))
+    finally:
+        pool.close()
+
+    print(f"{Style.BRIGHT}Restored {len(devices)} devices in {time.monotonic() - started:.2f}s: "
+          f"{totals['registers_changed']} registers changed in {totals['transactions']} write transactions"
+          f"{f' ({failures} failed)' if failures else ''}{Style.RESET_ALL}")
+    return failures == 0
 
 def main():
     parser = argparse.ArgumentParser(description='Modbus Backup & Restore Tool')
     parser.add_argument('--ip', help='Modbus device IP address')
     parser.add_argument('--slave-id', type=int, help='Modbus slave ID')
     parser.add_argument('--check', action='store_true', help='Check if device is online')
+    parser.add_argument('--backup', action='store_true', help='Back up the devices given by --devices/--devices-file without prompting')
+    parser.add_argument('--restore-file', help='Restore this backup to every device given by --devices/--devices-file')
+    parser.add_argument('--restore-dir', help='Restore each device given by --devices/--devices-file from its latest backup in this directory')
+    parser.add_argument('--devices', nargs='+', metavar='HOST:UNIT', help='Devices to back up or restore, as host:unit or host:port:unit')
+    parser.add_argument('--devices-file', help='File listing devices to back up or restore, one host:unit or host:port:unit per line')
+    parser.add_argument('--output-dir', default='.', help='Directory to write one snapshot per device to (default: current directory)')
+    parser.add_argument('--archive', help='Also add each backup to this snapshot archive database (see snapshot_archive.py)')
+    parser.add_argument('--probe-block-sizes', action='store_true', help='Find the largest blocks each firmware version can read and write at once, rather than 10 (restores rewrite the schedule registers to probe writes)')
+    parser.add_argument('--max-gateways', type=int, default=MAX_CONCURRENT_GATEWAYS, help='Maximum number of gateways to talk to at once')
     args = parser.parse_args()
 
+    if args.backup or args.devices or args.devices_file:
+        devices = load_devices(args.devices, args.devices_file)
+        if not devices:
+            parser.error("No devices given, use --devices or --devices-file")
+        if args.restore_file or args.restore_dir:
+            ok = asyncio.run(async_restore_devices(devices, args.restore_file, args.restore_dir, args.max_gateways, args.probe_block_sizes))
+        else:
+            archive = SnapshotArchive(args.archive) if args.archive else None
+            try:
+                ok = asyncio.run(async_backup_devices(devices, args.output_dir, args.max_gateways, archive, args.probe_block_sizes))
+            finally:
+                if archive is not None:
+                    archive.close()
+        raise SystemExit(0 if ok else 1)
+
     if args.check and args.ip and args.slave_id:
         check_device_online(args.ip, args.slave_id)
         return
@@ -1,153 +1,280 @@
+import asyncio
+import queue
+import threading
 import tkinter as tk
-from tkinter import messagebox, scrolledtext, filedialog
-from pymodbus.client import ModbusTcpClient
+from tkinter import messagebox, scrolledtext, filedialog, ttk
 import os
 import time
 
-REGISTER_COUNT = 218
-RESTORE_START = 21
+from _integration import load_integration_module
+
+snapshot = load_integration_module("snapshot")
+
+from backup_and_restore import (
+    REGISTER_COUNT,
+    GatewayPool,
+    async_backup_device,
+    async_restore_device,
+    backup_filename,
+    find_latest_backup,
+    load_backup,
+    parse_device,
+)
+
+class AsyncWorker:
+    """Runs an asyncio event loop in a background thread so Modbus I/O never blocks Tk."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the worker loop, returning a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
 
 class ModbusApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Modbus Backup & Restore Tool")
-        self.root.geometry("550x420")
+        self.root.geometry("620x560")
 
-        # IP address input
-        tk.Label(root, text="Device IP:").grid(row=0, column=0, padx=10, pady=5, sticky="e")
-        self.ip_entry = tk.Entry(root, width=30)
-        self.ip_entry.grid(row=0, column=1, padx=10, pady=5)
+        self.worker = AsyncWorker()
+        self.events = queue.Queue()  # Messages from the worker thread, only read on the Tk thread
+        self.job = None
+        self.progress_bars = {}
 
-        # Slave ID input
-        tk.Label(root, text="Slave ID:").grid(row=1, column=0, padx=10, pady=5, sticky="e")
-        self.slave_entry = tk.Entry(root, width=10)
-        self.slave_entry.grid(row=1, column=1, padx=10, pady=5, sticky="w")
+        # Devices input, one host:unit (or host:port:unit) per line
+        tk.Label(root, text="Devices (IP:Slave ID,\none per line):").grid(row=0, column=0, padx=10, pady=5, sticky="ne")
+        self.devices_text = tk.Text(root, width=30, height=5)
+        self.devices_text.grid(row=0, column=1, padx=10, pady=5, sticky="w")
 
         # Buttons
-        self.backup_btn = tk.Button(root, text="Backup Registers", command=self.backup_registers)
-        self.backup_btn.grid(row=2, column=0, columnspan=2, pady=10)
+        buttons = tk.Frame(root)
+        buttons.grid(row=1, column=0, columnspan=2, pady=10)
+        self.backup_btn = tk.Button(buttons, text="Backup Registers", command=self.backup_registers)
+        self.backup_btn.pack(side=tk.LEFT, padx=5)
+        self.restore_btn = tk.Button(buttons, text="Restore Registers", command=self.restore_registers)
+        self.restore_btn.pack(side=tk.LEFT, padx=5)
+        self.cancel_btn = tk.Button(buttons, text="Cancel", command=self.cancel, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
 
-        self.restore_btn = tk.Button(root, text="Restore Registers", command=self.restore_registers)
-        self.restore_btn.grid(row=3, column=0, columnspan=2, pady=5)
+        # One progress bar per device
+        self.progress_frame = tk.Frame(root)
+        self.progress_frame.grid(row=2, column=0, columnspan=2, padx=10, sticky="ew")
+        self.progress_frame.columnconfigure(1, weight=1)
 
         # Output area
-        self.output = scrolledtext.ScrolledText(root, width=65, height=15)
-        self.output.grid(row=4, column=0, columnspan=2, padx=10, pady=10)
+        self.output = scrolledtext.ScrolledText(root, width=72, height=15)
+        self.output.grid(row=3, column=0, columnspan=2, padx=10, pady=10)
+
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.root.after(50, self.process_events)
 
     def log(self, message):
         self.output.insert(tk.END, message + "\n")
         self.output.see(tk.END)
 
-    def read_registers(self, client, slave_id):
-        all_values = [None] * REGISTER_COUNT
-        for i in range(0, 210, 10):
-            result = client.read_holding_registers(i, count=10, slave=slave_id)
-            if result.isError():
-                self.log(f"Error reading {i}–{i+9}: {result}")
-                continue
-            all_values[i:i+10] = result.registers
-
-        result = client.read_holding_registers(210, count=8, slave=slave_id)
-        if not result.isError():
-            all_values[210:218] = result.registers
-        else:
-            self.log("Error reading 210–217")
+    # ===== Thread safe helpers, called from the worker thread =====
 
-        return all_values
+    def post_log(self, message):
+        self.events.put(("log", message))
 
-    def write_registers(self, client, slave_id, values):
-        for i in range(RESTORE_START, 210, 10):
-            chunk = values[i:i+10]
-            if None in chunk:
-                self.log(f"Skipping write to {i}–{i+9} (missing data)")
-                continue
-            client.write_registers(i, chunk, slave=slave_id)
+    def post_progress(self, device, fraction):
+        self.events.put(("progress", (device, fraction)))
 
-        last_chunk = values[210:218]
-        if None not in last_chunk:
-            client.write_registers(210, last_chunk, slave=slave_id)
-        else:
-            self.log("Skipping write to 210–217 (missing data)")
+    # ===== Tk thread =====
 
-    def backup_registers(self):
-        device_ip = self.ip_entry.get().strip()
+    def process_events(self):
+        """Apply everything the worker has posted since the last call, then check again shortly."""
         try:
-            slave_id = int(self.slave_entry.get())
-        except ValueError:
-            messagebox.showerror("Invalid Input", "Slave ID must be an integer.")
-            return
+            while True:
+                kind, payload = self.events.get_nowait()
+                if kind == "log":
+                    self.log(payload)
+                elif kind == "progress":
+                    device, fraction = payload
+                    if device in self.progress_bars:
+                        self.progress_bars[device]["value"] = fraction * 100
+        except queue.Empty:
+            pass
+        if self.job is not None and self.job.done():
+            self.finish_job()
+        self.root.after(50, self.process_events)
 
-        if not device_ip:
-            messagebox.showerror("Missing Input", "Device IP cannot be empty.")
-            return
+    def get_devices(self):
+        lines = [line.strip() for line in self.devices_text.get("1.0", tk.END).splitlines() if line.strip()]
+        try:
+            return [parse_device(line) for line in lines]
+        except ValueError as ex:
+            messagebox.showerror("Invalid Input", str(ex))
+            return None
 
-        # Build default filename
-        ip_sanitized = device_ip.replace(".", "_")
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        default_filename = f"heatmiser_backup_{ip_sanitized}_{slave_id}_{timestamp}.txt"
-
-        # Ask user where to save
-        file_path = filedialog.asksaveasfilename(
-            initialfile=default_filename,
-            defaultextension=".txt",
-            filetypes=[("Text Files", "*.txt")]
-        )
-        if not file_path:
-            self.log("Backup cancelled.")
-            return
+    def start_job(self, devices, coro):
+        for child in self.progress_frame.winfo_children():
+            child.destroy()
+        self.progress_bars = {}
+        for row, (host, port, slave_id) in enumerate(devices):
+            tk.Label(self.progress_frame, text=f"{host}:{slave_id}").grid(row=row, column=0, sticky="w")
+            bar = ttk.Progressbar(self.progress_frame, maximum=100)
+            bar.grid(row=row, column=1, sticky="ew", padx=5, pady=1)
+            self.progress_bars[(host, port, slave_id)] = bar
+
+        self.backup_btn.config(state=tk.DISABLED)
+        self.restore_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.job = self.worker.submit(coro)
 
-        self.log(f"Connecting to {device_ip}...")
-        client = ModbusTcpClient(device_ip)
-        if not client.connect():
-            self.log("Connection failed.")
+    def finish_job(self):
+        job, self.job = self.job, None
+        if job.cancelled():
+            self.log("Cancelled.")
+        elif job.exception() is not None:
+            self.log(f"Failed: {job.exception()}")
+        self.backup_btn.config(state=tk.NORMAL)
+        self.restore_btn.config(state=tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED)
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def close(self):
+        self.cancel()
+        self.worker.stop()
+        self.root.destroy()
+
+    def backup_registers(self):
+        devices = self.get_devices()
+        if devices is None:
+            return
+        if not devices:
+            messagebox.showerror("Missing Input", "Enter at least one device.")
             return
 
-        self.log("Reading registers 0–217...")
-        values = self.read_registers(client, slave_id)
-        client.close()
+        if len(devices) == 1:
+            # Ask user where to save
+            host, port, slave_id = devices[0]
+            file_path = filedialog.asksaveasfilename(
+                initialfile=backup_filename(host, slave_id),
+                defaultextension=snapshot.FILE_EXTENSION,
+                filetypes=[("Heatmiser snapshots", f"*{snapshot.FILE_EXTENSION}")]
+            )
+            if not file_path:
+                self.log("Backup cancelled.")
+                return
+            output_dir, file_name = os.path.split(file_path)
+        else:
+            output_dir = filedialog.askdirectory(title="Folder to save backups to")
+            if not output_dir:
+                self.log("Backup cancelled.")
+                return
+            file_name = None
 
-        with open(file_path, "w") as f:
-            f.write(",".join(map(str, values)))
+        self.start_job(devices, self.async_backup(devices, output_dir, file_name))
 
-        self.log(f"Backup saved to {file_path}.")
+    async def async_backup(self, devices, output_dir, file_name=None):
+        pool = GatewayPool()
+        started = time.monotonic()
 
+        async def _backup(host, port, slave_id):
+            device = (host, port, slave_id)
+            self.post_log(f"Reading registers 0–217 from {host}:{port} slave {slave_id}...")
+            try:
+                file_path, snap, elapsed = await async_backup_device(
+                    pool, host, port, slave_id, output_dir,
+                    progress=lambda start, count: self.post_progress(device, (start + count) / REGISTER_COUNT),
+                )
+                if file_name:
+                    os.replace(file_path, os.path.join(output_dir, file_name))
+                    file_path = os.path.join(output_dir, file_name)
+                missing = snap.registers.count(None)
+                self.post_log(f"Backup of {host} slave {slave_id} saved to {file_path} in {elapsed:.2f}s"
+                              f"{f' ({missing} registers could not be read)' if missing else ''}.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.post_log(f"Backup of {host} slave {slave_id} failed: {ex}")
 
-    def restore_registers(self):
-        device_ip = self.ip_entry.get()
         try:
-            slave_id = int(self.slave_entry.get())
-        except ValueError:
-            messagebox.showerror("Invalid Input", "Slave ID must be an integer.")
-            return
+            await asyncio.gather(*(_backup(*device) for device in devices))
+        finally:
+            pool.close()
+        self.post_log(f"Finished backing up {len(devices)} devices in {time.monotonic() - started:.2f}s.")
 
-        file_path = filedialog.askopenfilename(filetypes=[("Text Files", "*.txt")])
-        if not file_path:
-            self.log("Restore cancelled.")
+    def restore_registers(self):
+        devices = self.get_devices()
+        if devices is None:
             return
-
-        if not os.path.exists(file_path):
-            self.log(f"File not found: {file_path}")
+        if not devices:
+            messagebox.showerror("Missing Input", "Enter at least one device.")
             return
 
-        with open(file_path, "r") as f:
-            values_str = f.read().strip().split(",")
-            values = [int(v) if v != "None" else None for v in values_str]
+        if len(devices) == 1:
+            file_path = filedialog.askopenfilename(filetypes=[
+                ("Backups", f"*{snapshot.FILE_EXTENSION} *{snapshot.LEGACY_FILE_EXTENSION}"),
+                ("Heatmiser snapshots", f"*{snapshot.FILE_EXTENSION}"),
+                ("Legacy text backups", f"*{snapshot.LEGACY_FILE_EXTENSION}"),
+            ])
+            if not file_path:
+                self.log("Restore cancelled.")
+                return
+            backups = {devices[0]: file_path}
+        else:
+            backup_dir = filedialog.askdirectory(title="Folder containing the latest backup of each device")
+            if not backup_dir:
+                self.log("Restore cancelled.")
+                return
+            backups = {}
+            for host, port, slave_id in devices:
+                file_path = find_latest_backup(backup_dir, host, slave_id)
+                if file_path is None:
+                    self.log(f"No backup found for {host} slave {slave_id}, skipping.")
+                    continue
+                backups[(host, port, slave_id)] = file_path
 
-        if len(values) != REGISTER_COUNT:
-            self.log(f"File must contain {REGISTER_COUNT} values.")
-            return
+        # Load everything before connecting, so a bad file doesn't leave a restore half done
+        values = {}
+        for device, file_path in backups.items():
+            try:
+                values[device] = load_backup(file_path)
+            except (OSError, ValueError) as ex:
+                self.log(f"Could not read {file_path}: {ex}")
+                return
 
-        self.log(f"Connecting to {device_ip}...")
-        client = ModbusTcpClient(device_ip)
-        if not client.connect():
-            self.log("Connection failed.")
-            return
+        self.start_job(list(values), self.async_restore(values))
+
+    async def async_restore(self, values):
+        pool = GatewayPool()
 
-        self.log("Restoring writable registers 21–217...")
-        # NOTE TO FUTURE SEB, OUGHT TO MAKE SURE THAT YOU DON'T OVERWRITE THE REGISTER CONTAINING THE MODBUS ID (31 WHEN IN TIMER)
-        self.write_registers(client, slave_id, values)
-        client.close()
-        self.log("Restore complete.")
+        async def _restore(device, device_values):
+            host, port, slave_id = device
+            self.post_log(f"Restoring changed writable registers to {host}:{port} slave {slave_id}...")
+            try:
+                stats = await async_restore_device(
+                    pool, host, port, slave_id, device_values,
+                    progress=lambda done, total: self.post_progress(device, done / total),
+                )
+                self.post_progress(device, 1)
+                verified = "verify FAILED" if stats["verify_failed_blocks"] else "verified"
+                self.post_log(f"Restore of {host} slave {slave_id} complete: {stats['registers_changed']} registers changed in "
+                              f"{stats['transactions']} writes ({stats['seconds']:.2f}s, {verified}).")
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.post_log(f"Restore of {host} slave {slave_id} failed: {ex}")
+
+        try:
+            await asyncio.gather(*(_restore(device, device_values) for device, device_values in values.items()))
+        finally:
+            pool.close()
 
 if __name__ == "__main__":
     root = tk.Tk()
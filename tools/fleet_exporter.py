@@ -0,0 +1,578 @@
+"""Poll a fleet of Heatmiser Edge devices and serve their state as OpenMetrics (Prometheus).
+
+Runs without Home Assistant, using the integration's register store and poller. The fleet is
+described in a YAML file:
+
+    listen: 0.0.0.0:9731        # Address to serve /metrics on
+    interval: 30                # Usual seconds between polls of each device
+    min_interval: 10            # Polls speed up to this while a device's state is changing
+    max_interval: 300           # and slow down to this while it isn't
+    full_every: 10              # Read every register every N intervals, only the status registers otherwise
+    max_concurrent_polls: 64    # Polls in flight at once across all gateways (per worker)
+    workers: 4                  # Worker processes to spread the gateways over (default 1, no workers)
+    rebalance_interval: 600     # Seconds between checks that the workers are evenly loaded
+    gateways:
+      - host: 192.168.1.50
+        port: 502
+        requests_per_second: 10 # Optional limit for gateways that drop requests sent too quickly
+        burst: 5
+        pipeline_window: 4      # Optional, pipelined reads for gateways that can queue requests
+        units: [1, 2, {id: 3, name: Kitchen}]
+
+Each gateway is polled by a single task working through its devices in due order, so a
+gateway's RS485 bus is never asked to do more than one thing at a time.
+
+With more than one worker, the gateways are shared out between worker processes, each with its
+own event loop and connections. Workers send their devices' latest values back to the main
+process over a pipe every few seconds, and the main process serves /metrics from those. The
+registers read per second on each gateway are measured, and gateways are moved between workers
+when that evens out the load noticeably.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import heapq
+import logging
+import multiprocessing
+import time
+
+import yaml
+
+from _integration import load_integration_module
+
+const = load_integration_module("const")
+heatmiser_edge = load_integration_module("heatmiser_edge")
+poller = load_integration_module("poller")
+
+_LOGGER = logging.getLogger("fleet_exporter")
+
+DEFAULT_LISTEN = "0.0.0.0:9731"
+DEFAULT_PORT = 502
+DEFAULT_MAX_CONCURRENT_POLLS = 64
+DEFAULT_WORKERS = 1
+DEFAULT_REBALANCE_INTERVAL = 600  # Seconds
+REPORT_INTERVAL = 5               # Seconds between reports from each worker to the main process
+REBALANCE_MIN_IMPROVEMENT = 0.2   # Only move gateways if the busiest worker's load drops by at least this fraction
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Fields of a device row, the per device summary that the metrics are rendered from (and that workers send back)
+(ROW_LABELS, ROW_UP, ROW_ROOM_TEMPERATURE, ROW_SET_TEMPERATURE, ROW_RELAY, ROW_DEVICE_ON, ROW_OPERATION_MODE,
+ ROW_LAST_POLL_TIME, ROW_POLL_DURATION_SUM, ROW_POLL_COUNT, ROW_POLL_ERRORS, ROW_POLLS, ROW_UNIT_ID) = range(13)
+
+
+class FleetDevice:
+    """One device in the fleet: its register store, poller and metric labels."""
+
+    __slots__ = ("host", "port", "unit_id", "name", "store", "poller", "labels")
+
+    def __init__(self, host, port, unit_id, name, config):
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.name = name
+        self.store = heatmiser_edge.heatmiser_edge_register_store(host, port, unit_id)
+        self.store.sync_device_time = False  # Leave the clocks alone, this is only watching
+        self.poller = poller.RegisterStorePoller(
+            self.store, config["interval"], config["full_every"], config["min_interval"], config["max_interval"])
+        self.labels = format_labels(gateway=f"{host}:{port}", unit=str(unit_id), name=name)
+
+    def register(self, register_name, scale=1, device_type=None):
+        store = self.store
+        if store.device_type is None or (device_type is not None and store.device_type != device_type):
+            return None
+        value = store.registers[int(getattr(const.RegisterAddresses[store.device_type], register_name))]
+        if value is None or scale == 1:
+            return value
+        return value / scale
+
+    def row(self):
+        """Summarise the device for the metrics (a plain tuple, so it is cheap to send between processes)."""
+        p = self.poller
+        return (
+            self.labels,
+            1 if p.last_poll_ok else 0,
+            self.register("ROOM_TEMPERATURE_RD", 10, const.DEVICE_TYPE_THERMOSTAT),
+            self.register("CURRENT_SETTING_TEMPERATURE_RD", 10, const.DEVICE_TYPE_THERMOSTAT),
+            self.register("RELAY_STATUS_RD"),
+            self.register("THERMOSTAT_ON_OFF_MODE_RD"),
+            self.register("CURRENT_OPERATION_MODE_RD"),
+            p.last_poll_time,
+            p.poll_duration_sum,
+            p.polls + p.errors,
+            p.errors,
+            p.polls,
+            self.unit_id,
+        )
+
+    def seed(self, row):
+        """Carry the counters over from a row reported by the worker that polled this device before."""
+        self.poller.polls = row[ROW_POLLS]
+        self.poller.errors = row[ROW_POLL_ERRORS]
+        self.poller.poll_duration_sum = row[ROW_POLL_DURATION_SUM]
+
+
+def gateway_key(gateway):
+    return f"{gateway['host']}:{gateway['port']}"
+
+
+def load_config(file_path):
+    """Read the fleet YAML file, filling in defaults and normalising the unit list."""
+    with open(file_path, "r") as f:
+        config = yaml.safe_load(f) or {}
+
+    gateways = []
+    for gateway in config.get("gateways") or []:
+        if "host" not in gateway:
+            raise ValueError("Every gateway needs a host")
+        units = []
+        for unit in gateway.get("units") or []:
+            if isinstance(unit, dict):
+                unit_id = int(unit["id"])
+                units.append((unit_id, str(unit.get("name", unit_id))))
+            else:
+                units.append((int(unit), str(unit)))
+        gateways.append({
+            "host": str(gateway["host"]),
+            "port": int(gateway.get("port", DEFAULT_PORT)),
+            "requests_per_second": float(gateway.get("requests_per_second", const.DEFAULT_GATEWAY_REQUESTS_PER_SECOND)),
+            "burst": float(gateway.get("burst", const.DEFAULT_GATEWAY_BURST)),
+            "pipeline_window": int(gateway.get("pipeline_window", const.DEFAULT_PIPELINE_WINDOW)),
+            "units": units,
+        })
+    if not gateways:
+        raise ValueError("No gateways configured")
+
+    return {
+        "listen": str(config.get("listen", DEFAULT_LISTEN)),
+        "interval": float(config.get("interval", const.DEFAULT_POLL_INTERVAL)),
+        "full_every": int(config.get("full_every", const.DEFAULT_FULL_POLL_EVERY)),
+        "min_interval": float(config.get("min_interval", const.DEFAULT_MIN_POLL_INTERVAL)),
+        "max_interval": float(config.get("max_interval", const.DEFAULT_MAX_POLL_INTERVAL)),
+        "max_concurrent_polls": int(config.get("max_concurrent_polls", DEFAULT_MAX_CONCURRENT_POLLS)),
+        "workers": max(1, int(config.get("workers", DEFAULT_WORKERS))),
+        "rebalance_interval": float(config.get("rebalance_interval", DEFAULT_REBALANCE_INTERVAL)),
+        "gateways": gateways,
+    }
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(**labels):
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def plan_assignment(loads, workers):
+    """Share gateways out between workers, busiest gateway first to the least loaded worker.
+
+    loads maps gateway key to its load. Returns a list (one per worker) of sets of gateway keys.
+    """
+    assignment = [set() for _ in range(workers)]
+    heap = [(0.0, worker) for worker in range(workers)]
+    for key, load in sorted(loads.items(), key=lambda item: (-item[1], item[0])):
+        worker_load, worker = heapq.heappop(heap)
+        assignment[worker].add(key)
+        heapq.heappush(heap, (worker_load + load, worker))
+    return assignment
+
+
+def keep_in_place(current, proposed):
+    """Reorder a proposed assignment so each worker keeps as many of its current gateways as possible."""
+    result = [None] * len(current)
+    pairs = sorted(((len(c & p), w, i) for w, c in enumerate(current) for i, p in enumerate(proposed)), reverse=True)
+    used = set()
+    for _, worker, index in pairs:
+        if result[worker] is None and index not in used:
+            result[worker] = proposed[index]
+            used.add(index)
+    return result
+
+
+def busiest_load(assignment, loads):
+    return max((sum(loads.get(key, 0) for key in keys) for keys in assignment), default=0)
+
+
+class MetricsRenderer:
+    """Renders device rows as OpenMetrics and serves them over HTTP."""
+
+    def __init__(self, listen):
+        self.listen = listen
+        self.last_scrape_duration = 0.0
+        self.scrapes = 0
+
+    def device_rows(self):
+        raise NotImplementedError
+
+    def exporter_samples(self):
+        """Extra (family name, type, help, samples) tuples describing the exporter itself."""
+        return []
+
+    def render_metrics(self):
+        """Return the current state of the fleet in the OpenMetrics text format."""
+        started = time.monotonic()
+        rows = self.device_rows()
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"# HELP {name} {help_text}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{labels} {format_value(value)}")
+
+        def column(name, field):
+            return ((name, row[ROW_LABELS], row[field]) for row in rows if row[field] is not None)
+
+        family("heatmiser_edge_up", "gauge", "Whether the last poll of the device succeeded.",
+               column("heatmiser_edge_up", ROW_UP))
+        family("heatmiser_edge_room_temperature_celsius", "gauge", "Room temperature.",
+               column("heatmiser_edge_room_temperature_celsius", ROW_ROOM_TEMPERATURE))
+        family("heatmiser_edge_set_temperature_celsius", "gauge", "Temperature the thermostat is currently aiming for.",
+               column("heatmiser_edge_set_temperature_celsius", ROW_SET_TEMPERATURE))
+        family("heatmiser_edge_relay_on", "gauge", "Whether the output relay is on.",
+               column("heatmiser_edge_relay_on", ROW_RELAY))
+        family("heatmiser_edge_device_on", "gauge", "Whether the device is switched on.",
+               column("heatmiser_edge_device_on", ROW_DEVICE_ON))
+        family("heatmiser_edge_operation_mode", "gauge", "Current operation mode number (see the protocol document).",
+               column("heatmiser_edge_operation_mode", ROW_OPERATION_MODE))
+        family("heatmiser_edge_last_poll_timestamp_seconds", "gauge", "When the device was last polled.",
+               column("heatmiser_edge_last_poll_timestamp_seconds", ROW_LAST_POLL_TIME))
+
+        lines.append("# TYPE heatmiser_edge_poll_duration_seconds summary")
+        lines.append("# HELP heatmiser_edge_poll_duration_seconds Time taken to poll the device.")
+        for row in rows:
+            lines.append(f"heatmiser_edge_poll_duration_seconds_sum{row[ROW_LABELS]} {format_value(row[ROW_POLL_DURATION_SUM])}")
+            lines.append(f"heatmiser_edge_poll_duration_seconds_count{row[ROW_LABELS]} {row[ROW_POLL_COUNT]}")
+        family("heatmiser_edge_poll_errors", "counter", "Polls of the device that failed.",
+               column("heatmiser_edge_poll_errors_total", ROW_POLL_ERRORS))
+
+        family("heatmiser_exporter_devices", "gauge", "Devices being polled.", (("heatmiser_exporter_devices", "", len(rows)),))
+        for exporter_family in self.exporter_samples():
+            family(*exporter_family)
+        family("heatmiser_exporter_scrapes", "counter", "Scrapes served.", (("heatmiser_exporter_scrapes_total", "", self.scrapes),))
+        family("heatmiser_exporter_scrape_duration_seconds", "gauge", "Time taken to render the previous scrape.",
+               (("heatmiser_exporter_scrape_duration_seconds", "", self.last_scrape_duration),))
+        lines.append("# EOF")
+
+        self.scrapes += 1
+        self.last_scrape_duration = time.monotonic() - started
+        return "\n".join(lines) + "\n"
+
+    async def _handle_http(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while True:  # Headers aren't needed
+                header = await asyncio.wait_for(reader.readline(), 10)
+                if header in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            content_type = "text/plain; charset=utf-8"
+            if len(parts) < 2 or parts[0] not in ("GET", "HEAD"):
+                status, body = "405 Method Not Allowed", b"Method not allowed\n"
+            elif parts[1].split("?")[0] == "/metrics":
+                status, body, content_type = "200 OK", self.render_metrics().encode("utf-8"), CONTENT_TYPE
+            elif parts[1] == "/":
+                status, body = "200 OK", b"Heatmiser Edge fleet exporter, metrics are at /metrics\n"
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            head = (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode("latin-1")
+            writer.write(head if parts and parts[0] == "HEAD" else head + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def async_start_server(self):
+        host, _, port = self.listen.rpartition(":")
+        return await asyncio.start_server(self._handle_http, host or None, int(port))
+
+
+class FleetPoller:
+    """Polls a set of gateways from one event loop."""
+
+    def __init__(self, config):
+        self.config = config
+        self.gateways = {}  # Gateway key -> list of FleetDevice
+        self._tasks = {}    # Gateway key -> polling task
+        self._poll_limit = asyncio.Semaphore(config["max_concurrent_polls"])
+        self.polls_in_flight = 0
+
+    @property
+    def devices(self):
+        return [device for devices in self.gateways.values() for device in devices]
+
+    def add_gateway(self, gateway, seeds=None):
+        """Start polling a gateway. seeds optionally maps unit id to that device's last reported row."""
+        key = gateway_key(gateway)
+        devices = []
+        for unit_id, name in gateway["units"]:
+            device = FleetDevice(gateway["host"], gateway["port"], unit_id, name, self.config)
+            if seeds and unit_id in seeds:
+                device.seed(seeds[unit_id])
+            device.store.gateway.set_rate_limit(device.store, gateway["requests_per_second"], gateway["burst"])
+            device.store.pipeline_window = gateway["pipeline_window"]
+            devices.append(device)
+        self.gateways[key] = devices
+        if devices:
+            self._tasks[key] = asyncio.create_task(self.async_poll_gateway(devices))
+
+    def remove_gateway(self, key):
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+        for device in self.gateways.pop(key, []):
+            device.store.close()
+
+    def close(self):
+        for key in list(self.gateways):
+            self.remove_gateway(key)
+
+    async def async_poll_gateway(self, devices):
+        """Poll each device on one gateway whenever it is due, one at a time (see poller.async_poll_in_turn)."""
+        await poller.async_poll_in_turn([device.poller for device in devices], self._async_poll)
+
+    async def _async_poll(self, device_poller, status_only):
+        async with self._poll_limit:
+            self.polls_in_flight += 1
+            try:
+                return await device_poller.async_poll(status_only=status_only)
+            finally:
+                self.polls_in_flight -= 1
+
+    def gateway_registers_read(self):
+        """Registers read so far on each gateway, the measure of load used to balance workers."""
+        return {key: sum(device.poller.registers_read for device in devices) for key, devices in self.gateways.items()}
+
+
+class FleetExporter(MetricsRenderer):
+    """Polls the whole fleet in this process."""
+
+    def __init__(self, config):
+        super().__init__(config["listen"])
+        self.config = config
+        self.poller = None
+
+    def device_rows(self):
+        return [device.row() for device in self.poller.devices]
+
+    def exporter_samples(self):
+        return [("heatmiser_exporter_polls_in_flight", "gauge", "Polls currently in progress.",
+                 (("heatmiser_exporter_polls_in_flight", "", self.poller.polls_in_flight),))]
+
+    async def async_run(self):
+        self.poller = FleetPoller(self.config)
+        for gateway in self.config["gateways"]:
+            self.poller.add_gateway(gateway)
+        server = await self.async_start_server()
+        _LOGGER.info("Polling %d devices on %d gateways, serving metrics on %s",
+                     len(self.poller.devices), len(self.poller.gateways), self.listen)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.poller.close()
+
+
+# ===== Worker processes =====
+
+def _worker_main(conn, config, verbose):
+    """Entry point of a worker process."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(processName)s: %(message)s")
+    if not verbose:
+        logging.getLogger(poller.__name__).setLevel(logging.ERROR)
+    try:
+        asyncio.run(_async_worker(conn, config))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _async_worker(conn, config):
+    loop = asyncio.get_running_loop()
+    fleet = FleetPoller(config)
+    gateways = {gateway_key(gateway): gateway for gateway in config["gateways"]}
+
+    async def report():
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            rows = {key: [device.row() for device in devices] for key, devices in fleet.gateways.items()}
+            conn.send(("report", rows, fleet.gateway_registers_read(), fleet.polls_in_flight, time.process_time()))
+
+    reporter = asyncio.create_task(report())
+    try:
+        while True:
+            message = await loop.run_in_executor(None, conn.recv)
+            if message[0] == "assign":
+                keys, seeds = message[1], message[2]
+                for key in set(fleet.gateways) - keys:
+                    fleet.remove_gateway(key)
+                for key in keys - set(fleet.gateways):
+                    fleet.add_gateway(gateways[key], seeds.get(key))
+            elif message[0] == "stop":
+                break
+    except EOFError:  # The main process has gone
+        pass
+    finally:
+        reporter.cancel()
+        fleet.close()
+
+
+class Worker:
+    """The main process's handle on one worker process."""
+
+    def __init__(self, index, config, verbose):
+        self.index = index
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main, args=(child_conn, config, verbose),
+                                               name=f"worker-{index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.gateways = set()
+        self.rows = {}             # Gateway key -> device rows from the last report
+        self.registers_read = {}   # Gateway key -> registers read, from the last report
+        self.polls_in_flight = 0
+        self.cpu_seconds = 0.0
+
+    def assign(self, keys, seeds):
+        self.gateways = set(keys)
+        self.conn.send(("assign", set(keys), seeds))
+
+    def stop(self):
+        try:
+            self.conn.send(("stop",))
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ShardedFleetExporter(MetricsRenderer):
+    """Spreads the gateways over worker processes and serves the combined metrics."""
+
+    def __init__(self, config, verbose=False):
+        super().__init__(config["listen"])
+        self.config = config
+        self.verbose = verbose
+        self.workers = []
+        self.rows = {}  # Gateway key -> latest device rows, from whichever worker polls it
+        self.rebalances = 0
+        self._gateway_units = {gateway_key(g): len(g["units"]) for g in config["gateways"]}
+        self._executor = None  # One thread per worker waiting on its pipe
+
+    def device_rows(self):
+        return [row for rows in self.rows.values() for row in rows]
+
+    def exporter_samples(self):
+        return [
+            ("heatmiser_exporter_workers", "gauge", "Worker processes polling the fleet.",
+             (("heatmiser_exporter_workers", "", len(self.workers)),)),
+            ("heatmiser_exporter_polls_in_flight", "gauge", "Polls currently in progress.",
+             (("heatmiser_exporter_polls_in_flight", format_labels(worker=str(w.index)), w.polls_in_flight) for w in self.workers)),
+            ("heatmiser_exporter_worker_gateways", "gauge", "Gateways assigned to each worker.",
+             (("heatmiser_exporter_worker_gateways", format_labels(worker=str(w.index)), len(w.gateways)) for w in self.workers)),
+            ("heatmiser_exporter_worker_cpu_seconds", "counter", "CPU time used by each worker.",
+             (("heatmiser_exporter_worker_cpu_seconds_total", format_labels(worker=str(w.index)), w.cpu_seconds) for w in self.workers)),
+            ("heatmiser_exporter_rebalances", "counter", "Times gateways were moved between workers.",
+             (("heatmiser_exporter_rebalances_total", "", self.rebalances),)),
+        ]
+
+    def _seeds(self, key):
+        """Counters for the devices on a gateway, so moving it to another worker doesn't reset them."""
+        return {row[ROW_UNIT_ID]: row for row in self.rows.get(key, [])}
+
+    def _apply(self, assignment):
+        for worker, keys in zip(self.workers, assignment):
+            if keys != worker.gateways:
+                worker.assign(keys, {key: self._seeds(key) for key in keys - worker.gateways})
+
+    async def _receive(self, worker):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                message = await loop.run_in_executor(self._executor, worker.conn.recv)
+            except EOFError:
+                raise RuntimeError(f"Worker {worker.index} stopped unexpectedly") from None
+            _, rows, registers_read, worker.polls_in_flight, worker.cpu_seconds = message
+            # Ignore anything about gateways that have just moved away from this worker
+            for key in rows.keys() & worker.gateways:
+                self.rows[key] = rows[key]
+            worker.registers_read = {key: registers_read[key] for key in registers_read.keys() & worker.gateways}
+
+    async def _rebalance(self):
+        """Periodically move gateways between workers if it makes the busiest worker noticeably less busy."""
+        previous = {}
+        while True:
+            await asyncio.sleep(self.config["rebalance_interval"])
+            counts = {}
+            for worker in self.workers:
+                counts.update(worker.registers_read)
+            # Load is registers read per second since the last check (counters restart when a gateway moves)
+            loads = {key: max(0, count - previous.get(key, 0)) / self.config["rebalance_interval"] for key, count in counts.items()}
+            previous = counts
+            if len(loads) < len(self._gateway_units):
+                continue  # Not every gateway has reported yet
+            current = [worker.gateways for worker in self.workers]
+            proposed = keep_in_place(current, plan_assignment(loads, len(self.workers)))
+            current_load, proposed_load = busiest_load(current, loads), busiest_load(proposed, loads)
+            if current_load > 0 and proposed_load <= current_load * (1 - REBALANCE_MIN_IMPROVEMENT):
+                _LOGGER.info("Rebalancing gateways, busiest worker load %.1f -> %.1f registers/s", current_load, proposed_load)
+                self._apply(proposed)
+                self.rebalances += 1
+                previous = {}
+
+    async def async_run(self):
+        self.workers = [Worker(index, self.config, self.verbose) for index in range(self.config["workers"])]
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.workers))
+        try:
+            # Until there are measurements, assume load is proportional to the number of devices
+            self._apply(plan_assignment(self._gateway_units, len(self.workers)))
+            server = await self.async_start_server()
+            _LOGGER.info("Polling %d devices on %d gateways with %d workers, serving metrics on %s",
+                         sum(self._gateway_units.values()), len(self._gateway_units), len(self.workers), self.listen)
+            async with server:
+                await asyncio.gather(server.serve_forever(), self._rebalance(), *(self._receive(worker) for worker in self.workers))
+        finally:
+            for worker in self.workers:
+                worker.stop()
+            self._executor.shutdown(wait=False)
+
+
+async def async_main(config, verbose=False):
+    if config["workers"] > 1:
+        await ShardedFleetExporter(config, verbose).async_run()
+    else:
+        await FleetExporter(config).async_run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Heatmiser Edge fleet poller and OpenMetrics exporter')
+    parser.add_argument('config', help='Fleet YAML file')
+    parser.add_argument('--listen', help='Address to serve metrics on, overriding the config file (e.g. 0.0.0.0:9731)')
+    parser.add_argument('--workers', type=int, help='Worker processes to spread the gateways over, overriding the config file')
+    parser.add_argument('--verbose', action='store_true', help='Log every poll failure')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if not args.verbose:
+        logging.getLogger(poller.__name__).setLevel(logging.ERROR)
+
+    config = load_config(args.config)
+    if args.listen:
+        config["listen"] = args.listen
+    if args.workers:
+        config["workers"] = max(1, args.workers)
+    try:
+        asyncio.run(async_main(config, args.verbose))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 import os  # for filename extraction
+import time
+
+from _integration import load_integration_module
+
+snapshot = load_integration_module("snapshot")
 
 # First register map (your original)
 REGISTER_MAP_1 = {
@@ -400,6 +405,24 @@ REGISTER_MAPS = {
     "Timer": REGISTER_MAP_2,
 }
 
+# Map names indexed by the device type stored in snapshots
+DEVICE_TYPE_MAP_NAMES = ["Thermostat", "Timer"]
+
+def describe_snapshot(snap):
+    """One line summary of where and when a snapshot came from."""
+    details = []
+    if snap.host is not None:
+        details.append(f"{snap.host} unit {snap.unit_id}")
+    if snap.device_type is not None:
+        details.append(DEVICE_TYPE_MAP_NAMES[snap.device_type])
+    if snap.firmware is not None:
+        details.append(f"firmware {snap.firmware}")
+    if snap.timestamp is not None:
+        details.append(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snap.timestamp)))
+    if snap.extra.get("legacy"):
+        details.append("legacy text backup")
+    return ", ".join(details)
+
 def decode_registers(values, register_map):
     decoded = []
     for i, val in enumerate(values, start=1):
@@ -408,30 +431,121 @@ def decode_registers(values, register_map):
     return "\n".join(decoded)
 
 def load_file():
-    filepath = filedialog.askopenfilename(filetypes=[("Text Files", "*.txt")])
+    filepath = filedialog.askopenfilename(filetypes=[
+        ("Backups", f"*{snapshot.FILE_EXTENSION} *{snapshot.LEGACY_FILE_EXTENSION}"),
+        ("All Files", "*"),
+    ])
     if not filepath:
         return
 
     try:
-        with open(filepath, "r") as f:
-            content = f.read()
-            raw_values = [v.strip() for v in content.strip().split(",") if v.strip()]
-            values = list(map(int, raw_values))
+        snap = snapshot.read_snapshot(filepath)
 
+        # Snapshots know what kind of device they came from, legacy files rely on the dropdown
+        if snap.device_type is not None and not snap.extra.get("legacy"):
+            map_var.set(DEVICE_TYPE_MAP_NAMES[snap.device_type])
         selected_map_name = map_var.get()
         selected_map = REGISTER_MAPS[selected_map_name]
 
-        result = decode_registers(values, selected_map)
+        result = decode_registers(snap.registers, selected_map)
         output_area.delete("1.0", tk.END)
         output_area.insert(tk.END, result)
 
         filename = os.path.basename(filepath)
-        file_label.config(text=f"Loaded file: {filename}")
+        file_label.config(text=f"Loaded file: {filename} ({describe_snapshot(snap)})")
 
     except Exception as e:
         messagebox.showerror("Error", f"Failed to load file:\n{e}")
         file_label.config(text="")  # Clear label on error
 
+SNAPSHOT_FILETYPES = [
+    ("Backups", f"*{snapshot.FILE_EXTENSION} *{snapshot.LEGACY_FILE_EXTENSION}"),
+    ("All Files", "*"),
+]
+
+def format_differences(reference, others, register_map):
+    """Describe how each (name, snapshot) in others differs from the reference snapshot.
+
+    Only files with differences are listed, each changed register shown with its label.
+    """
+    differences = snapshot.diff_registers(reference, [snap for _, snap in others])
+    lines = []
+    identical = 0
+    register_counts = {}
+    for (name, snap), registers in zip(others, differences):
+        if not registers:
+            identical += 1
+            continue
+        lines.append(f"{name} ({describe_snapshot(snap)}): {len(registers)} registers differ")
+        for register in registers:
+            label = register_map.get(register + 1, f"Register {register + 1}")
+            lines.append(f"    {register + 1:03}: {label} = {reference.registers[register]} -> {snap.registers[register] if register < len(snap.registers) else None}")
+            register_counts[register] = register_counts.get(register, 0) + 1
+        lines.append("")
+
+    summary = [f"Compared {len(others)} snapshots: {identical} identical, {len(others) - identical} different"]
+    if register_counts:
+        most_common = sorted(register_counts.items(), key=lambda item: (-item[1], item[0]))[:10]
+        summary.append("Most often changed: " + ", ".join(
+            f"{register + 1:03} {register_map.get(register + 1, '')} ({count})" for register, count in most_common
+        ))
+    return "\n".join(summary + [""] + lines)
+
+def load_reference():
+    """Ask for the reference snapshot, returning it (and setting the register map from it) or None."""
+    filepath = filedialog.askopenfilename(title="Reference snapshot", filetypes=SNAPSHOT_FILETYPES)
+    if not filepath:
+        return None
+    reference = snapshot.read_snapshot(filepath)
+    if reference.device_type is not None and not reference.extra.get("legacy"):
+        map_var.set(DEVICE_TYPE_MAP_NAMES[reference.device_type])
+    return os.path.basename(filepath), reference
+
+def show_comparison(reference_name, reference, paths):
+    others = []
+    unreadable = []
+    for path in paths:
+        try:
+            others.append((os.path.basename(path), snapshot.read_snapshot(path)))
+        except (OSError, snapshot.SnapshotError) as e:
+            unreadable.append(f"{os.path.basename(path)}: {e}")
+
+    result = format_differences(reference, others, REGISTER_MAPS[map_var.get()])
+    if unreadable:
+        result += "\nCould not read:\n" + "\n".join(unreadable)
+    output_area.delete("1.0", tk.END)
+    output_area.insert(tk.END, result)
+    file_label.config(text=f"Compared against: {reference_name} ({describe_snapshot(reference)})")
+
+def compare_files():
+    try:
+        loaded = load_reference()
+        if loaded is None:
+            return
+        paths = filedialog.askopenfilenames(title="Snapshots to compare", filetypes=SNAPSHOT_FILETYPES)
+        if not paths:
+            return
+        show_comparison(*loaded, paths)
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to compare files:\n{e}")
+
+def compare_directory():
+    try:
+        loaded = load_reference()
+        if loaded is None:
+            return
+        directory = filedialog.askdirectory(title="Folder of snapshots to compare")
+        if not directory:
+            return
+        extensions = (snapshot.FILE_EXTENSION, snapshot.LEGACY_FILE_EXTENSION)
+        paths = sorted(
+            os.path.join(directory, f) for f in os.listdir(directory)
+            if f.endswith(extensions) and f != loaded[0]
+        )
+        show_comparison(*loaded, paths)
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to compare folder:\n{e}")
+
 # UI setup
 root = tk.Tk()
 root.title("Modbus Register Decoder")
@@ -442,7 +556,7 @@ root.columnconfigure(0, weight=1)
 
 frame = tk.Frame(root, padx=10, pady=10)
 frame.grid(sticky="nsew")  # use grid for better control
-frame.rowconfigure(4, weight=1)  # output_area is row 4, make it expand vertically
+frame.rowconfigure(5, weight=1)  # output_area is row 5, make it expand vertically
 frame.columnconfigure(0, weight=1)
 
 # Dropdown to select map
@@ -453,13 +567,20 @@ map_menu.grid(row=0, column=0, sticky="ew", pady=5)
 load_btn = tk.Button(frame, text="Load Register File", command=load_file)
 load_btn.grid(row=1, column=0, sticky="ew", pady=5)
 
+compare_frame = tk.Frame(frame)
+compare_frame.grid(row=2, column=0, sticky="ew", pady=5)
+compare_frame.columnconfigure(0, weight=1)
+compare_frame.columnconfigure(1, weight=1)
+tk.Button(compare_frame, text="Compare Files...", command=compare_files).grid(row=0, column=0, sticky="ew", padx=(0, 2))
+tk.Button(compare_frame, text="Compare Folder...", command=compare_directory).grid(row=0, column=1, sticky="ew", padx=(2, 0))
+
 file_label = tk.Label(frame, text="No file loaded")
-file_label.grid(row=2, column=0, sticky="w", pady=5)
+file_label.grid(row=3, column=0, sticky="w", pady=5)
 
 # Spacer row to separate label and output area (optional)
-frame.rowconfigure(3, minsize=5)
+frame.rowconfigure(4, minsize=5)
 
 output_area = scrolledtext.ScrolledText(frame, wrap=tk.WORD)
-output_area.grid(row=4, column=0, sticky="nsew", pady=5)
+output_area.grid(row=5, column=0, sticky="nsew", pady=5)
 
 root.mainloop()
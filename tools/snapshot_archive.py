@@ -0,0 +1,325 @@
+"""Archive of register snapshots in a single SQLite database.
+
+Snapshots are split into blocks of BLOCK_SIZE registers. Each block is stored once,
+keyed by the hash of its contents, so nightly backups of devices that rarely change
+take up very little space. Snapshots are indexed by device, timestamp and firmware,
+which lets questions like "history of register 34 on device X" be answered by only
+decoding the (few) distinct blocks that register has ever been in.
+
+Usage:
+    python tools/snapshot_archive.py archive.db import backups/*.hmsnap
+    python tools/snapshot_archive.py archive.db list --device 192.168.1.50:3
+    python tools/snapshot_archive.py archive.db history 192.168.1.50:3 34
+    python tools/snapshot_archive.py archive.db template winter backups/reference.hmsnap
+    python tools/snapshot_archive.py archive.db drift winter
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import time
+
+from _integration import load_integration_module
+
+const = load_integration_module("const")
+snapshot = load_integration_module("snapshot")
+
+BLOCK_SIZE = 10  # Same as the largest read, and lines up with the start of the schedule area (50)
+_BLOCK_VALUES = struct.Struct(f">H{BLOCK_SIZE}H")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    hash BLOB PRIMARY KEY,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    firmware INTEGER,
+    device_type INTEGER,
+    register_count INTEGER NOT NULL,
+    header TEXT NOT NULL,
+    UNIQUE (device, timestamp)
+);
+CREATE INDEX IF NOT EXISTS snapshots_device_time ON snapshots (device, timestamp);
+CREATE INDEX IF NOT EXISTS snapshots_firmware ON snapshots (firmware, device);
+CREATE TABLE IF NOT EXISTS snapshot_blocks (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    block INTEGER NOT NULL,
+    hash BLOB NOT NULL REFERENCES blocks (hash),
+    PRIMARY KEY (snapshot_id, block)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS snapshot_blocks_hash ON snapshot_blocks (block, hash);
+CREATE TABLE IF NOT EXISTS templates (
+    name TEXT PRIMARY KEY,
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id)
+);
+"""
+
+
+def encode_block(values):
+    """Pack up to BLOCK_SIZE values (None for missing) as a presence mask followed by uint16s."""
+    mask = 0
+    packed = []
+    for index in range(BLOCK_SIZE):
+        value = values[index] if index < len(values) else None
+        if value is not None:
+            mask |= 1 << index
+        packed.append(0 if value is None else int(value))
+    return _BLOCK_VALUES.pack(mask, *packed)
+
+
+def decode_block(data):
+    mask, *values = _BLOCK_VALUES.unpack(data)
+    return [value if mask & (1 << index) else None for index, value in enumerate(values)]
+
+
+def block_hash(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def device_key(host, unit_id):
+    return f"{host}:{unit_id}"
+
+
+_FILENAME_DEVICE = re.compile(r"heatmiser_backup_(?P<host>[0-9_]+?)_(?P<unit>\d+)_(?P<timestamp>\d{8}_\d{6})")
+
+
+def device_from_filename(file_path):
+    """Work out the device and time of a backup from the default filename, for legacy files without a header."""
+    match = _FILENAME_DEVICE.search(os.path.basename(file_path))
+    if not match:
+        return None, None
+    host = match.group("host").replace("_", ".")
+    timestamp = time.mktime(time.strptime(match.group("timestamp"), "%Y%m%d_%H%M%S"))
+    return device_key(host, int(match.group("unit"))), timestamp
+
+
+class SnapshotArchive:
+    """A SQLite database of deduplicated snapshots."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+        self._block_cache = {}
+
+    def close(self):
+        self.db.close()
+
+    def add(self, snap, device=None):
+        """Add a snapshot, returning its id (the existing id if it's already in the archive)."""
+        device = device or device_key(snap.host, snap.unit_id)
+        timestamp = snap.timestamp if snap.timestamp is not None else time.time()
+        with self.db:
+            existing = self.db.execute(
+                "SELECT id FROM snapshots WHERE device = ? AND timestamp = ?", (device, timestamp)
+            ).fetchone()
+            if existing:
+                return existing[0]
+            cursor = self.db.execute(
+                "INSERT INTO snapshots (device, timestamp, firmware, device_type, register_count, header) VALUES (?, ?, ?, ?, ?, ?)",
+                (device, timestamp, snap.firmware, snap.device_type, len(snap.registers), json.dumps(snap.header())),
+            )
+            snapshot_id = cursor.lastrowid
+            rows = []
+            for block, start in enumerate(range(0, len(snap.registers), BLOCK_SIZE)):
+                data = encode_block(snap.registers[start:start + BLOCK_SIZE])
+                digest = block_hash(data)
+                self.db.execute("INSERT OR IGNORE INTO blocks (hash, data) VALUES (?, ?)", (digest, data))
+                rows.append((snapshot_id, block, digest))
+            self.db.executemany("INSERT INTO snapshot_blocks (snapshot_id, block, hash) VALUES (?, ?, ?)", rows)
+        return snapshot_id
+
+    def _block(self, digest):
+        if digest not in self._block_cache:
+            (data,) = self.db.execute("SELECT data FROM blocks WHERE hash = ?", (digest,)).fetchone()
+            self._block_cache[digest] = decode_block(data)
+        return self._block_cache[digest]
+
+    def load(self, snapshot_id):
+        """Rebuild a full snapshot from its blocks."""
+        row = self.db.execute("SELECT header, register_count FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No snapshot with id {snapshot_id}")
+        header, register_count = row
+        registers = []
+        for (digest,) in self.db.execute(
+            "SELECT hash FROM snapshot_blocks WHERE snapshot_id = ? ORDER BY block", (snapshot_id,)
+        ):
+            registers.extend(self._block(digest))
+        return snapshot.Snapshot.from_dict({**json.loads(header), "registers": registers[:register_count]})
+
+    def list(self, device=None, firmware=None):
+        query = "SELECT id, device, timestamp, firmware, device_type FROM snapshots WHERE 1 = 1"
+        params = []
+        if device is not None:
+            query += " AND device = ?"
+            params.append(device)
+        if firmware is not None:
+            query += " AND firmware = ?"
+            params.append(firmware)
+        return self.db.execute(query + " ORDER BY device, timestamp", params).fetchall()
+
+    def history(self, device, register, changes_only=True):
+        """Yield (timestamp, value) for a register across every snapshot of a device.
+
+        Only the blocks containing the register are looked at, and each distinct block is decoded once.
+        """
+        block, offset = divmod(register, BLOCK_SIZE)
+        previous = object()
+        for timestamp, digest in self.db.execute(
+            "SELECT s.timestamp, sb.hash FROM snapshots s "
+            "JOIN snapshot_blocks sb ON sb.snapshot_id = s.id AND sb.block = ? "
+            "WHERE s.device = ? ORDER BY s.timestamp",
+            (block, device),
+        ):
+            value = self._block(digest)[offset]
+            if not changes_only or value != previous:
+                yield timestamp, value
+            previous = value
+
+    def set_template(self, name, snapshot_id):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO templates (name, snapshot_id) VALUES (?, ?)", (name, snapshot_id))
+
+    def latest_snapshots(self):
+        """Return {device: snapshot id} for the newest snapshot of every device."""
+        return dict(self.db.execute(
+            "SELECT device, id FROM snapshots s WHERE timestamp = "
+            "(SELECT MAX(timestamp) FROM snapshots WHERE device = s.device)"
+        ).fetchall())
+
+    def drift(self, template_name):
+        """Return {device: [differing registers]} for every device whose latest schedule differs from the template.
+
+        Only devices of the same type as the template are compared. Blocks that are identical to
+        the template's are skipped by comparing hashes in SQL, so only differing blocks are decoded.
+        """
+        row = self.db.execute(
+            "SELECT t.snapshot_id, s.device_type FROM templates t JOIN snapshots s ON s.id = t.snapshot_id WHERE t.name = ?",
+            (template_name,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"No template called {template_name}")
+        template_id, device_type = row
+        start = const.SCHEDULE_START_REGISTER
+        end = start + const.SCHEDULE_REGISTER_COUNT[device_type] - 1
+        first_block, last_block = start // BLOCK_SIZE, end // BLOCK_SIZE
+
+        differing = {}
+        for device, snapshot_id in self.latest_snapshots().items():
+            if snapshot_id == template_id:
+                continue
+            (this_type,) = self.db.execute("SELECT device_type FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+            if this_type != device_type:
+                continue
+            rows = self.db.execute(
+                "SELECT sb.block, sb.hash, tb.hash FROM snapshot_blocks sb "
+                "JOIN snapshot_blocks tb ON tb.snapshot_id = ? AND tb.block = sb.block "
+                "WHERE sb.snapshot_id = ? AND sb.block BETWEEN ? AND ? AND sb.hash != tb.hash",
+                (template_id, snapshot_id, first_block, last_block),
+            ).fetchall()
+            registers = []
+            for block, digest, template_digest in rows:
+                for offset, (value, expected) in enumerate(zip(self._block(digest), self._block(template_digest))):
+                    register = block * BLOCK_SIZE + offset
+                    if start <= register <= end and value != expected:
+                        registers.append(register)
+            if registers:
+                differing[device] = registers
+        return differing
+
+
+def _format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def import_files(archive, files, device=None):
+    imported = 0
+    for file_path in files:
+        try:
+            snap = snapshot.read_snapshot(file_path)
+        except (OSError, snapshot.SnapshotError) as ex:
+            print(f"Skipping {file_path}: {ex}")
+            continue
+        snap_device = device
+        if snap_device is None and snap.host is None:
+            snap_device, timestamp = device_from_filename(file_path)
+            if snap_device is None:
+                print(f"Skipping {file_path}: can't tell which device it's from, use --device")
+                continue
+            snap.timestamp = timestamp
+        archive.add(snap, snap_device)
+        imported += 1
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heatmiser Edge snapshot archive")
+    parser.add_argument("database", help="SQLite archive file (created if it doesn't exist)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Add snapshot files to the archive")
+    import_parser.add_argument("files", nargs="+")
+    import_parser.add_argument("--device", help="Device (host:unit) for files that don't record it")
+
+    list_parser = commands.add_parser("list", help="List snapshots")
+    list_parser.add_argument("--device")
+    list_parser.add_argument("--firmware", type=int)
+
+    history_parser = commands.add_parser("history", help="Show how a register has changed on a device")
+    history_parser.add_argument("device", help="host:unit")
+    history_parser.add_argument("register", type=int)
+    history_parser.add_argument("--all", action="store_true", help="Show every snapshot, not just changes")
+
+    template_parser = commands.add_parser("template", help="Save a snapshot (file or archive id) as a named template")
+    template_parser.add_argument("name")
+    template_parser.add_argument("source", help="Snapshot file, or id of a snapshot already in the archive")
+
+    drift_parser = commands.add_parser("drift", help="List devices whose latest schedule differs from a template")
+    drift_parser.add_argument("template")
+
+    export_parser = commands.add_parser("export", help="Write a snapshot from the archive to a file")
+    export_parser.add_argument("snapshot_id", type=int)
+    export_parser.add_argument("file")
+
+    args = parser.parse_args()
+    archive = SnapshotArchive(args.database)
+    try:
+        if args.command == "import":
+            started = time.monotonic()
+            imported = import_files(archive, args.files, args.device)
+            print(f"Imported {imported} of {len(args.files)} files in {time.monotonic() - started:.2f}s")
+        elif args.command == "list":
+            for snapshot_id, device, timestamp, firmware, device_type in archive.list(args.device, args.firmware):
+                print(f"{snapshot_id:6}  {device:24}  {_format_time(timestamp)}  firmware {firmware}  type {device_type}")
+        elif args.command == "history":
+            for timestamp, value in archive.history(args.device, args.register, changes_only=not args.all):
+                print(f"{_format_time(timestamp)}  {value}")
+        elif args.command == "template":
+            if os.path.exists(args.source):
+                snap = snapshot.read_snapshot(args.source)
+                snapshot_id = archive.add(snap, None if snap.host else f"template:{args.name}")
+            else:
+                snapshot_id = int(args.source)
+            archive.set_template(args.name, snapshot_id)
+            print(f"Template {args.name} set to snapshot {snapshot_id}")
+        elif args.command == "drift":
+            differing = archive.drift(args.template)
+            for device, registers in sorted(differing.items()):
+                print(f"{device:24}  {len(registers)} registers differ: {', '.join(map(str, registers))}")
+            print(f"{len(differing)} devices differ from {args.template}")
+        elif args.command == "export":
+            snapshot.write_snapshot(args.file, archive.load(args.snapshot_id))
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()